@@ -0,0 +1,115 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+In-process fake of the parts of SyPy used by the engine
+
+Every call sleeps for a configurable latency to simulate the round trip to
+SynthEyes. install() registers the fake as the SyPy module, so it has to
+be called before anything imports syntheyes.
+"""
+import random
+import sys
+import time
+import types
+
+# artificial round trip latency of every call in seconds
+latency = 0.0
+# artificial extra latency of opening a connection in seconds
+open_latency = 0.0
+
+
+def _round_trip():
+    if latency:
+        time.sleep(latency)
+
+
+class FakeCore(object):
+    def __init__(self, level):
+        self._level = level
+
+    def OK(self):
+        _round_trip()
+        return self._level.connected
+
+
+class FakeObject(object):
+    def __init__(self, name, kind):
+        self.nm = name
+        self.kind = kind
+
+    def Name(self):
+        _round_trip()
+        return self.nm
+
+
+class SyLevel(object):
+    def __init__(self):
+        self.connected = False
+        self.core = FakeCore(self)
+        self.scene_file = ""
+        self.frame = 0
+        self._cameras = [FakeObject("Camera01", "Camera")]
+        self._trackers = [FakeObject("Tracker%d" % i, "Tracker")
+                          for i in range(100)]
+
+    def OpenExisting(self, port, pin):
+        if open_latency:
+            time.sleep(open_latency)
+        _round_trip()
+        self.connected = True
+
+    def Close(self):
+        self.connected = False
+
+    def OpenSNI(self, path):
+        _round_trip()
+        self.scene_file = path
+
+    def SNIFileName(self):
+        _round_trip()
+        return self.scene_file
+
+    def Cameras(self):
+        _round_trip()
+        return list(self._cameras)
+
+    def Trackers(self):
+        _round_trip()
+        return list(self._trackers)
+
+    def Frame(self):
+        _round_trip()
+        return self.frame
+
+    def SetFrame(self, frame):
+        _round_trip()
+        self.frame = frame
+
+
+class syconfig(object):
+    @staticmethod
+    def RandomPort(low, high):
+        return random.randint(low, high)
+
+    @staticmethod
+    def RandomPin():
+        return "%06d" % random.randint(0, 999999)
+
+
+def install():
+    """
+    Registers this module as SyPy
+    """
+    module = types.ModuleType("SyPy")
+    module.SyLevel = SyLevel
+    module.syconfig = syconfig
+    sys.modules["SyPy"] = module
+    return module
@@ -0,0 +1,339 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Benchmarks of the engine's hot paths against a fake SyPy
+
+Usage:
+    python benchmarks/run_benchmarks.py [--latency SECONDS]
+                                        [--open-latency SECONDS]
+                                        [--baseline FILE] [--save-baseline]
+                                        [--tolerance FRACTION]
+                                        [--repeat COUNT]
+                                        [BENCHMARK ...]
+
+Every benchmark runs once to warm up, then repeat times; the median of the
+timed runs is its result. Results are compared against the stored baseline
+and the script exits with a non zero code if any benchmark got slower than
+the tolerance allows. The default tolerance is above the run to run noise
+measured on the baseline machine, about 35%.
+
+The baseline records the machine and versions it was measured with. On
+another setup results aren't comparable, regressions are only reported as
+warnings then; save a baseline per machine.
+"""
+import json
+import logging
+import optparse
+import os
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, "..", "python"))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import fake_sypy
+fake_sypy.install()
+
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+DEFAULT_REPEAT = 11
+# above the run to run noise of about 35% on the baseline machine
+DEFAULT_TOLERANCE = 0.5
+
+g_app = None
+g_benchmarks = []
+
+
+def benchmark(ops):
+    """
+    Registers a benchmark function running ops operations per call
+    """
+    def register(fn):
+        g_benchmarks.append((fn.__name__, ops, fn))
+        return fn
+    return register
+
+
+def process_events_until(predicate, timeout=60.0):
+    from PySide import QtCore
+    end = time.time() + timeout
+    while not predicate():
+        QtCore.QCoreApplication.processEvents()
+        if time.time() > end:
+            raise RuntimeError("Timed out waiting for events")
+
+
+################################################################################
+# SyPy connection
+
+@benchmark(ops=100)
+def connection_open(ops):
+    from syntheyes import get_existing_connection
+    for _ in range(ops):
+        get_existing_connection()
+
+
+@benchmark(ops=100)
+def heartbeat(ops):
+    # the work done by one cycle of heartbeat.heartbeat_thread_run
+    from syntheyes import get_existing_connection
+    for _ in range(ops):
+        get_existing_connection().core.OK()
+
+
+@benchmark(ops=1000)
+def sypy_call(ops):
+    from syntheyes import get_existing_connection
+    hlev = get_existing_connection()
+    for _ in range(ops):
+        hlev.Frame()
+
+
+################################################################################
+# UI
+
+class _FakeApp(object):
+    def __init__(self, engine, index):
+        self.engine = engine
+        self.instance_name = "tk-multi-app%d" % (index % 10)
+        self.display_name = "App %d" % (index % 10)
+        self.documentation_url = None
+
+
+class _FakeContext(object):
+    shotgun_url = "https://example.shotgunstudio.com/detail/Shot/1"
+    filesystem_locations = []
+    entity = {"type": "Shot", "id": 1, "name": "sh010"}
+
+
+class _FakeEngine(object):
+    name = "tk-syntheyes"
+
+    def __init__(self, ui, command_count, settings=None):
+        self.ui = ui
+        self.context = _FakeContext()
+        self.settings = settings or {}
+        self.commands = {}
+        self.apps = {}
+        for index in range(command_count):
+            app = _FakeApp(self, index)
+            self.apps[app.instance_name] = app
+            self.commands["Command %d" % index] = {
+                "callback": lambda: None,
+                "properties": {"app": app, "type": "default"}}
+
+    def get_setting(self, name, default=None):
+        return self.settings.get(name, default)
+
+    def log_debug(self, msg, *args, **kwargs):
+        pass
+
+    log_info = log_warning = log_error = log_exception = log_debug
+
+
+def _populate(ops, command_count, settings=None):
+    from tk_syntheyes.panel_generation import PanelGenerator
+    from tk_syntheyes.ui.sgtk_panel import Ui_SgtkPanel
+    ui = Ui_SgtkPanel()
+    generator = PanelGenerator(_FakeEngine(ui, command_count, settings))
+    for _ in range(ops):
+        generator.populate_panel()
+    generator.destroy_panel()
+
+
+@benchmark(ops=20)
+def populate_panel(ops):
+    # below the command_palette_threshold, a button per command
+    _populate(ops, 50)
+
+
+@benchmark(ops=20)
+def populate_palette(ops):
+    _populate(ops, 200, {"command_palette_threshold": 20})
+
+
+@benchmark(ops=2000)
+def log_handler(ops):
+    from PySide import QtGui
+    from tk_syntheyes.logging_console import QtLogHandler
+    widget = QtGui.QPlainTextEdit()
+    handler = QtLogHandler(widget)
+    logger = logging.getLogger("benchmark.log_handler")
+    logger.propagate = False
+    logger.addHandler(handler)
+    for index in range(ops):
+        logger.warning("Benchmark message %d", index)
+    process_events_until(lambda: widget.blockCount() >= ops)
+    logger.removeHandler(handler)
+
+
+@benchmark(ops=10000)
+def send_to_main_thread(ops):
+    from syntheyes import callback_event
+    done = [0]
+
+    def callback():
+        done[0] += 1
+    callback._tkLog = False
+
+    for _ in range(ops):
+        callback_event.send_to_main_thread(callback)
+    process_events_until(lambda: done[0] >= ops)
+
+
+################################################################################
+# runner
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def run(names=None, repeat=DEFAULT_REPEAT):
+    """
+    Runs the benchmarks and returns a dict of name -> seconds per operation,
+    the median of repeat runs after a warm-up run
+    """
+    results = {}
+    for name, ops, fn in g_benchmarks:
+        if names and name not in names:
+            continue
+        # fills caches and imports modules, not measured
+        fn(ops)
+        timings = []
+        for _ in range(max(1, repeat)):
+            start = time.time()
+            fn(ops)
+            timings.append(time.time() - start)
+        results[name] = _median(timings) / ops
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints results next to the baseline and returns the names of the
+    benchmarks that regressed
+    """
+    regressions = []
+    print "%-22s %14s %14s %8s" % ("benchmark", "per op", "baseline",
+                                   "change")
+    for name in sorted(results):
+        value = results[name]
+        reference = baseline.get(name)
+        if reference:
+            change = (value - reference) / reference
+            flag = ""
+            if change > tolerance:
+                regressions.append(name)
+                flag = "  REGRESSION"
+            print "%-22s %12.2fus %12.2fus %+7.1f%%%s" % (
+                name, value * 1e6, reference * 1e6, change * 100, flag)
+        else:
+            print "%-22s %12.2fus %14s" % (name, value * 1e6, "-")
+    return regressions
+
+
+def environment():
+    """
+    Describes what the results were measured with. Results of different
+    environments can't be compared.
+    """
+    import platform
+    from PySide import QtCore
+    return {"python": platform.python_version(),
+            "qt": QtCore.qVersion(),
+            "platform": platform.platform(),
+            "machine": platform.node()}
+
+
+def _run_headless():
+    """
+    Qt 4 on Linux needs an X server, QT_QPA_PLATFORM only works from Qt 5 on.
+    Re-runs the script in a virtual X server if there is no display. Returns
+    the exit code of that run or None to run in this process.
+    """
+    from PySide import QtCore
+    if (not sys.platform.startswith("linux") or os.environ.get("DISPLAY") or
+            not QtCore.qVersion().startswith("4.")):
+        return None
+    import distutils.spawn
+    import subprocess
+    if not distutils.spawn.find_executable("xvfb-run"):
+        print "No display and no xvfb-run to run Qt 4 headless"
+        return 1
+    return subprocess.call(["xvfb-run", "-a", sys.executable] + sys.argv)
+
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__.strip())
+    parser.add_option("--latency", type="float", default=0.0,
+                      help="artificial latency of every SyPy call in seconds")
+    parser.add_option("--open-latency", type="float", default=0.0,
+                      help="artificial extra latency of opening a SyPy "
+                           "connection in seconds")
+    parser.add_option("--baseline", default=DEFAULT_BASELINE)
+    parser.add_option("--save-baseline", action="store_true", default=False)
+    parser.add_option("--tolerance", type="float", default=DEFAULT_TOLERANCE,
+                      help="allowed slowdown against the baseline")
+    parser.add_option("--repeat", type="int", default=DEFAULT_REPEAT,
+                      help="timed runs per benchmark, the median is used")
+    options, names = parser.parse_args()
+
+    global g_app
+    # Qt 5 builds run headless with the offscreen platform
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    exit_code = _run_headless()
+    if exit_code is not None:
+        return exit_code
+
+    os.environ["SGTK_SYNTHEYES_PORT"] = "59200"
+    os.environ["SGTK_SYNTHEYES_PIN"] = "000000"
+    fake_sypy.latency = options.latency
+    fake_sypy.open_latency = options.open_latency
+
+    from PySide import QtGui
+    g_app = QtGui.QApplication(sys.argv)
+
+    results = run(names, options.repeat)
+
+    baseline = {}
+    if os.path.exists(options.baseline):
+        with open(options.baseline) as file_:
+            baseline = json.load(file_)
+    measured_with = baseline.pop("_environment", None)
+    comparable = not measured_with or measured_with == environment()
+    if not comparable:
+        print "The baseline was measured with %s" % ", ".join(
+            "%s %s" % item for item in sorted(measured_with.items()))
+    regressions = compare(results, baseline, options.tolerance)
+
+    if options.save_baseline:
+        baseline.update(results)
+        baseline["_environment"] = environment()
+        with open(options.baseline, "w") as file_:
+            json.dump(baseline, file_, indent=4, sort_keys=True)
+        print "Saved baseline to %s" % options.baseline
+        return 0
+
+    if regressions and not comparable:
+        print "Warning, slower than a baseline of another setup: %s" % \
+            ", ".join(regressions)
+    elif regressions:
+        print "Regressions: %s" % ", ".join(regressions)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
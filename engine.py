@@ -14,16 +14,33 @@ A SynthEyes engine for Toolkit.
 import logging
 import os
 import sys
+import time
 
 import sgtk
 
 from syntheyes import get_existing_connection
+from syntheyes import metrics
+from syntheyes import sessions
+from syntheyes import tasks
+from syntheyes import tracing
+from syntheyes import transfer
+
+
+def _bundle_name(bundle):
+    """
+    Returns the name of a bundle for metric labels. Dialog titles are free
+    text and would give a label value per title.
+    """
+    return getattr(bundle, "name", None) or "unknown"
 
 
 ################################################################################
 # The Toolkit SynthEyes engine
 class SyntheyesEngine(sgtk.platform.Engine):
     _logger = logging.getLogger('sgtk.syntheyes.engine')
+    _dialog_open_seconds = metrics.g_registry.histogram(
+        "syntheyes_dialog_open_seconds",
+        "Time to create and show an app dialog")
 
     ############################################################################
     # init and destroy
@@ -31,23 +48,188 @@ class SyntheyesEngine(sgtk.platform.Engine):
         self._init_logging()
         self.log_debug("%s: Initializing...", self)
         self.__qt_dialogs = []
+        # created in post_app_init
+        self._panel_generator = None
+        self._broker = None
+        self._dialog_prewarmer = None
+        self._plate_prefetcher = None
 
     def pre_app_init(self):
         from tk_syntheyes.ui.sgtk_panel import Ui_SgtkPanel
         # Alternative way of starting the panel but it would be too big for now
         # self.ui = self.show_dialog('SGTK Panel', self, Ui_SgtkPanel)
-        self.ui = Ui_SgtkPanel(self._get_dialog_parent())
+        self.ui = Ui_SgtkPanel(self._get_dialog_parent(),
+                               session=sessions.g_sessions.active())
 
     def post_app_init(self):
         import tk_syntheyes
+
+        # warm the Shotgun cache for the context before apps ask for it
+        self.shotgun_cache = tk_syntheyes.ShotgunCache(
+            self, self.get_setting("shotgun_cache_ttl", 3600))
+        self.shotgun_cache.prefetch(self.get_setting("shotgun_prefetch", []))
+
         self._initialize_dark_look_and_feel()
         self._panel_generator = tk_syntheyes.PanelGenerator(self)
         self._panel_generator.populate_panel()
+        tasks.g_executor.add_busy_listener(self._set_busy)
         self.ui.show()
+        import launch_timeline
+        launch_timeline.ready()
+
+        # serve further or restarted SynthEyes sessions from this backend
+        sessions.g_sessions.add_closed_listener(self._session_closed)
+        if sessions.broker_enabled():
+            self._broker = sessions.SessionBroker(self._accept_session)
+            self._broker.start()
+
+        # build the most used dialogs while SynthEyes is idle
+        self._dialog_prewarmer = tk_syntheyes.DialogPrewarmer(
+            self, self.get_setting("prewarm_dialogs", 0))
+        self._dialog_prewarmer.start()
+
+        tasks.g_executor.add_queue(transfer.QUEUE,
+                                   self.get_setting("transfer_threads", 8))
+
+        # read the context's plates before SynthEyes needs them
+        self._plate_prefetcher = tk_syntheyes.PlatePrefetcher(self)
+        self._plate_prefetcher.start()
+
+        # growth of the memory is measured from the loaded engine on
+        from syntheyes import memory
+        if memory.g_monitor:
+            memory.g_monitor.add_counter("Retained dialogs",
+                                         lambda: len(self.__qt_dialogs))
+            memory.g_monitor.set_baseline_later()
+
+    def post_context_change(self, old_context, new_context):
+        # the plates of the old context are not needed anymore
+        if self._plate_prefetcher:
+            self._plate_prefetcher.start()
+        # prewarmed dialogs belong to the apps and the context of the old
+        # environment and would never be taken
+        if self._dialog_prewarmer:
+            self._dialog_prewarmer.stop()
+            self._dialog_prewarmer.start()
 
     def destroy_engine(self):
         self.log_debug("%s: Destroying...", self)
-        self._panel_generator.destroy_panel()
+        # post_app_init may not have run or failed half way
+        for service in (self._dialog_prewarmer, self._plate_prefetcher,
+                        self._broker):
+            if service:
+                service.stop()
+        tasks.g_executor.cancel()
+        for session in sessions.g_sessions.all():
+            if session.panel_generator:
+                session.panel_generator.destroy_panel()
+        if self._panel_generator:
+            self._panel_generator.destroy_panel()
+
+    ############################################################################
+    # sessions
+
+    def _accept_session(self, request):
+        """
+        Serves a SynthEyes session handed over by another backend. Returns
+        None if it was accepted, otherwise the reason for refusing it.
+        """
+        if sessions.g_sessions.all() and not sessions.multi_session_enabled():
+            return "serving another session"
+        if request.get("engine") != self.name:
+            return "different engine %s" % request.get("engine")
+        try:
+            context = sgtk.context.deserialize(request.get("context"))
+        except Exception as e:
+            return "invalid context: %s" % e
+        if context != self.context:
+            return "different context %s" % context
+
+        import tk_syntheyes
+        from tk_syntheyes.ui.sgtk_panel import Ui_SgtkPanel
+        session = sessions.Session(request["port"], request["pin"])
+        if self.ui.session not in sessions.g_sessions.all():
+            # the SynthEyes of the main panel is gone, re-attach the panel
+            self.ui.session = session
+            panel = self.ui
+        else:
+            session.ui = Ui_SgtkPanel(self._get_dialog_parent(),
+                                      session=session)
+            session.ui.setWindowTitle("SGTK Panel (%d)" % session.port)
+            session.panel_generator = tk_syntheyes.PanelGenerator(self,
+                                                                  session.ui)
+            session.panel_generator.populate_panel()
+            panel = session.ui
+        sessions.g_sessions.add(session)
+        sessions.g_sessions.activate(session)
+
+        from syntheyes import heartbeat
+        heartbeat.setup(session)
+        panel.show()
+        import launch_timeline
+        launch_timeline.ready(request.get("timeline"))
+
+        file_to_open = request.get("file_to_open")
+        if file_to_open:
+            self.submit_task(self._open_file, file_to_open, session=session,
+                             name="Open %s" % file_to_open)
+        return None
+
+    def _open_file(self, task, path):
+        hlev = get_existing_connection()
+        hlev.OpenSNI(path)
+
+    def _session_closed(self, session, remaining):
+        if session.panel_generator:
+            session.panel_generator.destroy_panel()
+            session.panel_generator = None
+        elif self.ui.session is session:
+            # SynthEyes of the primary panel is gone, others are still open
+            self.ui.hide()
+
+    def _set_busy(self, command, busy):
+        self.ui.set_busy(command, busy)
+        for session in sessions.g_sessions.all():
+            if session.ui:
+                session.ui.set_busy(command, busy)
+
+    ############################################################################
+    # background tasks
+
+    def copy_files(self, pairs, checksum=True, on_progress=None):
+        """
+        Copies (source, target) pairs in the background, e.g. to publish
+        files into the context's filesystem locations.
+
+        Several files are copied at a time, each into a temporary file that
+        is renamed to the target once complete. An interrupted copy of the
+        same file continues where it stopped. on_progress(transfer, copied,
+        total) is called in the main thread.
+
+        :returns: a Transfer future resolving to a dict of target -> sha1,
+                  or target -> None without checksum
+        """
+        return transfer.copy_files(pairs, checksum, on_progress)
+
+    def submit_task(self, fn, *args, **kwargs):
+        """
+        Runs the non-UI portion of a command on a background thread.
+
+        fn is called as fn(task, *args, **kwargs) on a worker thread and can
+        report progress with task.report_progress(fraction, message) and
+        should regularly call task.check_cancelled(). The optional keyword
+        arguments on_done(task) and on_progress(task, fraction, message) are
+        called in the main thread and may update the UI. queue selects a
+        named queue, each of which runs a limited number of tasks at a time.
+
+        While a task submitted from a panel command is running, the
+        command's button is shown as busy. The task talks to the SynthEyes
+        of the panel command or dialog submitting it, unless the keyword
+        argument session selects another one.
+
+        :returns: The Task, a future for the result of fn
+        """
+        return tasks.g_executor.submit(fn, *args, **kwargs)
 
     ############################################################################
     # UI
@@ -208,26 +390,45 @@ class SyntheyesEngine(sgtk.platform.Engine):
             self.log_error(msg)
             return
 
-        # create the dialog:
-        dialog, widget = self._create_dialog_with_widget(title, bundle,
-                                                         widget_class, *args,
-                                                         **kwargs)
-
-        # Note - the base engine implementation will try to clean up
-        # dialogs and widgets after they've been closed.  However this
-        # can cause a crash in SynthEyes as the system may try to send
-        # an event after the dialog has been deleted.
-        # Keeping track of all dialogs will ensure this doesn't happen
-        self.__qt_dialogs.append(dialog)
-
-        # make sure the window raised so it doesn't
-        # appear behind the main SynthEyes window
-        dialog.raise_()
-        dialog.activateWindow()
-
-        # show the dialog:
-        dialog.show()
+        import tk_syntheyes
 
+        start = time.time()
+        # the dialog talks to the SynthEyes of the command opening it
+        session = sessions.current()
+
+        span = tracing.span("show_dialog %s" % title, tracing.DIALOG)
+        with span, sessions.session_context(session):
+            # use a prewarmed dialog if there is one, otherwise create it:
+            prewarmed = None
+            if not args and not kwargs and self._dialog_prewarmer:
+                self._dialog_prewarmer.record(title, bundle, widget_class)
+                prewarmed = self._dialog_prewarmer.take(title, bundle,
+                                                        widget_class)
+            if prewarmed:
+                dialog, widget = prewarmed
+            else:
+                dialog, widget = self._create_dialog_with_widget(
+                    title, bundle, widget_class, *args, **kwargs)
+            tk_syntheyes.SessionBinder(dialog, session)
+
+            # Note - the base engine implementation will try to clean up
+            # dialogs and widgets after they've been closed.  However this
+            # can cause a crash in SynthEyes as the system may try to send
+            # an event after the dialog has been deleted.
+            # Keeping track of all dialogs will ensure this doesn't happen
+            self.__qt_dialogs.append(dialog)
+
+            # make sure the window raised so it doesn't
+            # appear behind the main SynthEyes window
+            dialog.raise_()
+            dialog.activateWindow()
+
+            # show the dialog:
+            dialog.show()
+
+        self._dialog_open_seconds.observe(time.time() - start,
+                                          bundle=_bundle_name(bundle),
+                                          prewarmed=bool(prewarmed))
         return widget
 
     def show_modal(self, title, bundle, widget_class, *args, **kwargs):
@@ -255,12 +456,21 @@ class SyntheyesEngine(sgtk.platform.Engine):
             self.log_error(msg)
             return
 
+        import tk_syntheyes
         from sgtk.platform.qt import QtGui
 
+        # the dialog talks to the SynthEyes of the command opening it
+        session = sessions.current()
+
         # create the dialog:
-        dialog, widget = self._create_dialog_with_widget(title, bundle,
-                                                         widget_class, *args,
-                                                         **kwargs)
+        span = tracing.span("show_modal %s" % title, tracing.DIALOG)
+        with span, sessions.session_context(session), \
+                self._dialog_open_seconds.time(bundle=_bundle_name(bundle),
+                                               prewarmed=False):
+            dialog, widget = self._create_dialog_with_widget(title, bundle,
+                                                             widget_class,
+                                                             *args, **kwargs)
+        tk_syntheyes.SessionBinder(dialog, session)
 
         # Note - the base engine implementation will try to clean up
         # dialogs and widgets after they've been closed. However this
@@ -10,16 +10,25 @@
 
 from shutil import copyfile
 import ConfigParser
+import logging
 import os
 import re
+import subprocess
 import sys
+import threading
 
 import sgtk
 
+import bytecode_cache
+import launch_timeline
+
 CURRENT_EXTENSION = "0.1.0"
 
+logger = logging.getLogger('sgtk.syntheyes.bootstrap')
+
 
 def bootstrap(engine_name, context, app_path, app_args, extra_args):
+    launch_timeline.start()
 
     engine_path = sgtk.platform.get_engine_path(engine_name, context.tank,
                                                 context)
@@ -41,7 +50,8 @@ def bootstrap(engine_name, context, app_path, app_args, extra_args):
                "extra setting %s" % python_setting)
         raise sgtk.TankError(msg)
 
-    update(engine_path)
+    update(engine_path, os.path.expandvars(python_path),
+           _bundle_paths(engine_name, context))
 
     # Store data needed for bootstrapping Toolkit in env vars.
     # Used in startup/menu.py
@@ -71,9 +81,29 @@ def bootstrap(engine_name, context, app_path, app_args, extra_args):
     else:
         app_args = new_args
 
+    launch_timeline.stamp("launch_synth_eyes")
     return app_path, app_args
 
 
+def _bundle_paths(engine_name, context):
+    """
+    Returns the paths of the apps and frameworks the engine loads in the
+    environment of context
+    """
+    tk = context.tank
+    try:
+        env_name = tk.execute_core_hook("pick_environment", context=context)
+        env = tk.pipeline_configuration.get_environment(env_name, context)
+        paths = [env.get_app_descriptor(engine_name, app).get_path()
+                 for app in env.get_apps(engine_name)]
+        paths.extend(env.get_framework_descriptor(framework).get_path()
+                     for framework in env.get_frameworks())
+    except Exception:
+        logger.exception("Could not find the bundles of %s", engine_name)
+        return []
+    return paths
+
+
 def _user_path():
     user_path = {"darwin": "~/Library/Application Support/SynthEyes",
                  "win32": "%APPDATA%/SynthEyes",
@@ -137,7 +167,46 @@ def _upgrade_script(engine_path):
     copyfile(source_szl, target_szl)
 
 
-def update(engine_path):
+def _precompile(python_path, roots):
+    """
+    Compiles the modules below roots into the bytecode cache of the backend
+    interpreter. Runs in the background, the backend compiles what isn't
+    cached yet itself.
+    """
+    base = os.environ.get(bytecode_cache.BYTECODE_CACHE)
+    if base is None:
+        base = bytecode_cache.default_base()
+        os.environ[bytecode_cache.BYTECODE_CACHE] = base
+    if not base:
+        # disabled
+        return
+    os.environ[bytecode_cache.BYTECODE_ROOTS] = os.pathsep.join(roots)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "bytecode_cache.py")
+    try:
+        with open(os.devnull, "w") as devnull:
+            process = subprocess.Popen(
+                [python_path, script, "compile", base] + roots,
+                stdout=devnull, stderr=devnull)
+    except OSError:
+        logger.exception("Could not precompile the engine with %s",
+                         python_path)
+        return
+    # reap the compiler, the launcher may run for a long time
+    reaper = threading.Thread(target=_reap, args=(process,),
+                              name="PrecompileReaperThread")
+    reaper.daemon = True
+    reaper.start()
+
+
+def _reap(process):
+    returncode = process.wait()
+    if returncode:
+        logger.warning("Precompiling the engine failed with exit code %d",
+                       returncode)
+
+
+def update(engine_path, python_path=None, bundle_paths=()):
     # Upgrade if the installed version is out of date
     config = _get_config()
     installed_version = config.get("SGTK SynthEyes", "installed_version")
@@ -145,3 +214,7 @@ def update(engine_path):
     if _version_cmp(CURRENT_EXTENSION, installed_version) > 0:
         _upgrade_script(engine_path)
         tag(CURRENT_EXTENSION)
+
+    # modules changed since the last launch are compiled on every launch
+    if python_path:
+        _precompile(python_path, [engine_path] + list(bundle_paths))
@@ -0,0 +1,292 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Per-user cache of the compiled modules of the engine and its bundles
+
+Bundle caches are often read-only or on network storage, so the .pyc files
+next to the sources can't be written and every launch compiles the modules
+again. The launcher precompiles the modules of the engine, apps and
+frameworks with the backend interpreter into a cache directory:
+
+    python bytecode_cache.py compile CACHE_DIR ROOT [ROOT ...]
+
+The backend installs an import hook which loads the modules below the same
+roots from that directory. Cached code is keyed by the path of the source
+and only used while the sha1 of the source matches, modules compiled on a
+miss are added to the cache. CACHE_DIR is per user and holds a directory
+per bytecode version, as the launcher may run another interpreter than the
+backend.
+
+This module is used before the engine's python path is set up, so it only
+depends on the standard library.
+"""
+import hashlib
+import imp
+import marshal
+import os
+import sys
+import time
+
+
+# Constants
+# per user directory of the cache, set up by the launcher
+BYTECODE_CACHE = 'SGTK_SYNTHEYES_BYTECODE_CACHE'
+# the directories holding the cached modules, separated by os.pathsep
+BYTECODE_ROOTS = 'SGTK_SYNTHEYES_BYTECODE_ROOTS'
+# cached modules of sources not seen for this long are removed
+MAX_AGE = 30 * 24 * 3600
+SKIPPED_DIRS = ("tests", "test", "docs")
+
+
+def default_base():
+    return os.path.join(os.path.expanduser('~'), 'Library', 'Caches',
+                        'Shotgun', 'tk-syntheyes', 'bytecode')
+
+
+def cache_directory(base):
+    """
+    Returns the directory below base for the bytecode version of the running
+    interpreter
+    """
+    return os.path.join(base, "py%d%d-%s" % (sys.version_info[0],
+                                             sys.version_info[1],
+                                             imp.get_magic().encode("hex")))
+
+
+def _normalize(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+class BytecodeCache(object):
+    def __init__(self, directory):
+        self.directory = directory
+        self.writable = True
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                self.writable = False
+
+    def _cache_path(self, source_path):
+        key = hashlib.sha1(_normalize(source_path)).hexdigest()
+        return os.path.join(self.directory, key[:2], key[2:] + ".pyc")
+
+    def _read(self, cache_path, source_hash):
+        try:
+            with open(cache_path, "rb") as file_:
+                data = file_.read()
+        except IOError:
+            return None
+        magic = imp.get_magic()
+        header = len(magic) + len(source_hash)
+        if data[:header] != magic + source_hash:
+            return None
+        try:
+            return marshal.loads(data[header:])
+        except (EOFError, ValueError, TypeError):
+            return None
+
+    def _write(self, cache_path, source_hash, code):
+        if not self.writable:
+            return
+        directory = os.path.dirname(cache_path)
+        temp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(temp_path, "wb") as file_:
+                file_.write(imp.get_magic() + source_hash)
+                marshal.dump(code, file_)
+            if os.name == "nt" and os.path.exists(cache_path):
+                os.remove(cache_path)
+            os.rename(temp_path, cache_path)
+        except (IOError, OSError):
+            # another process wrote it meanwhile or the cache is read-only
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def get_code(self, source_path):
+        """
+        Returns the code of source_path and whether it came from the cache
+        """
+        with open(source_path, "rU") as file_:
+            source = file_.read()
+        source_hash = hashlib.sha1(source).digest()
+        cache_path = self._cache_path(source_path)
+        code = self._read(cache_path, source_hash)
+        if code is not None:
+            return code, True
+        code = compile(source, source_path, "exec", 0, True)
+        self._write(cache_path, source_hash, code)
+        return code, False
+
+    def compile_tree(self, root):
+        """
+        Caches the modules below root, returns the number of modules
+        compiled and found in the cache
+        """
+        compiled = cached = 0
+        for path, dirs, names in os.walk(root):
+            dirs[:] = [d for d in dirs if not d.startswith(".") and
+                       d not in SKIPPED_DIRS]
+            for name in names:
+                if not name.endswith(".py"):
+                    continue
+                source_path = os.path.join(path, name)
+                try:
+                    _, hit = self.get_code(source_path)
+                except (SyntaxError, TypeError, IOError):
+                    # e.g. Python 3 only modules of a bundle
+                    continue
+                if hit:
+                    cached += 1
+                    # keeps it from being removed as unused
+                    try:
+                        os.utime(self._cache_path(source_path), None)
+                    except OSError:
+                        pass
+                else:
+                    compiled += 1
+        return compiled, cached
+
+    def remove_unused(self, max_age=MAX_AGE):
+        """
+        Removes cached modules not compiled or used by compile_tree recently
+        """
+        limit = time.time() - max_age
+        for path, _, names in os.walk(self.directory):
+            for name in names:
+                cache_path = os.path.join(path, name)
+                try:
+                    if os.path.getmtime(cache_path) < limit:
+                        os.remove(cache_path)
+                except OSError:
+                    continue
+
+
+################################################################################
+# import hook
+
+class CachedLoader(object):
+    def __init__(self, cache, source_path, is_package):
+        self._cache = cache
+        self._source_path = source_path
+        self._is_package = is_package
+
+    def load_module(self, fullname):
+        code, _ = self._cache.get_code(self._source_path)
+        is_new = fullname not in sys.modules
+        module = sys.modules.setdefault(fullname, imp.new_module(fullname))
+        module.__file__ = self._source_path
+        module.__loader__ = self
+        if self._is_package:
+            module.__path__ = [os.path.dirname(self._source_path)]
+            module.__package__ = fullname
+        else:
+            module.__package__ = fullname.rpartition(".")[0]
+        try:
+            exec code in module.__dict__
+        except BaseException:
+            if is_new:
+                del sys.modules[fullname]
+            raise
+        return sys.modules[fullname]
+
+    def is_package(self, fullname):
+        return self._is_package
+
+    def get_source(self, fullname):
+        with open(self._source_path, "rU") as file_:
+            return file_.read()
+
+    def get_filename(self, fullname):
+        return self._source_path
+
+
+class CachedFinder(object):
+    """
+    Finds the source modules below the roots. Only path entries below the
+    roots are searched, everything else, and compiled extensions, are left
+    to the regular import.
+    """
+    def __init__(self, cache, roots):
+        self._cache = cache
+        self._roots = tuple(_normalize(r).rstrip(os.sep) + os.sep
+                            for r in roots)
+        self._suffixes = [s for (s, _, _) in imp.get_suffixes()]
+        # path entry -> whether it is below the roots
+        self._below_roots = {}
+
+    def _entries(self, path):
+        entries = []
+        for entry in (sys.path if path is None else path):
+            if not isinstance(entry, basestring):
+                continue
+            below = self._below_roots.get(entry)
+            if below is None:
+                below = self._below_roots[entry] = (
+                    _normalize(entry or os.curdir).rstrip(os.sep) +
+                    os.sep).startswith(self._roots)
+            if below:
+                entries.append(entry)
+        return entries
+
+    def find_module(self, fullname, path=None):
+        entries = self._entries(path)
+        if not entries:
+            return None
+        name = fullname.rpartition(".")[2]
+        for entry in entries:
+            base = os.path.join(entry or os.curdir, name)
+            init = os.path.join(base, "__init__.py")
+            if os.path.isfile(init):
+                return CachedLoader(self._cache, init, True)
+            for suffix in self._suffixes:
+                if os.path.isfile(base + suffix):
+                    if suffix != ".py":
+                        return None
+                    return CachedLoader(self._cache, base + suffix, False)
+        return None
+
+
+def install():
+    """
+    Loads the modules below the roots set up by the launcher from the cache
+    """
+    base = os.environ.get(BYTECODE_CACHE)
+    roots = [r for r in os.environ.get(BYTECODE_ROOTS, "").split(os.pathsep)
+             if r]
+    if not base or not roots:
+        return None
+    finder = CachedFinder(BytecodeCache(cache_directory(base)), roots)
+    sys.meta_path.insert(0, finder)
+    return finder
+
+
+def main(argv):
+    if len(argv) < 3 or argv[0] != "compile":
+        print "usage: bytecode_cache.py compile CACHE_DIR ROOT [ROOT ...]"
+        return 2
+    start = time.time()
+    cache = BytecodeCache(cache_directory(argv[1]))
+    compiled = cached = 0
+    for root in argv[2:]:
+        counts = cache.compile_tree(root)
+        compiled += counts[0]
+        cached += counts[1]
+    cache.remove_unused()
+    print "Compiled %d modules, %d up to date in %.2fs" % (
+        compiled, cached, time.time() - start)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
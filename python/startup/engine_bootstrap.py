@@ -9,9 +9,13 @@
 # reserved by Sebastian Kral.
 
 import os
+import subprocess
 import sys
 import logging
-import logging.handlers
+import threading
+
+import launch_timeline
+launch_timeline.stamp("backend_start")
 
 
 # platform specific alert with no dependencies
@@ -21,10 +25,23 @@ def msg_box(message):
         message_box = ctypes.windll.user32.MessageBoxA
         message_box(None, message, "Shotgun", 0)
     elif sys.platform == "darwin":
-        os.system("""osascript -e 'tell app "System Events" to activate""")
-        msg_ = ("""osascript -e 'tell app "System Events" to display"""
-                """dialog "%s" with icon caution buttons "Sorry!"'""" % message)
-        os.system(msg_)
+        # the launcher of the syntheyes package needs PySide, which may not
+        # be set up yet. Don't wait for the artist to close the alert, reap
+        # osascript on a thread instead.
+        message = message.replace("\\", "\\\\").replace('"', '\\"')
+        try:
+            process = subprocess.Popen(
+                ["osascript",
+                 "-e", 'tell app "System Events" to activate',
+                 "-e", 'tell app "System Events" to display dialog '
+                       '"%s" with icon caution buttons "Sorry!"' % message])
+        except OSError as e:
+            logging.getLogger('sgtk.syntheyes.PythonBootstrap').error(
+                "Failed to show alert: %s", e)
+            return
+        thread = threading.Thread(target=process.wait, name="AlertThread")
+        thread.daemon = True
+        thread.start()
 
 # setup logging
 ################################################################################
@@ -32,15 +49,19 @@ try:
     log_dir = '%s/Library/Logs/Shotgun/' % os.path.expanduser('~')
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
+    os.environ['SGTK_SYNTHEYES_LOG_DIR'] = log_dir
     log_file = os.path.join(log_dir, 'tk-syntheyes.log')
-    rotating = logging.handlers.RotatingFileHandler(log_file,
-                                                    maxBytes=4*1024*1024,
-                                                    backupCount=10)
+    # rotated logs are compressed and cleaned up in the background
+    import log_rotation
+    rotating = log_rotation.create_handler(log_file)
     pattern = '%(asctime)s [%(levelname) 8s] ' \
               '%(threadName)s %(name)s: %(message)s'
     rotating.setFormatter(logging.Formatter(pattern))
+    # repeated and excessive messages are dropped before any handler
+    import log_throttle
+    throttle = log_throttle.create_handler([rotating])
     logger = logging.getLogger('sgtk')
-    logger.addHandler(rotating)
+    logger.addHandler(throttle)
     logger.setLevel(logging.INFO)
 
     logger = logging.getLogger('sgtk.syntheyes.PythonBootstrap')
@@ -63,10 +84,66 @@ api_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..",
                                         "python"))
 sys.path.insert(0, api_path)
 
+# load the modules of the engine and its bundles from the bytecode cache
+try:
+    import bytecode_cache
+    if bytecode_cache.install():
+        logger.debug("Loading modules from the bytecode cache in %s",
+                     os.environ[bytecode_cache.BYTECODE_CACHE])
+except Exception, e:
+    logger.exception('Failed to set up the bytecode cache')
+
+# Initialize metrics
+try:
+    from syntheyes import metrics
+    logging.getLogger('sgtk').addHandler(metrics.MetricsLogHandler())
+    suppressed = metrics.g_registry.counter(
+        "syntheyes_log_records_suppressed_total",
+        "Number of log records dropped by deduplication or rate limits")
+    throttle.on_suppressed = lambda reason, name: suppressed.inc(
+        reason=reason, logger=name)
+    metrics.setup()
+except Exception, e:
+    logger.exception('Failed to initialize metrics')
+
+# Trace panel commands
+try:
+    from syntheyes import tracing
+    tracing.setup()
+except Exception, e:
+    logger.exception('Failed to initialize tracing')
+
+# Record SyPy traffic if requested
+try:
+    from syntheyes import recorder
+    recorder.setup()
+except Exception, e:
+    logger.exception('Failed to initialize SyPy recording')
+
+# Hand the session over to an already running or dormant backend
+try:
+    from syntheyes import sessions
+    port = os.environ[sessions.SGTK_SYNTHEYES_PORT]
+    pin = os.environ[sessions.SGTK_SYNTHEYES_PIN]
+    launch_timeline.stamp("handoff")
+    if sessions.broker_enabled() and sessions.handoff(
+            port, pin, engine=os.environ.get("TANK_ENGINE"),
+            context=os.environ.get("TANK_CONTEXT"),
+            file_to_open=os.environ.get("TANK_FILE_TO_OPEN"),
+            timeline=launch_timeline.current()):
+        logger.info("Session on port %s handed over to running backend", port)
+        sys.exit(0)
+except Exception, e:
+    logger.exception('Failed to hand over session')
+
 # Initialize heartbeat
 try:
     from syntheyes import heartbeat
-    heartbeat.setup()
+    from syntheyes import sessions
+    port = os.environ[sessions.SGTK_SYNTHEYES_PORT]
+    pin = os.environ[sessions.SGTK_SYNTHEYES_PIN]
+    g_session = sessions.g_sessions.add(sessions.Session(port, pin))
+    heartbeat.setup(g_session)
 except Exception, e:
     msg = ("Shotgun Pipeline Toolkit failed to initialize"
            "SynthEyes heartbeat:\n\n%s" % e)
@@ -92,6 +169,7 @@ try:
     g_app.setWindowIcon(QtGui.QIcon(os.path.join(res_dir,
                                                  "process_icon_256.png")))
     g_app.setApplicationName(sys.argv[0])
+    launch_timeline.stamp("pyside")
 except Exception, e:
     logger.exception("Could not create global PySide app")
     sys.exit(1)
@@ -100,14 +178,38 @@ except Exception, e:
 try:
     g_log = logging_console.LogConsole()
     g_app.setProperty("tk-syntheyes.log_console", g_log)
-    qt_handler = logging_console.QtLogHandler(g_log.logs)
-    logger = logging.getLogger('sgtk')
-    logger.addHandler(qt_handler)
+    qt_handler = logging_console.QtLogHandler(g_log.logs, g_log.index)
+    throttle.add_target(qt_handler)
     g_log.setHidden(True)
+    from syntheyes import callback_event
+    from syntheyes import tracing
+    g_log.add_report("Callbacks",
+                     callback_event.g_callbackRunner.stats.format_report)
+    g_log.add_report("Traces", tracing.g_tracer.summary.format_report)
 except Exception, e:
     logger.exception("Could not create logging console")
     sys.exit(1)
 
+# watch the main thread for stalls
+try:
+    from syntheyes import watchdog
+    g_watchdog = watchdog.setup()
+    if g_watchdog:
+        g_log.add_report("Stalls", g_watchdog.format_report)
+except Exception, e:
+    logger.exception("Could not start main thread watchdog")
+
+# watch the memory of long running sessions
+try:
+    from syntheyes import memory
+    g_memory = memory.setup()
+    g_memory.add_counter("Log console lines", g_log.logs.blockCount,
+                         main_thread=True)
+    g_memory.add_counter("Indexed log records", lambda: len(g_log.index))
+    g_log.add_report("Memory", g_memory.format_report)
+except Exception, e:
+    logger.exception("Could not start memory monitor")
+
 # run userSetup.py if it exists, borrowed from Maya
 ################################################################################
 try:
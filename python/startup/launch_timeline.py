@@ -0,0 +1,182 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Timeline of a SynthEyes launch across the launcher, SynthEyes and the Python
+backend
+
+The launcher stamps a launch id and the launch time into the environment.
+SynthEyes passes the environment on to the backend, which appends a
+timestamp per startup stage. Once the panel is shown the backend is ready
+and the timeline is appended to a history file in the log directory. The
+history can be summarized with:
+
+    python launch_timeline.py [HISTORY]
+
+This module is used before the engine's python path is set up and in the
+launcher, so it only depends on the standard library.
+"""
+import json
+import logging
+import os
+import socket
+import sys
+import time
+import uuid
+
+
+# Constants
+LAUNCH_ID = 'SGTK_SYNTHEYES_LAUNCH_ID'
+# "stage=timestamp" entries separated by semicolons
+LAUNCH_STAGES = 'SGTK_SYNTHEYES_LAUNCH_STAGES'
+HISTORY_FILE = 'launch_history.jsonl'
+
+
+def start():
+    """
+    Starts the timeline of a new launch. Called by the launcher.
+    """
+    os.environ[LAUNCH_ID] = uuid.uuid4().hex
+    os.environ[LAUNCH_STAGES] = ""
+    stamp("launch")
+
+
+def stamp(stage, timestamp=None):
+    """
+    Appends a stage to the timeline of the current launch, if there is one
+    """
+    if LAUNCH_ID not in os.environ:
+        return
+    if timestamp is None:
+        timestamp = time.time()
+    entry = "%s=%.6f" % (stage, timestamp)
+    stages = os.environ.get(LAUNCH_STAGES)
+    os.environ[LAUNCH_STAGES] = "%s;%s" % (stages, entry) if stages else entry
+
+
+def current():
+    """
+    Returns the launch id and the list of (stage, timestamp) tuples of the
+    current launch, or None
+    """
+    launch_id = os.environ.get(LAUNCH_ID)
+    if not launch_id:
+        return None
+    stages = []
+    for entry in os.environ.get(LAUNCH_STAGES, "").split(";"):
+        stage, _, timestamp = entry.partition("=")
+        try:
+            stages.append((stage, float(timestamp)))
+        except ValueError:
+            continue
+    return launch_id, stages
+
+
+def history_path():
+    default = os.path.join(os.path.expanduser('~'), 'Library', 'Logs',
+                           'Shotgun')
+    return os.path.join(os.environ.get('SGTK_SYNTHEYES_LOG_DIR', default),
+                        HISTORY_FILE)
+
+
+def ready(timeline=None):
+    """
+    Signals that the panel is usable. Stamps the "ready" stage, appends the
+    timeline to the history and returns the seconds since the launch.
+    timeline is the result of current() in another process, e.g. of a
+    backend that handed its session over.
+    """
+    logger = logging.getLogger('sgtk.syntheyes.launch_timeline')
+    own_launch = timeline is None
+    if own_launch:
+        timeline = current()
+    if not timeline or not timeline[1]:
+        return None
+
+    launch_id, stages = timeline
+    stages = list(stages) + [("ready", time.time())]
+    record = {"launch_id": launch_id, "host": socket.gethostname(),
+              "pid": os.getpid(), "stages": stages}
+    try:
+        with open(history_path(), "a") as file_:
+            file_.write(json.dumps(record) + "\n")
+    except (IOError, OSError):
+        logger.exception("Could not write launch timeline")
+
+    if own_launch:
+        # a later re-attach must not report this launch again
+        del os.environ[LAUNCH_ID]
+    total = stages[-1][1] - stages[0][1]
+    logger.info("Launch %s ready after %.2fs: %s", launch_id, total,
+                ", ".join("%s +%.2fs" % (stage, timestamp - stages[0][1])
+                          for (stage, timestamp) in stages))
+    return total
+
+
+def read_history(path):
+    records = []
+    with open(path) as file_:
+        for line in file_:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # a line cut off by a crash
+                continue
+    return records
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(records):
+    """
+    Returns a report of the p50 and p95 time per stage, measured from the
+    previous stage, and of the total launch time
+    """
+    durations = {}
+    order = []
+    for record in records:
+        stages = record.get("stages") or []
+        for (_, previous), (stage, timestamp) in zip(stages, stages[1:]):
+            if stage not in durations:
+                durations[stage] = []
+                order.append(stage)
+            durations[stage].append(timestamp - previous)
+        if len(stages) > 1:
+            durations.setdefault("total", []).append(stages[-1][1] -
+                                                     stages[0][1])
+    if not durations:
+        return "No launches recorded."
+
+    lines = ["%d launches, stage times since the previous stage" %
+             len(records), "",
+             "%8s %10s %10s %10s  %s" % ("count", "p50", "p95", "max",
+                                         "stage")]
+    for stage in order + ["total"]:
+        values = durations[stage]
+        lines.append("%8d %9.3fs %9.3fs %9.3fs  %s" % (
+            len(values), _percentile(values, 0.5), _percentile(values, 0.95),
+            max(values), stage))
+    return "\n".join(lines)
+
+
+def main(argv):
+    path = argv[0] if argv else history_path()
+    if not os.path.exists(path):
+        print "No launch history at %s" % path
+        return 1
+    print summarize(read_history(path))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
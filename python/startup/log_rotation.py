@@ -0,0 +1,265 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Log file rotation with background compression and retention
+
+Rotating only renames the active log file, compressing the rotated file and
+removing old logs of all sessions on the host happens on a background
+thread. Every session only compresses the files it rotated itself.
+
+Sessions share the log file. Before every record a session checks whether
+the file it writes to is still the log and reopens it otherwise, so after
+another session rotated it only a record written at that very moment can
+still end up in the rotated file. A rotated file is compressed once it
+stopped changing.
+
+This module is used before the engine's python path is set up, so it only
+depends on the standard library.
+"""
+import glob
+import gzip
+import itertools
+import logging
+import logging.handlers
+import os
+import Queue
+import shutil
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Constants
+LOG_MAX_BYTES = 'SGTK_SYNTHEYES_LOG_MAX_BYTES'
+LOG_ROTATE_INTERVAL = 'SGTK_SYNTHEYES_LOG_ROTATE_INTERVAL'
+LOG_COMPRESSION = 'SGTK_SYNTHEYES_LOG_COMPRESSION'
+LOG_RETENTION_MB = 'SGTK_SYNTHEYES_LOG_RETENTION_MB'
+LOG_RETENTION_DAYS = 'SGTK_SYNTHEYES_LOG_RETENTION_DAYS'
+
+COMPRESSED_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+# seconds a rotated file must be unchanged before it is compressed
+SETTLE_SECONDS = 2.0
+
+# numbers the files rotated by this process, so their names never clash
+_rotation_counter = itertools.count(1)
+
+
+class Compressor(threading.Thread):
+    """
+    Compresses rotated log files and applies the retention policy to all
+    logs in the directory
+    """
+    def __init__(self, base_filename, compression, retention_bytes,
+                 retention_age):
+        super(Compressor, self).__init__(name="LogCompressorThread")
+        self.daemon = True
+        self.base_filename = base_filename
+        if compression == "zstd" and zstandard is None:
+            compression = "gzip"
+        self.compression = compression
+        self.retention_bytes = retention_bytes
+        self.retention_age = retention_age
+        self.queue = Queue.Queue()
+
+    def run(self):
+        logger = logging.getLogger('sgtk.syntheyes.log_rotation')
+        while True:
+            path = self.queue.get()
+            try:
+                if path:
+                    self.compress(path)
+                self.apply_retention()
+            except Exception:
+                logger.exception("Could not process rotated log %s", path)
+
+    def _wait_until_settled(self, path):
+        """
+        Waits until path was not written to for SETTLE_SECONDS and returns
+        its stat, or None if it is gone
+        """
+        while True:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            idle = time.time() - stat.st_mtime
+            if idle >= SETTLE_SECONDS:
+                return stat
+            time.sleep(SETTLE_SECONDS - max(idle, 0))
+
+    def compress(self, path):
+        extension = COMPRESSED_EXTENSIONS.get(self.compression)
+        if extension is None:
+            return
+        stat = self._wait_until_settled(path)
+        if stat is None:
+            return
+        target = path + extension
+        temp_path = "%s.%d.tmp" % (target, os.getpid())
+        try:
+            with open(path, "rb") as source:
+                if self.compression == "zstd":
+                    compressor = zstandard.ZstdCompressor()
+                    with open(temp_path, "wb") as destination:
+                        compressor.copy_stream(source, destination)
+                else:
+                    destination = gzip.open(temp_path, "wb")
+                    try:
+                        shutil.copyfileobj(source, destination, 1024 * 1024)
+                    finally:
+                        destination.close()
+            current = os.stat(path)
+            if (current.st_size, current.st_mtime) != \
+                    (stat.st_size, stat.st_mtime):
+                # a session still wrote to it, try again once it settled
+                os.remove(temp_path)
+                self.queue.put(path)
+                return
+            os.rename(temp_path, target)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        os.remove(path)
+
+    def rotated_files(self):
+        """
+        Returns all rotated logs of all sessions, newest first
+        """
+        paths = [p for p in glob.glob(self.base_filename + ".*")
+                 if not p.endswith(".tmp")]
+        entries = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort(reverse=True)
+        return entries
+
+    def apply_retention(self):
+        now = time.time()
+        total = 0
+        for mtime, size, path in self.rotated_files():
+            total += size
+            too_old = self.retention_age and now - mtime > self.retention_age
+            too_big = self.retention_bytes and total > self.retention_bytes
+            if too_old or too_big:
+                try:
+                    os.remove(path)
+                except OSError:
+                    # another session might have removed it already
+                    pass
+
+
+class CompressingRotatingFileHandler(logging.handlers.BaseRotatingHandler):
+    """
+    Rotates the log by size and/or age. A rotated file is renamed to
+    "<log>.<date>-<time>.<pid>.<count>" and handed to a background thread
+    for compression, so rotation never waits on disk heavy work.
+    """
+    def __init__(self, filename, max_bytes=0, interval=0, compression="gzip",
+                 retention_bytes=0, retention_age=0):
+        logging.handlers.BaseRotatingHandler.__init__(self, filename, "a")
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.next_rollover = self._compute_next_rollover()
+        self.compressor = Compressor(self.baseFilename, compression,
+                                     retention_bytes, retention_age)
+        self.compressor.start()
+        # files other sessions rotated are theirs to compress, they are
+        # only removed by the retention policy
+        self.compressor.queue.put(None)
+
+    def _compute_next_rollover(self):
+        if not self.interval:
+            return None
+        return time.time() + self.interval
+
+    def _reopen_if_moved(self):
+        """
+        Reopens the log if another session rotated the file the stream
+        writes to, like logging.handlers.WatchedFileHandler
+        """
+        if self.stream is None:
+            return
+        try:
+            stat = os.stat(self.baseFilename)
+        except OSError:
+            stat = None
+        current = os.fstat(self.stream.fileno())
+        if stat is None or (stat.st_dev, stat.st_ino) != \
+                (current.st_dev, current.st_ino):
+            self.stream.close()
+            self.stream = self._open()
+
+    def shouldRollover(self, record):
+        self._reopen_if_moved()
+        if self.next_rollover and time.time() >= self.next_rollover:
+            return True
+        if self.max_bytes > 0:
+            if self.stream is None:
+                self.stream = self._open()
+            message = "%s\n" % self.format(record)
+            self.stream.seek(0, 2)
+            if self.stream.tell() + len(message) >= self.max_bytes:
+                return True
+        return False
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        while True:
+            rotated = "%s.%s.%d.%d" % (self.baseFilename,
+                                       time.strftime("%Y%m%d-%H%M%S"),
+                                       os.getpid(), next(_rotation_counter))
+            if not os.path.exists(rotated):
+                break
+        if os.path.exists(self.baseFilename):
+            try:
+                os.rename(self.baseFilename, rotated)
+                self.compressor.queue.put(rotated)
+            except OSError:
+                # another session rotated the shared file first
+                pass
+        self.stream = self._open()
+        self.next_rollover = self._compute_next_rollover()
+
+
+def _env_number(name, default, logger):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        logger.error("Error reading %s: %s", name, os.getenv(name))
+        return float(default)
+
+
+def create_handler(log_file):
+    """
+    Creates the rotating handler configured by the environment
+    """
+    logger = logging.getLogger('sgtk.syntheyes.log_rotation')
+    max_bytes = int(_env_number(LOG_MAX_BYTES, 4 * 1024 * 1024, logger))
+    interval = _env_number(LOG_ROTATE_INTERVAL, 24 * 60 * 60, logger)
+    retention_mb = _env_number(LOG_RETENTION_MB, 200, logger)
+    retention_days = _env_number(LOG_RETENTION_DAYS, 30, logger)
+    compression = os.getenv(LOG_COMPRESSION, "gzip")
+    return CompressingRotatingFileHandler(
+        log_file, max_bytes=max_bytes, interval=interval,
+        compression=compression,
+        retention_bytes=int(retention_mb * 1024 * 1024),
+        retention_age=retention_days * 24 * 60 * 60)
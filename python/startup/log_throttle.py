@@ -0,0 +1,204 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Deduplication and rate limiting of log records
+
+ThrottlingHandler sits in front of the real handlers. Identical messages
+(same logger, level and message template) within a window are collapsed
+into a single "repeated N times" record, and per logger token buckets cap
+how many records a logger may emit. This module is used before the
+engine's python path is set up, so it only depends on the standard library.
+"""
+import logging
+import os
+import threading
+import time
+
+
+# Constants
+LOG_DEDUPE_WINDOW = 'SGTK_SYNTHEYES_LOG_DEDUPE_WINDOW'
+# comma separated "logger=rate/burst" entries, e.g.
+# "sgtk.syntheyes.heartbeat=1/5,sgtk=100/500"
+LOG_RATE_LIMITS = 'SGTK_SYNTHEYES_LOG_RATE_LIMITS'
+
+DEDUPED = "deduplicated"
+RATE_LIMITED = "rate_limited"
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.time()
+
+    def take(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+def parse_rate_limits(text):
+    """
+    Parses "logger=rate/burst,..." into a dict of logger -> (rate, burst)
+    """
+    limits = {}
+    for entry in text.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, limit = entry.partition("=")
+        rate, _, burst = limit.partition("/")
+        rate = float(rate)
+        limits[name.strip()] = (rate, float(burst) if burst else rate)
+    return limits
+
+
+def _message_key(msg):
+    """
+    Returns a key of the unformatted message, str() fails on non-ascii unicode
+    """
+    try:
+        hash(msg)
+    except TypeError:
+        return repr(msg)
+    return msg
+
+
+class ThrottlingHandler(logging.Handler):
+    """
+    Forwards records to its targets, dropping repeated and excessive ones
+    """
+    def __init__(self, targets=(), window=5.0, rate_limits=None):
+        logging.Handler.__init__(self)
+        self.targets = list(targets)
+        self.window = window
+        self.rate_limits = rate_limits or {}
+        self.suppressed = {DEDUPED: 0, RATE_LIMITED: 0}
+        # called with (reason, logger name) for every dropped record
+        self.on_suppressed = None
+        self._recent = {}
+        self._buckets = {}
+        self._rate_limited = {}
+        self._state_lock = threading.Lock()
+
+        thread = threading.Thread(target=self._run, name="LogThrottleThread")
+        thread.daemon = True
+        thread.start()
+
+    def add_target(self, handler):
+        self.targets.append(handler)
+
+    def emit(self, record):
+        now = time.time()
+        forward = []
+        with self._state_lock:
+            key = (record.name, record.levelno, _message_key(record.msg))
+            recent = self._recent.get(key)
+            if recent and now - recent[0] < self.window:
+                recent[1] += 1
+                recent[2] = record
+                self._suppress(DEDUPED, record.name)
+                return
+
+            # only records that are forwarded use up the budget
+            if not self._take_token(record.name, now):
+                self._suppress(RATE_LIMITED, record.name)
+                self._rate_limited[record.name] = \
+                    self._rate_limited.get(record.name, 0) + 1
+                return
+            if recent and recent[1]:
+                forward.append(self._repeated_record(recent))
+            self._recent[key] = [now, 0, record]
+        forward.append(record)
+        self._forward(forward)
+
+    def _take_token(self, name, now):
+        bucket = self._buckets.get(name)
+        if bucket is None:
+            # the most specific configured logger applies
+            limit = None
+            parts = name.split(".")
+            for index in range(len(parts), 0, -1):
+                limit = self.rate_limits.get(".".join(parts[:index]))
+                if limit:
+                    break
+            if not limit:
+                return True
+            bucket = self._buckets[name] = TokenBucket(*limit)
+        return bucket.take(now)
+
+    def _suppress(self, reason, name):
+        self.suppressed[reason] += 1
+        if self.on_suppressed:
+            try:
+                self.on_suppressed(reason, name)
+            except Exception:
+                pass
+
+    def _repeated_record(self, recent):
+        first, count, record = recent
+        values = dict(record.__dict__)
+        values.update(msg="Last message repeated %d times within %.1fs: %s" %
+                      (count, record.created - first, record.getMessage()),
+                      args=None, exc_info=None, exc_text=None)
+        return logging.makeLogRecord(values)
+
+    def _forward(self, records):
+        for record in records:
+            for handler in self.targets:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def _run(self):
+        # report what was collapsed once the window is over, even if the
+        # message never comes again
+        while True:
+            time.sleep(1.0)
+            now = time.time()
+            forward = []
+            with self._state_lock:
+                for key, recent in self._recent.items():
+                    if now - recent[0] < self.window:
+                        continue
+                    if recent[1]:
+                        forward.append(self._repeated_record(recent))
+                    del self._recent[key]
+                rate_limited, self._rate_limited = self._rate_limited, {}
+            for name, count in rate_limited.items():
+                forward.append(logging.makeLogRecord(dict(
+                    name=name, levelno=logging.WARNING, levelname="WARNING",
+                    msg="%d records suppressed by the rate limit" % count)))
+            self._forward(forward)
+
+
+def create_handler(targets):
+    """
+    Creates the throttling handler configured by the environment
+    """
+    logger = logging.getLogger('sgtk.syntheyes.log_throttle')
+    try:
+        window = float(os.getenv(LOG_DEDUPE_WINDOW, '5'))
+    except ValueError:
+        logger.error("Error reading %s: %s", LOG_DEDUPE_WINDOW,
+                     os.getenv(LOG_DEDUPE_WINDOW))
+        window = 5.0
+    try:
+        rate_limits = parse_rate_limits(os.getenv(LOG_RATE_LIMITS, ''))
+    except ValueError:
+        logger.error("Error reading %s: %s", LOG_RATE_LIMITS,
+                     os.getenv(LOG_RATE_LIMITS))
+        rate_limits = {}
+    return ThrottlingHandler(targets, window=window, rate_limits=rate_limits)
@@ -22,10 +22,8 @@ def msg_box(message):
         message_box = ctypes.windll.user32.MessageBoxA
         message_box(None, message, "Shotgun", 0)
     elif sys.platform == "darwin":
-        os.system("""osascript -e 'tell app "System Events" to activate""")
-        msg_ = ("""osascript -e 'tell app "System Events" to display"""
-                """dialog "%s" with icon caution buttons "Sorry!"'""" % message)
-        os.system(msg_)
+        from syntheyes import launcher
+        launcher.g_launcher.launch(launcher.message_box_args(message))
 
 
 def bootstrap_tank():
@@ -48,6 +46,8 @@ def bootstrap_tank():
         msg_box(msg)
         return
 
+    import launch_timeline
+    launch_timeline.stamp("start_engine")
     try:
         sgtk.platform.start_engine(engine_name, context.tank, context)
     except Exception, e:
@@ -58,7 +58,7 @@ def bootstrap_tank():
     if file_to_open:
         from syntheyes import get_existing_connection
         hlev = get_existing_connection()
-        hlev.OpenSNI(file_path)
+        hlev.OpenSNI(file_to_open)
 
     # clean up temp env vars
     for var in ["TANK_ENGINE", "TANK_CONTEXT", "TANK_FILE_TO_OPEN"]:
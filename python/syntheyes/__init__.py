@@ -9,15 +9,23 @@
 # reserved by Sebastian Kral.
 
 # system modules
+import contextlib
 import os
 import sys
 import logging
+import threading
+import time
 
 import SyPy
 
+from syntheyes import metrics
+from syntheyes import sessions
+from syntheyes import tracing
+
 # Constants
-SGTK_SYNTHEYES_PORT = 'SGTK_SYNTHEYES_PORT'
-SGTK_SYNTHEYES_PIN = 'SGTK_SYNTHEYES_PIN'
+SGTK_SYNTHEYES_PORT = sessions.SGTK_SYNTHEYES_PORT
+SGTK_SYNTHEYES_PIN = sessions.SGTK_SYNTHEYES_PIN
+SGTK_SYNTHEYES_LOG_DIR = 'SGTK_SYNTHEYES_LOG_DIR'
 
 # setup logging
 ################################################################################
@@ -43,9 +51,155 @@ def logging_excepthook(type, value, tb):
 sys.execpthook = logging_excepthook
 
 
+def get_log_dir():
+    default = os.path.join(os.path.expanduser('~'), 'Library', 'Logs',
+                           'Shotgun')
+    return os.environ.get(SGTK_SYNTHEYES_LOG_DIR, default)
+
+
+# SyPy call interception
+################################################################################
+_interceptors = []
+_connection_open_seconds = metrics.g_registry.histogram(
+    "syntheyes_connection_open_seconds",
+    "Time to open a SyPy connection to SynthEyes")
+_call_seconds = metrics.g_registry.histogram(
+    "syntheyes_sypy_call_seconds",
+    "Latency of SyPy calls made through the engine connections")
+
+
+def add_connection_interceptor(interceptor):
+    """
+    Registers interceptor(path, args, kwargs, proceed) to be called around
+    every SyPy call made through connections returned by
+    get_existing_connection. path is the dotted method name, e.g.
+    "core.OK", and proceed() runs the call and returns its result.
+    Interceptors registered first are outermost.
+    """
+    _interceptors.append(interceptor)
+
+
+def remove_connection_interceptor(interceptor):
+    if interceptor in _interceptors:
+        _interceptors.remove(interceptor)
+
+
+def _time_call(path, args, kwargs, proceed):
+    with _call_seconds.time(method=path):
+        return proceed()
+
+
+def _trace_call(path, args, kwargs, proceed):
+    with tracing.span(path, tracing.SYPY):
+        return proceed()
+
+
+add_connection_interceptor(_time_call)
+add_connection_interceptor(_trace_call)
+
+# plain values are returned as they are, other attributes get wrapped so
+# calls on sub objects like hlev.core are intercepted as well
+_PLAIN_TYPES = (basestring, bool, int, long, float, complex, type(None),
+                tuple, list, dict)
+_local = threading.local()
+
+
+def _intercept(path, attr):
+    """
+    Returns attr wrapped so calls run through the interceptors, or attr
+    itself if there is nothing to intercept
+    """
+    if (not _interceptors or getattr(_local, "intercepting", False) or
+            isinstance(attr, _PLAIN_TYPES) or isinstance(attr, type)):
+        # calls SyPy makes while running an intercepted call are part of it
+        return attr
+    if not callable(attr):
+        return _SubObject(attr, path + ".")
+
+    def call(*args, **kwargs):
+        return _intercepted_call(path, attr, args, kwargs)
+    return call
+
+
+class _SubObject(object):
+    """
+    Wraps an attribute of a SyLevel like core, so its calls are intercepted
+    """
+    def __init__(self, target, path):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_path", path)
+
+    def __getattr__(self, name):
+        return _intercept(self._path + name, getattr(self._target, name))
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+    def __repr__(self):
+        return repr(self._target)
+
+
+class SyntheyesLevel(SyPy.SyLevel, object):
+    """
+    SyPy.SyLevel running every call through the registered interceptors
+    """
+    # (port, pin) of the SynthEyes, shared by all its connections
+    session_key = None
+
+    def __getattribute__(self, name):
+        try:
+            attr = object.__getattribute__(self, name)
+        except AttributeError:
+            # attributes SyPy provides dynamically
+            getattr_fn = getattr(type(self), "__getattr__", None)
+            if getattr_fn is None:
+                raise
+            attr = getattr_fn(self, name)
+        if name.startswith("_"):
+            return attr
+        return _intercept(name, attr)
+
+
+@contextlib.contextmanager
+def _not_intercepted():
+    previous = getattr(_local, "intercepting", False)
+    _local.intercepting = True
+    try:
+        yield
+    finally:
+        _local.intercepting = previous
+
+
+def _intercepted_call(path, fn, args, kwargs):
+    interceptors = list(_interceptors)
+
+    def proceed(index=0):
+        if index == len(interceptors):
+            with _not_intercepted():
+                return fn(*args, **kwargs)
+        return interceptors[index](path, args, kwargs,
+                                   lambda: proceed(index + 1))
+    return proceed()
+
+
 def get_existing_connection():
-    port = int(os.environ[SGTK_SYNTHEYES_PORT])
-    pin = os.environ[SGTK_SYNTHEYES_PIN]
-    hlev = SyPy.SyLevel()
-    hlev.OpenExisting(port, pin)
+    """
+    Connects to the SynthEyes of the active session
+    """
+    port, pin = sessions.current_port_and_pin()
+    return get_connection(port, pin)
+
+
+def get_connection(port, pin):
+    """
+    Connects to the SynthEyes listening on port. Returns a SyPy.SyLevel.
+    """
+    hlev = SyntheyesLevel()
+    start = time.time()
+    # timed as a whole, not as a SyPy call
+    with tracing.span("OpenExisting", tracing.SYPY, port=port), \
+            _not_intercepted():
+        hlev.OpenExisting(port, pin)
+    _connection_open_seconds.observe(time.time() - start)
+    hlev.session_key = (port, pin)
     return hlev
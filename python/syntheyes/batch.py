@@ -0,0 +1,206 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Batched execution of SyPy operations
+
+Operations queued inside a batch return futures and are sent to SynthEyes
+when the batch is flushed, in the order they were queued:
+
+    with batch(hlev) as b:
+        frame = b.Frame()
+        ok = b.core.OK()
+    print frame.result(), ok.result()
+
+SyPy waits for the reply of every call before sending the next one and
+has no bulk execution, so a flush still costs one round trip per
+operation. What a batch adds is that its operations run back to back as
+one unit.
+
+Batches on the same SynthEyes are flushed one at a time, so the operations
+of two batches never interleave. With background=True the flush happens on
+a separate thread and leaving the with block does not wait for SynthEyes.
+"""
+import logging
+import threading
+import weakref
+
+from syntheyes import metrics
+from syntheyes.futures import Future
+
+
+# What to do with the remaining operations when one fails
+CONTINUE = "continue"
+ABORT = "abort"
+
+_batch_size = metrics.g_registry.histogram(
+    "syntheyes_batch_operations", "Number of operations per SyPy batch",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+_flush_seconds = metrics.g_registry.histogram(
+    "syntheyes_batch_flush_seconds", "Time to flush a SyPy batch")
+
+_locks_lock = threading.Lock()
+# (port, pin) -> lock of the SynthEyes
+_session_locks = {}
+# locks of connections not made by get_connection
+_connection_locks = weakref.WeakKeyDictionary()
+
+
+def connection_lock(connection):
+    """
+    Returns the lock held while a batch runs on the SynthEyes of connection.
+    Hold it to run a sequence of calls that batches must not interleave
+    with. All connections to the same SynthEyes share the lock.
+    """
+    key = getattr(connection, "session_key", None)
+    with _locks_lock:
+        if key is not None:
+            return _session_locks.setdefault(key, threading.Lock())
+        lock = _connection_locks.get(connection)
+        if lock is None:
+            lock = _connection_locks[connection] = threading.Lock()
+        return lock
+
+
+class BatchAborted(Exception):
+    """
+    Set on operations that were not run because an earlier operation in
+    the same batch failed
+    """
+
+
+class Operation(object):
+    def __init__(self, path, args, kwargs):
+        self.path = path
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+
+    def __repr__(self):
+        return "<Operation %s%r>" % (self.path, self.args)
+
+
+class _OperationBuilder(object):
+    """
+    Turns attribute access and calls into queued operations, e.g.
+    b.core.OK() queues the operation "core.OK"
+    """
+    def __init__(self, batch, path):
+        self._batch = batch
+        self._path = path
+
+    def __getattr__(self, name):
+        return _OperationBuilder(self._batch, "%s.%s" % (self._path, name))
+
+    def __call__(self, *args, **kwargs):
+        return self._batch.call(self._path, *args, **kwargs)
+
+
+class Batch(object):
+    _logger = logging.getLogger('sgtk.syntheyes.batch')
+
+    def __init__(self, connection, on_error=CONTINUE, background=False):
+        self.connection = connection
+        self.on_error = on_error
+        self.background = background
+        self._operations = []
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return _OperationBuilder(self, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None:
+            # the block failed, don't send half of what it queued
+            self.cancel()
+            return False
+        self.flush()
+        return False
+
+    def call(self, path, *args, **kwargs):
+        """
+        Queues the operation path (e.g. "core.OK") and returns its future
+        """
+        operation = Operation(path, args, kwargs)
+        with self._lock:
+            self._operations.append(operation)
+        return operation.future
+
+    def cancel(self):
+        with self._lock:
+            operations, self._operations = self._operations, []
+        for operation in operations:
+            operation.future.cancel()
+
+    def flush(self):
+        """
+        Sends all queued operations. Returns the list of futures.
+        """
+        with self._lock:
+            operations, self._operations = self._operations, []
+        if not operations:
+            return []
+
+        if self.background:
+            thread = threading.Thread(target=self._run,
+                                      args=(operations,),
+                                      name="SyPyBatchThread")
+            thread.daemon = True
+            thread.start()
+        else:
+            self._run(operations)
+        return [operation.future for operation in operations]
+
+    def _run(self, operations):
+        _batch_size.observe(len(operations))
+        with connection_lock(self.connection), _flush_seconds.time():
+            self._run_sequential(operations)
+
+    def _run_sequential(self, operations):
+        failed = None
+        for index, operation in enumerate(operations):
+            if operation.future.cancelled():
+                continue
+            if failed is not None:
+                error = BatchAborted("Operation %d (%s) of the batch failed" %
+                                     (failed, operations[failed].path))
+                operation.future.set_exception((BatchAborted, error, None))
+                continue
+            try:
+                target = self.connection
+                for name in operation.path.split("."):
+                    target = getattr(target, name)
+                result = target(*operation.args, **operation.kwargs)
+            except Exception:
+                operation.future.set_exception()
+                self._logger.debug("Batch operation %r failed", operation,
+                                   exc_info=True)
+                if self.on_error == ABORT:
+                    failed = index
+            else:
+                operation.future.set_result(result)
+
+
+def batch(connection, on_error=CONTINUE, background=False):
+    """
+    Returns a Batch queuing operations for connection. Use it as a context
+    manager to flush it at the end of the with block.
+
+    :param on_error: CONTINUE runs the remaining operations after one
+                     failed, ABORT fails them with BatchAborted.
+    :param background: Flush on a separate thread instead of waiting for
+                       SynthEyes when leaving the with block.
+    """
+    return Batch(connection, on_error=on_error, background=background)
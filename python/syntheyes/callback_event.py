@@ -15,9 +15,95 @@ This is used by the logging console to update the gui on the main thread
 and so it cannot use logging itself
 """
 
+import cProfile
 import logging
+import os
+import re
+import threading
+import time
+
 from PySide import QtCore
 
+from syntheyes import metrics
+from syntheyes import tracing
+
+# Constants
+PROFILE_CALLBACKS = 'SGTK_SYNTHEYES_PROFILE_CALLBACKS'
+# upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0,
+                   2.0, 5.0, float('inf'))
+
+
+def callback_name(fn):
+    """
+    Returns a readable name for a callable, e.g. "module.Class.method"
+    """
+    owner = getattr(fn, '__self__', None)
+    name = getattr(fn, '__name__', None) or fn.__class__.__name__
+    if owner is not None:
+        name = "%s.%s" % (owner.__class__.__name__, name)
+    module = getattr(fn, '__module__', None)
+    if module:
+        name = "%s.%s" % (module, name)
+    return name
+
+
+class CallbackStats(object):
+    """
+    Call counts and latency histograms per callable
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def add(self, name, duration):
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = [0, 0.0, 0.0,
+                                             [0] * len(LATENCY_BUCKETS)]
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    stats[3][index] += 1
+                    break
+
+    def snapshot(self):
+        """
+        Returns a dict of name -> (count, total, max, bucket counts)
+        """
+        with self._lock:
+            return dict((name, (count, total, longest, list(buckets)))
+                        for (name, (count, total, longest, buckets))
+                        in self._stats.items())
+
+    def format_report(self):
+        stats = self.snapshot()
+        if not stats:
+            return "No callbacks recorded."
+
+        header = ["%8s" % "count", "%10s" % "mean", "%10s" % "max"]
+        header += ["%7s" % _format_bound(b) for b in LATENCY_BUCKETS]
+        lines = ["latency histogram columns are upper bounds", "",
+                 " ".join(header) + "  callback"]
+        for name, (count, total, longest, buckets) in sorted(
+                stats.items(), key=lambda item: item[1][1], reverse=True):
+            row = ["%8d" % count, "%9.2fms" % (total / count * 1000),
+                   "%9.2fms" % (longest * 1000)]
+            row += ["%7d" % b for b in buckets]
+            lines.append(" ".join(row) + "  " + name)
+        return "\n".join(lines)
+
+
+def _format_bound(bound):
+    if bound == float('inf'):
+        return "inf"
+    if bound < 1.0:
+        return "%dms" % (bound * 1000)
+    return "%ds" % bound
+
 
 class RunCallbackEvent(QtCore.QEvent):
     EVENT_TYPE = QtCore.QEvent.Type(QtCore.QEvent.registerEventType())
@@ -27,24 +113,94 @@ class RunCallbackEvent(QtCore.QEvent):
         self.fn = fn
         self.args = args
         self.kwargs = kwargs
+        # continue the trace of the sending thread
+        self.span = tracing.capture()
 
 
 class CallbackRunner(QtCore.QObject):
     _logger = logging.getLogger('sgtk.syntheyes.engine')
 
+    def __init__(self, parent=None):
+        super(CallbackRunner, self).__init__(parent)
+        self.stats = CallbackStats()
+        self._profile_remaining = 0
+        self._profile_dir = None
+        self._profile_seq = 0
+
+    def start_profiling(self, count, directory=None):
+        """
+        Profiles the next count callbacks with cProfile and dumps a .pstats
+        file for each of them into directory. Callbacks that don't log
+        themselves, like log console updates, are not profiled.
+        """
+        if directory is None:
+            from syntheyes import get_log_dir
+            directory = os.path.join(get_log_dir(), 'callback_profiles')
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._profile_dir = directory
+        self._profile_remaining = count
+        self._logger.info("Profiling the next %d callbacks into %s", count,
+                          directory)
+
+    def stop_profiling(self):
+        self._profile_remaining = 0
+
+    @property
+    def profiling(self):
+        return self._profile_remaining > 0
+
     def event(self, event):
+        _queue_depth.dec()
+        logged = getattr(event.fn, '_tkLog', True)
+        start = time.time()
         try:
-            if getattr(event.fn, '_tkLog', True):
-                self._logger.info("Callback %s", str(event.fn))
-            event.fn(*event.args, **event.kwargs)
+            with tracing.activate(event.span), \
+                    tracing.span(callback_name(event.fn), tracing.CALLBACK):
+                if logged:
+                    self._logger.info("Callback %s", str(event.fn))
+                    if self._profile_remaining > 0:
+                        self._profile(event)
+                        return True
+                event.fn(*event.args, **event.kwargs)
         except Exception:
             self._logger.exception("Error in callback %s", str(event.fn))
+        finally:
+            self.stats.add(callback_name(event.fn), time.time() - start)
         return True
 
+    def _profile(self, event):
+        self._profile_remaining -= 1
+        self._profile_seq += 1
+        profile = cProfile.Profile()
+        try:
+            profile.runcall(event.fn, *event.args, **event.kwargs)
+        finally:
+            name = re.sub(r'[^\w.-]+', '_', callback_name(event.fn))
+            path = os.path.join(self._profile_dir, "%s-%03d-%s.pstats" %
+                                (time.strftime("%Y%m%d-%H%M%S"),
+                                 self._profile_seq, name))
+            profile.dump_stats(path)
+            self._logger.info("Wrote callback profile %s", path)
+
 g_callbackRunner = CallbackRunner()
+_queue_depth = metrics.g_registry.gauge(
+    "syntheyes_callback_queue_depth",
+    "Number of callbacks waiting to be run in the main thread")
+
+try:
+    _profile_count = int(os.getenv(PROFILE_CALLBACKS, '0'))
+except ValueError:
+    _profile_count = 0
+    logging.getLogger('sgtk.syntheyes.engine').error(
+        "Error setting callback profiling from %s: %s", PROFILE_CALLBACKS,
+        os.getenv(PROFILE_CALLBACKS))
+if _profile_count > 0:
+    g_callbackRunner.start_profiling(_profile_count)
 
 
 def send_to_main_thread(fn, *args, **kwargs):
     global g_callbackRunner
+    _queue_depth.inc()
     QtCore.QCoreApplication.postEvent(g_callbackRunner,
                                       RunCallbackEvent(fn, *args, **kwargs))
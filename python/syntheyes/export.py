@@ -0,0 +1,283 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Streaming writers for per-frame camera and tracker data
+
+Data is pulled from SynthEyes in blocks of frames. Every block is formatted
+with a single string formatting operation and written out before the next
+one is read, so memory use doesn't grow with the length of the shot:
+
+    channels = [Channel(["tx", "ty", "tz"], camera, "Position"),
+                Channel(["rx", "ry", "rz"], camera, "Rotation")]
+    with ChanWriter(path) as writer:
+        export(hlev, range(first, last + 1), channels, writer)
+
+Channels name the SyPy method queried per frame on an object returned by
+SynthEyes, or on a dotted attribute path of the connection. SyPy has no
+bulk getters, so every frame costs a SetFrame and every value a round
+trip; the timeline of SynthEyes moves along while exporting. Its frame is
+restored once the export is done.
+
+Blocks are NumPy arrays when NumPy is available and lists of rows
+otherwise; frames a channel could not be read for are NaN. Writers treat
+NaN and infinite values as missing.
+"""
+import functools
+import itertools
+import json
+
+from syntheyes.batch import connection_lock
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Constants
+BLOCK_FRAMES = 250
+FLOAT_FORMAT = "%.6f"
+NAN = float("nan")
+INF = float("inf")
+
+
+class Channel(object):
+    """
+    One or more columns read per frame by calling method on target. A
+    method returning a sequence fills one column per item. target is an
+    object returned by SynthEyes or a dotted attribute path of the
+    connection.
+    """
+    def __init__(self, columns, target, method, *args):
+        if isinstance(columns, basestring):
+            columns = [columns]
+        self.columns = list(columns)
+        self.target = target
+        self.method = method
+        self.args = args
+
+
+def _resolve(target, path):
+    for name in path.split("."):
+        target = getattr(target, name)
+    return target
+
+
+def _columns(value, width):
+    """
+    Returns the width columns of a value read for a channel
+    """
+    if width == 1:
+        return [float(value)]
+    values = [float(v) for v in value][:width]
+    return values + [NAN] * (width - len(values))
+
+
+def _read_row(methods):
+    row = []
+    for method, width in methods:
+        try:
+            row.extend(_columns(method(), width))
+        except Exception:
+            row.extend([NAN] * width)
+    return row
+
+
+def _block_reader(connection, channels, set_frame):
+    """
+    Returns a function reading the rows of a block of frames
+    """
+    set_frame = _resolve(connection, set_frame)
+    # look the methods up once, not per frame
+    methods = []
+    for channel in channels:
+        target = channel.target
+        if isinstance(target, basestring):
+            target = _resolve(connection, target)
+        methods.append((functools.partial(getattr(target, channel.method),
+                                          *channel.args),
+                        len(channel.columns)))
+
+    def read_block(frames):
+        rows = []
+        for frame in frames:
+            set_frame(frame)
+            rows.append(_read_row(methods))
+        return rows
+    return read_block
+
+
+def read_blocks(connection, frames, channels, block_size=BLOCK_FRAMES,
+                get_frame="Frame", set_frame="SetFrame"):
+    """
+    Yields (frames, values) blocks with one row per frame and one column per
+    channel column. A block is read while holding the connection's batch
+    lock, so other batches can't change the frame in between. The frame
+    SynthEyes was on is restored when the generator is exhausted or closed.
+    """
+    frames = list(frames)
+    read_block = _block_reader(connection, channels, set_frame)
+    with connection_lock(connection):
+        original_frame = _resolve(connection, get_frame)()
+    try:
+        for start in range(0, len(frames), block_size):
+            block_frames = frames[start:start + block_size]
+            with connection_lock(connection):
+                values = read_block(block_frames)
+            if numpy is not None:
+                values = numpy.array(values, dtype=float)
+            yield block_frames, values
+    finally:
+        with connection_lock(connection):
+            _resolve(connection, set_frame)(original_frame)
+
+
+def columns_of(channels):
+    return [column for channel in channels for column in channel.columns]
+
+
+def export(connection, frames, channels, writer, block_size=BLOCK_FRAMES):
+    """
+    Streams the channels for frames into writer. Returns the number of
+    frames written.
+    """
+    count = 0
+    blocks = read_blocks(connection, frames, channels, block_size)
+    try:
+        for block_frames, values in blocks:
+            count += writer.write_block(block_frames, values)
+    finally:
+        # restores the frame right away if writing failed
+        blocks.close()
+    return count
+
+
+################################################################################
+# writers
+
+class BlockWriter(object):
+    """
+    Base class of the writers. Subclasses provide the row template with a
+    %d for the frame followed by one float format per column.
+    """
+    separator = " "
+
+    def __init__(self, path, columns=None):
+        self.path = path
+        self.columns = list(columns or [])
+        self._file = open(path, "wb", 1024 * 1024)
+        header = self.header()
+        if header:
+            self._file.write(header)
+        self._template = self.row_template()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def header(self):
+        return ""
+
+    def row_template(self):
+        return "%d" + (self.separator + FLOAT_FORMAT) * len(self.columns) + \
+            "\n"
+
+    def format_nan(self, text):
+        return text
+
+    def _rows(self, frames, values):
+        return frames, values
+
+    def write_block(self, frames, values):
+        """
+        Formats and writes a block of rows, returns the number of rows
+        """
+        # infinite values are as invalid as missing ones in all formats
+        if numpy is not None and isinstance(values, numpy.ndarray):
+            values = numpy.where(numpy.isinf(values), NAN, values)
+        else:
+            values = [[NAN if v in (INF, -INF) else v for v in row]
+                      for row in values]
+        frames, values = self._rows(frames, values)
+        if not len(frames):
+            return 0
+        if numpy is not None and isinstance(values, numpy.ndarray):
+            data = numpy.column_stack([numpy.asarray(frames, dtype=float),
+                                       values]).ravel().tolist()
+        else:
+            data = list(itertools.chain.from_iterable(
+                itertools.chain((frame,), row)
+                for frame, row in zip(frames, values)))
+        # one formatting operation for the whole block, twice as fast as
+        # numpy.savetxt, which formats row by row
+        text = (self._template * len(frames)) % tuple(data)
+        self._file.write(self.format_nan(text))
+        return len(frames)
+
+    def close(self):
+        self._file.close()
+
+
+class ChanWriter(BlockWriter):
+    """
+    Nuke .chan camera files: frame, translation, rotation in degrees and
+    optionally the vertical field of view. Nuke can't read gaps, so frames
+    with missing values are left out.
+    """
+    def __init__(self, path, columns=("tx", "ty", "tz", "rx", "ry", "rz")):
+        if len(columns) not in (6, 7):
+            raise ValueError(".chan files have 6 or 7 columns, not %d" %
+                             len(columns))
+        super(ChanWriter, self).__init__(path, columns)
+
+    def _rows(self, frames, values):
+        if numpy is not None and isinstance(values, numpy.ndarray):
+            valid = ~numpy.isnan(values).any(axis=1)
+            return numpy.asarray(frames)[valid], values[valid]
+        rows = [(f, r) for (f, r) in zip(frames, values)
+                if not any(v != v for v in r)]
+        return [f for (f, _) in rows], [r for (_, r) in rows]
+
+
+class CsvWriter(BlockWriter):
+    """
+    CSV tables with a header row, e.g. tracker positions with one column
+    per tracker and axis. Missing values are empty cells.
+    """
+    separator = ","
+
+    def header(self):
+        names = ["frame"] + self.columns
+        return ",".join('"%s"' % n.replace('"', '""') if "," in n or '"' in n
+                        else n for n in names) + "\n"
+
+    def format_nan(self, text):
+        # the rows hold nothing but numbers, so this only hits values
+        return text.replace("nan", "")
+
+
+class JsonLinesWriter(BlockWriter):
+    """
+    One JSON object per frame with the frame and a key per column. Missing
+    values are null.
+    """
+    def row_template(self):
+        fields = ['"frame": %d']
+        for column in self.columns:
+            fields.append("%s: %s" % (json.dumps(column).replace("%", "%%"),
+                                      FLOAT_FORMAT))
+        return "{" + ", ".join(fields) + "}\n"
+
+    def format_nan(self, text):
+        return text.replace(": nan", ": null")
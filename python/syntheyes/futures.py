@@ -0,0 +1,117 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Minimal futures for results that are produced later or on another thread
+"""
+import logging
+import sys
+import threading
+
+
+class CancelledError(Exception):
+    pass
+
+
+class Future(object):
+    """
+    The result of an operation that may not have run yet
+    """
+    _logger = logging.getLogger('sgtk.syntheyes.futures')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._cancelled = False
+        self._resolved = False
+        self._callbacks = []
+
+    def done(self):
+        return self._done.is_set()
+
+    def cancelled(self):
+        return self._cancelled
+
+    def cancel(self):
+        """
+        Cancels the operation if it has not finished yet. Returns whether
+        the future is cancelled.
+        """
+        with self._lock:
+            if self._resolved:
+                return self._cancelled
+            self._resolved = True
+            self._cancelled = True
+            self._exc_info = (CancelledError, CancelledError(), None)
+        self._finish()
+        return True
+
+    def result(self, timeout=None):
+        """
+        Waits for and returns the result, raises the exception of the
+        operation if it failed
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError("Timed out waiting for result")
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Waits for the operation and returns its exception or None
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError("Timed out waiting for result")
+        if self._exc_info:
+            return self._exc_info[1]
+        return None
+
+    def add_done_callback(self, fn):
+        """
+        Calls fn(future) once the future is done, immediately if it already
+        is. The callback runs on the thread finishing the future.
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        self._run_callback(fn)
+
+    def set_result(self, result):
+        with self._lock:
+            if self._resolved:
+                return
+            self._resolved = True
+            self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info=None):
+        with self._lock:
+            if self._resolved:
+                return
+            self._resolved = True
+            self._exc_info = exc_info or sys.exc_info()
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            self._run_callback(fn)
+
+    def _run_callback(self, fn):
+        try:
+            fn(self)
+        except Exception:
+            self._logger.exception("Error in future callback %s", fn)
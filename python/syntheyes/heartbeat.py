@@ -13,7 +13,9 @@ import os
 import threading
 import time
 
-from syntheyes import get_existing_connection
+from syntheyes import get_connection
+from syntheyes import metrics
+from syntheyes import sessions
 
 
 # Constants
@@ -21,13 +23,17 @@ HEARTBEAT_INTERVAL = 'SGTK_SYNTHEYES_HEARTBEAT_INTERVAL'
 HEARTBEAT_TOLERANCE = 'SGTK_SYNTHEYES_HEARTBEAT_TOLERANCE'
 
 
-def setup():
+def setup(session):
+    """
+    Starts watching the connection to the SynthEyes of session
+    """
     heartbeat = threading.Thread(target=heartbeat_thread_run,
-                                 name="HeartbeatThread")
+                                 args=(session,),
+                                 name="HeartbeatThread-%d" % session.port)
     heartbeat.start()
 
 
-def heartbeat_thread_run():
+def heartbeat_thread_run(session):
     logger = logging.getLogger('sgtk.syntheyes.heartbeat')
 
     try:
@@ -42,18 +48,56 @@ def heartbeat_thread_run():
         logger.error("Error setting tolerance from %s: %s", HEARTBEAT_TOLERANCE,
                      os.getenv(HEARTBEAT_TOLERANCE))
 
+    heartbeat_seconds = metrics.g_registry.histogram(
+        "syntheyes_heartbeat_seconds",
+        "Time to connect to SynthEyes and check the connection")
+    heartbeat_failures = metrics.g_registry.counter(
+        "syntheyes_heartbeat_failures_total",
+        "Number of heartbeats without a connection to SynthEyes")
+
     error_cycle = 0
     while True:
         time.sleep(interval)
         try:
-            hlev = get_existing_connection()
-            if not hlev.core.OK():
+            with heartbeat_seconds.time():
+                hlev = get_connection(session.port, session.pin)
+                ok = hlev.core.OK()
+            if not ok:
                 logger.error("Heartbeat: No connection.")
+                heartbeat_failures.inc()
                 error_cycle += 1
         except Exception, e:
+            heartbeat_failures.inc()
             logger.exception("Python: Heartbeat unknown exception: %s" % e)
 
         if error_cycle >= tolerance:
+            sessions.g_sessions.close(session)
+            if sessions.g_sessions.all():
+                logger.info("Heartbeat errors greater than tolerance. "
+                            "Closed %s", session)
+                return
+            if _wait_for_reattach(logger):
+                return
             msg = "Python: Quitting. Heartbeat errors greater than tolerance."
             logger.error(msg)
+            broker = sessions.g_broker
+            if broker:
+                broker.stop()
+            # os._exit skips atexit
+            metrics.shutdown()
             os._exit(0)
+
+
+def _wait_for_reattach(logger):
+    """
+    Keeps the backend dormant until a restarted SynthEyes re-attaches.
+    Returns True if one did, its session has a heartbeat of its own.
+    """
+    timeout = sessions.dormant_timeout()
+    if not timeout or sessions.g_broker is None:
+        return False
+    logger.info("Lost SynthEyes, waiting %.0fs for it to re-attach", timeout)
+    if sessions.g_sessions.wait_for_session(timeout):
+        logger.info("SynthEyes re-attached")
+        return True
+    return False
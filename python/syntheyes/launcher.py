@@ -0,0 +1,128 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Non-blocking launching of external programs
+
+Programs are started and reaped on the "launcher" task queue, which caps
+how many of them run at a time. Identical launches within a short window
+are dropped, so double clicks don't open everything twice. Failures are
+reported to the log.
+"""
+import logging
+import subprocess
+import sys
+import threading
+import time
+import webbrowser
+
+from syntheyes import tasks
+
+
+QUEUE = "launcher"
+MAX_CONCURRENT = 4
+DEDUPE_WINDOW = 2.0
+
+
+class Launcher(object):
+    _logger = logging.getLogger('sgtk.syntheyes.launcher')
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT,
+                 dedupe_window=DEDUPE_WINDOW):
+        self.dedupe_window = dedupe_window
+        self._lock = threading.Lock()
+        self._recent = {}
+        tasks.g_executor.add_queue(QUEUE, max_concurrent)
+
+    def launch(self, args):
+        """
+        Runs the command line args without waiting for it. args is a list,
+        or a string on Windows where it is passed on as it is.
+        Returns the Task or None if an identical launch was just made.
+        """
+        if isinstance(args, basestring):
+            key = ("launch", args)
+            name = args.split()[0]
+        else:
+            key = ("launch",) + tuple(args)
+            name = args[0]
+        if not self._should_launch(key):
+            return None
+        return tasks.submit(self._run, args, name=name, queue=QUEUE)
+
+    def open_url(self, url):
+        """
+        Opens url in the web browser
+        """
+        if not self._should_launch(("url", url)):
+            return None
+        return tasks.submit(self._open_url, url, name="open url",
+                            queue=QUEUE)
+
+    def open_path(self, path):
+        """
+        Shows path in the platform's file browser
+        """
+        if sys.platform.startswith("linux"):
+            args = ["xdg-open", path]
+        elif sys.platform == "darwin":
+            args = ["open", path]
+        elif sys.platform == "win32":
+            # start needs a quoted title, which a list would escape
+            args = 'cmd.exe /C start "Folder" "%s"' % path
+        else:
+            raise Exception("Platform '%s' is not supported." % sys.platform)
+        return self.launch(args)
+
+    def _should_launch(self, key):
+        now = time.time()
+        with self._lock:
+            # forget launches that are out of the window
+            for recent_key, launched in self._recent.items():
+                if now - launched > self.dedupe_window:
+                    del self._recent[recent_key]
+            if key in self._recent:
+                self._logger.debug("Skipping repeated launch %s", key)
+                return False
+            self._recent[key] = now
+            return True
+
+    def _run(self, task, args):
+        try:
+            process = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT)
+        except OSError as e:
+            self._logger.error("Failed to launch %s: %s", args, e)
+            raise
+        output = process.communicate()[0]
+        if process.returncode != 0:
+            if not isinstance(args, basestring):
+                args = " ".join(args)
+            self._logger.error("Failed to launch '%s' (exit code %d): %s",
+                               args, process.returncode, output.strip())
+        return process.returncode
+
+    def _open_url(self, task, url):
+        if not webbrowser.open(url, autoraise=True):
+            self._logger.error("Failed to open %s", url)
+
+g_launcher = Launcher()
+
+
+def message_box_args(message):
+    """
+    Returns the command line showing message in an alert on OSX
+    """
+    message = message.replace("\\", "\\\\").replace('"', '\\"')
+    return ["osascript",
+            "-e", 'tell app "System Events" to activate',
+            "-e", 'tell app "System Events" to display dialog "%s" '
+                  'with icon caution buttons "Sorry!"' % message]
@@ -0,0 +1,375 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Memory diagnostics for long running backends
+
+Snapshots of the Python heap and of the live Qt widgets are taken every
+SGTK_SYNTHEYES_MEMORY_INTERVAL seconds and whenever the report is shown.
+Every snapshot is compared to a baseline taken once the engine is up, and
+the report of the largest growth is written to the memory directory in the
+log directory. Snapshots are taken on a background thread, only the
+widgets and counters touching Qt are read in the main thread.
+
+The Python heap is traced with tracemalloc, keeping
+SGTK_SYNTHEYES_MEMORY_DEPTH frames per allocation. Interpreters without
+tracemalloc fall back to counting the objects tracked by the garbage
+collector per type. The backend runs on the Python 2.7 of SynthEyes, which
+has no tracemalloc, so in production the report always counts objects and
+SGTK_SYNTHEYES_MEMORY_DEPTH has no effect. The tracemalloc reports are
+only available when the backend runs on Python 3.
+"""
+import collections
+import gc
+import logging
+import os
+import threading
+import time
+
+from syntheyes import callback_event
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+# Constants
+MEMORY_INTERVAL = 'SGTK_SYNTHEYES_MEMORY_INTERVAL'
+MEMORY_DEPTH = 'SGTK_SYNTHEYES_MEMORY_DEPTH'
+MEMORY_DIR = 'SGTK_SYNTHEYES_MEMORY_DIR'
+# growth sites and widget classes listed per report
+TOP_COUNT = 25
+# reports kept on disk per process
+MAX_FILES = 100
+MAX_HISTORY = 200
+# seconds a snapshot waits for the main thread to count the widgets
+MAIN_THREAD_TIMEOUT = 60.0
+
+g_monitor = None
+
+
+def _peak_rss():
+    """
+    Returns the peak resident size of the process in bytes, or None
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on OS X
+    return rss if os.uname()[0] == "Darwin" else rss * 1024
+
+
+def _object_counts():
+    counts = collections.defaultdict(int)
+    for obj in gc.get_objects():
+        cls = getattr(obj, "__class__", type(obj))
+        counts["%s.%s" % (getattr(cls, "__module__", "?"),
+                          getattr(cls, "__name__", "?"))] += 1
+    return counts
+
+
+def _widget_counts():
+    """
+    Returns the number of live widgets per class. Has to be called in the
+    main thread.
+    """
+    try:
+        from PySide import QtGui
+    except ImportError:
+        return {}
+    counts = collections.defaultdict(int)
+    for widget in QtGui.QApplication.allWidgets():
+        counts[widget.metaObject().className()] += 1
+    return counts
+
+
+def _count_diff(counts, baseline):
+    """
+    Returns (key, count, growth) tuples sorted by the growth
+    """
+    keys = set(counts) | set(baseline)
+    diff = [(k, counts.get(k, 0), counts.get(k, 0) - baseline.get(k, 0))
+            for k in keys]
+    return sorted(diff, key=lambda item: (-item[2], item[0]))
+
+
+class Snapshot(object):
+    def __init__(self, python, widgets, counters):
+        self.time = time.time()
+        # tracemalloc.Snapshot or a dict of object counts per type
+        self.python = python
+        self.widgets = widgets
+        self.counters = counters
+        self.rss = _peak_rss()
+        if tracemalloc is not None:
+            self.traced = tracemalloc.get_traced_memory()[0]
+        else:
+            self.traced = sum(python.values())
+
+    @property
+    def widget_total(self):
+        return sum(self.widgets.values())
+
+
+class MemoryMonitor(object):
+    def __init__(self, interval, depth, directory):
+        self._logger = logging.getLogger('sgtk.syntheyes.memory')
+        self.interval = interval
+        self.depth = depth
+        self.directory = directory
+        self.baseline = None
+        self.history = collections.deque(maxlen=MAX_HISTORY)
+        self.last_report = None
+        self._counters = []
+        self._lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start(self.depth)
+        if not self.interval:
+            return
+        thread = threading.Thread(target=self._run, name="MemoryThread")
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.snapshot()
+            except Exception:
+                self._logger.exception("Could not take memory snapshot")
+
+    def add_counter(self, name, count_fn, main_thread=False):
+        """
+        Adds a size reported with every snapshot, e.g. of a cache. Counters
+        touching Qt have to be read in the main thread.
+        """
+        self._counters.append((name, count_fn, main_thread))
+
+    def _read_counters(self, main_thread):
+        counters = []
+        for name, count_fn, in_main_thread in self._counters:
+            if in_main_thread != main_thread:
+                continue
+            try:
+                counters.append((name, count_fn()))
+            except Exception as e:
+                counters.append((name, "error: %s" % e))
+        return counters
+
+    def _read_main_thread(self):
+        """
+        Returns the widget counts and the counters read in the main thread
+        """
+        if isinstance(threading.current_thread(), threading._MainThread):
+            return _widget_counts(), self._read_counters(True)
+        result = []
+        done = threading.Event()
+
+        def read():
+            try:
+                result.append((_widget_counts(), self._read_counters(True)))
+            finally:
+                done.set()
+        read._tkLog = False
+        callback_event.send_to_main_thread(read)
+        if not done.wait(MAIN_THREAD_TIMEOUT) or not result:
+            self._logger.warning("Main thread busy, memory snapshot without "
+                                 "widgets")
+            return {}, []
+        return result[0]
+
+    def _take(self):
+        if tracemalloc is not None:
+            python = tracemalloc.take_snapshot().filter_traces(
+                (tracemalloc.Filter(False, tracemalloc.__file__),))
+        else:
+            python = _object_counts()
+        widgets, counters = self._read_main_thread()
+        return Snapshot(python, widgets,
+                        counters + self._read_counters(False))
+
+    def _in_background(self, fn):
+        """
+        Runs fn on a background thread unless it is running already
+        """
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=fn,
+                                            name="MemorySnapshotThread")
+            self._thread.daemon = True
+            self._thread.start()
+
+    ############################################################################
+    # public methods
+
+    def set_baseline(self):
+        """
+        Takes the snapshot later snapshots are compared to. Must not be
+        called in the main thread, which would wait for itself; use
+        set_baseline_later there.
+        """
+        with self._lock:
+            self.baseline = self._take()
+        self._logger.debug("Memory baseline taken")
+
+    def set_baseline_later(self):
+        """
+        Takes the baseline on a background thread
+        """
+        self._in_background(self.set_baseline)
+
+    def snapshot(self):
+        """
+        Takes a snapshot, writes its report to disk and returns the report.
+        Must not be called in the main thread.
+        """
+        with self._lock:
+            if self.baseline is None:
+                self.baseline = self._take()
+            current = self._take()
+            self.history.append((current.time, current.traced,
+                                 current.widget_total, current.rss))
+            report = self._format(current)
+            self.last_report = report
+        self._write(report)
+        return report
+
+    def format_report(self):
+        """
+        Returns the report of the last snapshot and takes a new one in the
+        background, shown the next time the report is refreshed
+        """
+        self._in_background(self.snapshot)
+        if self.last_report is None:
+            return "Taking the first memory snapshot, refresh in a moment."
+        return "%s\n\nTaking a new snapshot, refresh in a moment." % \
+            self.last_report
+
+    ############################################################################
+    # reports
+
+    def _python_growth(self, current):
+        if tracemalloc is None:
+            lines = ["%10s %10s  %s" % ("objects", "growth", "type")]
+            for name, count, growth in _count_diff(
+                    current.python, self.baseline.python)[:TOP_COUNT]:
+                lines.append("%10d %+10d  %s" % (count, growth, name))
+            return lines
+
+        key_type = "traceback" if self.depth > 1 else "lineno"
+        lines = ["%10s %10s %10s  %s" % ("size", "growth", "blocks",
+                                         "allocated at")]
+        for stat in current.python.compare_to(self.baseline.python,
+                                              key_type)[:TOP_COUNT]:
+            # innermost frame first
+            frames = ["%s:%d" % (f.filename, f.lineno)
+                      for f in reversed(stat.traceback)] or ["?"]
+            lines.append("%9.1fK %+9.1fK %+10d  %s" % (
+                stat.size / 1024.0, stat.size_diff / 1024.0,
+                stat.count_diff, frames[0]))
+            lines.extend("%34s%s" % ("", f) for f in frames[1:])
+        return lines
+
+    def _format(self, current):
+        baseline = self.baseline
+        if tracemalloc is not None:
+            heap = "%.1f MB traced by tracemalloc, %+.1f MB" % (
+                current.traced / 1048576.0,
+                (current.traced - baseline.traced) / 1048576.0)
+        else:
+            heap = "%d objects tracked by the garbage collector, %+d" % (
+                current.traced, current.traced - baseline.traced)
+        lines = ["Snapshot of %s compared to the baseline of %s" %
+                 (time.ctime(current.time), time.ctime(baseline.time)),
+                 "",
+                 "Python heap: %s" % heap,
+                 "Qt widgets: %d, %+d" % (current.widget_total,
+                                          current.widget_total -
+                                          baseline.widget_total)]
+        if current.rss is not None:
+            lines.append("Peak resident size: %.1f MB" %
+                         (current.rss / 1048576.0))
+        for name, value in current.counters:
+            lines.append("%s: %s" % (name, value))
+
+        lines.extend(["", "Largest Python heap growth:"])
+        lines.extend(self._python_growth(current))
+
+        lines.extend(["", "Qt widgets per class:",
+                      "%10s %10s  %s" % ("widgets", "growth", "class")])
+        for name, count, growth in _count_diff(
+                current.widgets, baseline.widgets)[:TOP_COUNT]:
+            lines.append("%10d %+10d  %s" % (count, growth, name))
+
+        lines.extend(["", "History:",
+                      "%24s %12s %10s" % ("time", "heap", "widgets")])
+        for timestamp, traced, widgets, _ in self.history:
+            lines.append("%24s %12d %10d" % (time.ctime(timestamp), traced,
+                                              widgets))
+        return "\n".join(lines)
+
+    def _write(self, report):
+        try:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            prefix = "memory-%d-" % os.getpid()
+            path = os.path.join(self.directory, "%s%s.txt" % (
+                prefix, time.strftime("%Y%m%d-%H%M%S")))
+            with open(path, "w") as file_:
+                file_.write(report)
+            written = sorted(n for n in os.listdir(self.directory)
+                             if n.startswith(prefix))
+            for name in written[:-MAX_FILES]:
+                os.remove(os.path.join(self.directory, name))
+        except (IOError, OSError):
+            self._logger.exception("Could not write memory report")
+            return
+        self._logger.debug("Wrote memory report to %s", path)
+
+
+def setup():
+    """
+    Starts the memory monitor. Has to be called from the main thread.
+    """
+    global g_monitor
+    logger = logging.getLogger('sgtk.syntheyes.memory')
+
+    try:
+        interval = float(os.getenv(MEMORY_INTERVAL, '1800'))
+    except ValueError:
+        logger.error("Error setting interval from %s: %s", MEMORY_INTERVAL,
+                     os.getenv(MEMORY_INTERVAL))
+        interval = 1800.0
+
+    try:
+        depth = max(1, int(os.getenv(MEMORY_DEPTH, '1')))
+    except ValueError:
+        logger.error("Error setting depth from %s: %s", MEMORY_DEPTH,
+                     os.getenv(MEMORY_DEPTH))
+        depth = 1
+
+    directory = os.getenv(MEMORY_DIR)
+    if not directory:
+        from syntheyes import get_log_dir
+        directory = os.path.join(get_log_dir(), "memory")
+
+    if tracemalloc is None:
+        logger.debug("tracemalloc is not available, counting objects")
+    g_monitor = MemoryMonitor(max(0.0, interval), depth, directory)
+    g_monitor.start()
+    return g_monitor
@@ -0,0 +1,369 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Minimal metrics registry with Prometheus text format exporters
+
+Metrics are collected in the process wide registry g_registry and can be
+exported either as a file for a node local textfile collector or served on
+a localhost port.
+"""
+import atexit
+import BaseHTTPServer
+import errno
+import logging
+import os
+import re
+import threading
+import time
+
+
+# Constants
+METRICS_DIR = 'SGTK_SYNTHEYES_METRICS_DIR'
+METRICS_PORT = 'SGTK_SYNTHEYES_METRICS_PORT'
+METRICS_INTERVAL = 'SGTK_SYNTHEYES_METRICS_INTERVAL'
+# metrics files of the backends, with their pid
+FILE_REGEX = re.compile(r"^tk-syntheyes-(\d+)\.prom(?:\.tmp)?$")
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        if isinstance(value, unicode):
+            value = value.encode("utf-8")
+        value = str(value).replace('\\', r'\\').replace('"', r'\"')
+        escaped.append('%s="%s"' % (name, value.replace('\n', r'\n')))
+    return "{%s}" % ",".join(escaped)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def expose(self):
+        lines = ["# HELP %s %s" % (self.name, self.help),
+                 "# TYPE %s %s" % (self.name, self.kind)]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.extend(self._expose_value(key, value))
+        return lines
+
+    def _expose_value(self, key, value):
+        return ["%s%s %s" % (self.name, _format_labels(key),
+                             _format_value(value))]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help_text)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # one count per bucket followed by the sum
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-1] += value
+
+    def time(self, **labels):
+        """
+        Returns a context manager observing the time spent in its block
+        """
+        return _Timer(self, labels)
+
+    def _expose_value(self, key, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts[:-1]):
+            cumulative += count
+            lines.append("%s_bucket%s %d" % (
+                self.name, _format_labels(key, [("le", _format_value(bound))]),
+                cumulative))
+        lines.append("%s_sum%s %s" % (self.name, _format_labels(key),
+                                      _format_value(counts[-1])))
+        lines.append("%s_count%s %d" % (self.name, _format_labels(key),
+                                        cumulative))
+        return lines
+
+
+class _Timer(object):
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.time() - self._start, **self._labels)
+        return False
+
+
+class Registry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, cls, name, help_text, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError("Metric %s already registered as %s" %
+                                 (name, metric.kind))
+            return metric
+
+    def counter(self, name, help_text):
+        return self._get(Counter, name, help_text)
+
+    def gauge(self, name, help_text):
+        return self._get(Gauge, name, help_text)
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, buckets=buckets)
+
+    def expose(self):
+        """
+        Returns all metrics in the Prometheus text format
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+g_registry = Registry()
+g_file_exporter = None
+
+
+class MetricsLogHandler(logging.Handler):
+    """
+    Counts log records by level
+    """
+    def __init__(self, registry=g_registry):
+        logging.Handler.__init__(self)
+        self._records = registry.counter("syntheyes_log_records_total",
+                                         "Number of log records emitted")
+
+    def emit(self, record):
+        self._records.inc(level=record.levelname)
+
+
+################################################################################
+# exporters
+
+def _pid_running(pid):
+    if os.name == "nt":
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        # SYNCHRONIZE access is enough to tell whether the process exists
+        handle = kernel32.OpenProcess(0x100000, False, pid)
+        if not handle:
+            return False
+        kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+class FileExporter(object):
+    """
+    Periodically writes the registry to a .prom file, e.g. for the textfile
+    collector of the Prometheus node exporter
+    """
+    def __init__(self, directory, interval, registry=g_registry):
+        self.directory = directory
+        self.path = os.path.join(directory,
+                                 "tk-syntheyes-%d.prom" % os.getpid())
+        self.interval = interval
+        self._registry = registry
+        self._stopped = False
+
+    def start(self):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self.remove_stale()
+        # the backend usually quits with os._exit, which skips atexit, so
+        # it calls remove() itself
+        atexit.register(self.remove)
+        thread = threading.Thread(target=self._run,
+                                  name="MetricsExporterThread")
+        thread.daemon = True
+        thread.start()
+
+    def write(self):
+        # write next to the target and rename, scrapers never see half a file
+        temp_path = "%s.tmp" % self.path
+        with open(temp_path, "w") as file_:
+            file_.write(self._registry.expose())
+        if os.path.exists(self.path) and os.name == "nt":
+            os.remove(self.path)
+        os.rename(temp_path, self.path)
+
+    def remove(self):
+        self._stopped = True
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def remove_stale(self):
+        """
+        Removes the files of backends that quit without removing theirs,
+        they would be scraped forever
+        """
+        logger = logging.getLogger('sgtk.syntheyes.metrics')
+        for name in os.listdir(self.directory):
+            match = FILE_REGEX.match(name)
+            if not match or _pid_running(int(match.group(1))):
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+                logger.debug("Removed stale metrics file %s", name)
+            except OSError:
+                # removed by another backend meanwhile
+                pass
+
+    def _run(self):
+        logger = logging.getLogger('sgtk.syntheyes.metrics')
+        while not self._stopped:
+            try:
+                self.write()
+            except Exception:
+                logger.exception("Could not write metrics to %s", self.path)
+            time.sleep(self.interval)
+
+
+class _MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    registry = g_registry
+
+    def do_GET(self):
+        body = self.registry.expose()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # don't spam stderr with every scrape
+        pass
+
+
+class HttpExporter(object):
+    """
+    Serves the registry on a localhost port
+    """
+    def __init__(self, port):
+        self.port = port
+
+    def start(self):
+        self._server = BaseHTTPServer.HTTPServer(("127.0.0.1", self.port),
+                                                 _MetricsRequestHandler)
+        thread = threading.Thread(target=self._server.serve_forever,
+                                  name="MetricsServerThread")
+        thread.daemon = True
+        thread.start()
+
+
+def setup():
+    """
+    Starts the exporters configured in the environment
+    """
+    logger = logging.getLogger('sgtk.syntheyes.metrics')
+
+    try:
+        interval = float(os.getenv(METRICS_INTERVAL, '15'))
+    except ValueError:
+        logger.error("Error setting interval from %s: %s", METRICS_INTERVAL,
+                     os.getenv(METRICS_INTERVAL))
+        interval = 15.0
+
+    global g_file_exporter
+    directory = os.getenv(METRICS_DIR)
+    if directory:
+        g_file_exporter = FileExporter(directory, interval)
+        g_file_exporter.start()
+        logger.debug("Writing metrics to %s", directory)
+
+    port = os.getenv(METRICS_PORT)
+    if port:
+        try:
+            HttpExporter(int(port)).start()
+            logger.debug("Serving metrics on port %s", port)
+        except Exception:
+            logger.exception("Could not serve metrics on port %s", port)
+
+
+def shutdown():
+    """
+    Removes the metrics file of this process. Call it before quitting with
+    os._exit, which skips the atexit handlers.
+    """
+    if g_file_exporter is not None:
+        g_file_exporter.remove()
@@ -0,0 +1,304 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Recording and replaying of SyPy traffic
+
+When SGTK_SYNTHEYES_RECORD_DIR is set every SyPy call made through
+get_existing_connection is appended to a binary journal in that directory.
+A journal can be summarized or replayed against a fake or real SynthEyes:
+
+    python recorder.py summary JOURNAL
+    python recorder.py replay JOURNAL [--fake] [--port PORT --pin PIN]
+
+Replaying re-issues the recorded calls, including the ones modifying the
+scene, so don't replay against a SynthEyes with unsaved work.
+"""
+import atexit
+import hashlib
+import logging
+import marshal
+import os
+import struct
+import sys
+import threading
+import time
+
+
+# Constants
+RECORD_DIR = 'SGTK_SYNTHEYES_RECORD_DIR'
+MAGIC = "SYJ1"
+# timestamp, duration, response size, ok, method, thread and payload sizes
+_HEADER = struct.Struct("<dfIBHHI")
+_DIGEST_SIZE = 8
+# flush the journal at most this often, in seconds
+FLUSH_INTERVAL = 1.0
+
+
+class CallRecord(object):
+    def __init__(self, timestamp, duration, method, thread, digest,
+                 response_size, ok, payload):
+        self.timestamp = timestamp
+        self.duration = duration
+        self.method = method
+        self.thread = thread
+        self.digest = digest
+        self.response_size = response_size
+        self.ok = ok
+        self.payload = payload
+
+    @property
+    def args(self):
+        """
+        The recorded (args, kwargs) or None if they could not be recorded
+        """
+        if not self.payload:
+            return None
+        return marshal.loads(self.payload)
+
+
+class JournalWriter(object):
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._last_flush = time.time()
+
+    def write(self, record):
+        method = record.method.encode("utf-8")
+        thread = record.thread.encode("utf-8")
+        data = "".join([_HEADER.pack(record.timestamp, record.duration,
+                                     record.response_size, record.ok,
+                                     len(method), len(thread),
+                                     len(record.payload)),
+                        record.digest, method, thread, record.payload])
+        with self._lock:
+            self._file.write(data)
+            if record.timestamp - self._last_flush > FLUSH_INTERVAL:
+                self._file.flush()
+                self._last_flush = record.timestamp
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_journal(path):
+    """
+    Yields the CallRecords stored in a journal
+    """
+    with open(path, "rb") as file_:
+        if file_.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a SyPy journal" % path)
+        while True:
+            header = file_.read(_HEADER.size)
+            if len(header) < _HEADER.size:
+                # end of file or a record cut off by a crash
+                return
+            (timestamp, duration, response_size, ok, method_size,
+             thread_size, payload_size) = _HEADER.unpack(header)
+            body = file_.read(_DIGEST_SIZE + method_size + thread_size +
+                              payload_size)
+            if len(body) < _DIGEST_SIZE + method_size + thread_size:
+                return
+            digest = body[:_DIGEST_SIZE]
+            offset = _DIGEST_SIZE
+            method = body[offset:offset + method_size].decode("utf-8")
+            offset += method_size
+            thread = body[offset:offset + thread_size].decode("utf-8")
+            offset += thread_size
+            yield CallRecord(timestamp, duration, method, thread, digest,
+                             response_size, bool(ok), body[offset:])
+
+
+def _marshal(value):
+    try:
+        return marshal.dumps(value)
+    except ValueError:
+        return None
+
+
+class Recorder(object):
+    """
+    Connection interceptor appending every call to a journal
+    """
+    def __init__(self, writer):
+        self.writer = writer
+
+    def __call__(self, path, args, kwargs, proceed):
+        payload = _marshal((args, kwargs))
+        if payload is None:
+            payload = ""
+            digest = hashlib.sha1(repr((args, kwargs))).digest()
+        else:
+            digest = hashlib.sha1(payload).digest()
+
+        start = time.time()
+        ok = True
+        result = None
+        try:
+            result = proceed()
+            return result
+        except Exception:
+            ok = False
+            raise
+        finally:
+            duration = time.time() - start
+            response = _marshal(result)
+            if response is None:
+                response = repr(result)
+            self.writer.write(CallRecord(
+                start, duration, path, threading.current_thread().name,
+                digest[:_DIGEST_SIZE], len(response), ok, payload))
+
+
+def setup():
+    """
+    Starts recording if SGTK_SYNTHEYES_RECORD_DIR is set
+    """
+    directory = os.getenv(RECORD_DIR)
+    if not directory:
+        return None
+
+    from syntheyes import add_connection_interceptor
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, "sypy-%s-%d.journal" %
+                        (time.strftime("%Y%m%d-%H%M%S"), os.getpid()))
+    writer = JournalWriter(path)
+    atexit.register(writer.close)
+    recorder = Recorder(writer)
+    add_connection_interceptor(recorder)
+    logging.getLogger('sgtk.syntheyes.recorder').info(
+        "Recording SyPy traffic to %s", path)
+    return recorder
+
+
+################################################################################
+# analysis and replay
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def format_latencies(durations_by_key, title):
+    lines = ["%8s %10s %10s %10s %10s  %s" % ("count", "total", "mean", "p95",
+                                               "max", title)]
+    rows = sorted(durations_by_key.items(), key=lambda item: sum(item[1]),
+                  reverse=True)
+    for key, durations in rows:
+        total = sum(durations)
+        lines.append("%8d %9.3fs %8.2fms %8.2fms %8.2fms  %s" % (
+            len(durations), total, total / len(durations) * 1000,
+            _percentile(durations, 0.95) * 1000, max(durations) * 1000, key))
+    return "\n".join(lines)
+
+
+def summarize(records):
+    """
+    Returns a report of the recorded latencies per method and the number of
+    calls per thread
+    """
+    by_method = {}
+    by_thread = {}
+    response_bytes = 0
+    for record in records:
+        by_method.setdefault(record.method, []).append(record.duration)
+        by_thread.setdefault(record.thread, []).append(record.duration)
+        response_bytes += record.response_size
+    if not by_method:
+        return "Journal is empty."
+
+    durations = [d for values in by_method.values() for d in values]
+    return "\n".join([
+        "%d calls, %.3fs in SyPy, %d response bytes" % (
+            len(durations), sum(durations), response_bytes),
+        "", format_latencies(by_method, "method"),
+        "", format_latencies(by_thread, "thread")])
+
+
+def replay(records, connection):
+    """
+    Re-issues the recorded calls on connection in their original order.
+    Returns a report comparing the recorded and replayed latencies.
+    """
+    recorded = {}
+    replayed = {}
+    skipped = 0
+    for record in records:
+        call_args = record.args
+        if call_args is None:
+            skipped += 1
+            continue
+        args, kwargs = call_args
+
+        target = connection
+        for name in record.method.split("."):
+            target = getattr(target, name)
+
+        start = time.time()
+        try:
+            target(*args, **kwargs)
+        except Exception:
+            pass
+        replayed.setdefault(record.method, []).append(time.time() - start)
+        recorded.setdefault(record.method, []).append(record.duration)
+
+    total_recorded = sum(sum(d) for d in recorded.values())
+    total_replayed = sum(sum(d) for d in replayed.values())
+    return "\n".join([
+        "%d calls replayed, %d skipped without recorded arguments" % (
+            sum(len(d) for d in replayed.values()), skipped),
+        "recorded %.3fs, replayed %.3fs" % (total_recorded, total_replayed),
+        "", "Recorded:", format_latencies(recorded, "method"),
+        "", "Replayed:", format_latencies(replayed, "method")])
+
+
+def main(argv):
+    import optparse
+    parser = optparse.OptionParser(usage=__doc__.strip())
+    parser.add_option("--fake", action="store_true", default=False,
+                      help="replay against the fake SyPy of the benchmarks")
+    parser.add_option("--latency", type="float", default=0.0,
+                      help="artificial latency of the fake SyPy in seconds")
+    parser.add_option("--port", type="int")
+    parser.add_option("--pin")
+    options, args = parser.parse_args(argv)
+    if len(args) != 2 or args[0] not in ("summary", "replay"):
+        parser.error("expected summary or replay and a journal")
+    command, path = args
+
+    if command == "summary":
+        print summarize(read_journal(path))
+        return 0
+
+    if options.fake:
+        benchmarks = os.path.join(os.path.dirname(__file__), "..", "..",
+                                  "benchmarks")
+        sys.path.insert(0, os.path.abspath(benchmarks))
+        import fake_sypy
+        fake_sypy.latency = options.latency
+        SyPy = fake_sypy.install()
+    else:
+        import SyPy
+
+    connection = SyPy.SyLevel()
+    connection.OpenExisting(options.port, options.pin)
+    print replay(read_journal(path), connection)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,385 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+SynthEyes sessions served by this Python backend
+
+A session is one running SynthEyes, identified by the port and pin of its
+SyPy server. The backend always serves the session it was launched for.
+With SGTK_SYNTHEYES_MULTI_SESSION set, a backend also offers a broker on a
+localhost port. Backends launched later by other SynthEyes instances of the
+same user hand their port and pin over to it and exit, instead of starting
+their own PySide application and Toolkit engine.
+
+Panel commands, the dialogs they open and the tasks they submit are bound
+to the session of their panel, and their SyPy connections go to it.
+
+Toolkit runs a single engine per process, so sessions share the engine and
+its context. A handoff for a different context is refused and the new
+backend starts on its own.
+
+With SGTK_SYNTHEYES_DORMANT_TIMEOUT set, a backend that lost its last
+SynthEyes stays dormant for that many seconds instead of quitting. A
+SynthEyes started meanwhile for the same context re-attaches to it and gets
+the already initialized engine and apps.
+"""
+import getpass
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+from syntheyes import metrics
+
+
+# Constants
+SGTK_SYNTHEYES_PORT = 'SGTK_SYNTHEYES_PORT'
+SGTK_SYNTHEYES_PIN = 'SGTK_SYNTHEYES_PIN'
+MULTI_SESSION = 'SGTK_SYNTHEYES_MULTI_SESSION'
+DORMANT_TIMEOUT = 'SGTK_SYNTHEYES_DORMANT_TIMEOUT'
+# seconds a handoff waits for the broker to accept or refuse it
+HANDOFF_TIMEOUT = 30.0
+
+_logger = logging.getLogger('sgtk.syntheyes.sessions')
+_sessions_gauge = metrics.g_registry.gauge(
+    "syntheyes_sessions", "Number of SynthEyes sessions served by this "
+    "process")
+
+
+class Session(object):
+    def __init__(self, port, pin):
+        self.port = int(port)
+        self.pin = pin
+        # filled in by the engine for sessions that have their own panel
+        self.ui = None
+        self.panel_generator = None
+
+    @property
+    def id(self):
+        return self.port
+
+    def __repr__(self):
+        return "<Session %d>" % self.port
+
+
+class SessionRegistry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._added = threading.Condition(self._lock)
+        self._sessions = {}
+        self._active = None
+        self._closed_listeners = []
+
+    def add(self, session):
+        with self._lock:
+            self._sessions[session.id] = session
+            if self._active is None:
+                self._active = session
+            count = len(self._sessions)
+            self._added.notify_all()
+        _sessions_gauge.set(count, host=socket.gethostname())
+        _logger.info("Serving %s, %d sessions", session, count)
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def all(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def active(self):
+        """
+        The session SyPy connections are opened for, the one the artist
+        last used
+        """
+        return self._active
+
+    def activate(self, session):
+        self._active = session
+
+    def add_closed_listener(self, fn):
+        """
+        Calls fn(session, remaining) in the main thread after a session
+        has been closed
+        """
+        self._closed_listeners.append(fn)
+
+    def close(self, session):
+        """
+        Removes a session. Safe to call from any thread.
+        """
+        with self._lock:
+            if self._sessions.pop(session.id, None) is None:
+                return
+            if self._active is session:
+                self._active = next(iter(self._sessions.values()), None)
+            remaining = len(self._sessions)
+        _sessions_gauge.set(remaining, host=socket.gethostname())
+        _logger.info("Closed %s, %d sessions left", session, remaining)
+        from syntheyes import callback_event
+        for fn in self._closed_listeners:
+            callback_event.send_to_main_thread(fn, session, remaining)
+
+    def wait_for_session(self, timeout):
+        """
+        Blocks until a session is served again or timeout seconds passed.
+        Returns True if there is a session.
+        """
+        deadline = time.time() + timeout
+        with self._lock:
+            while not self._sessions:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._added.wait(remaining)
+            return True
+
+g_sessions = SessionRegistry()
+_local = threading.local()
+
+
+class session_context(object):
+    """
+    Binds the SyPy connections opened and the tasks submitted in its block
+    to a session
+    """
+    def __init__(self, session):
+        self.session = session
+
+    def __enter__(self):
+        self._previous = getattr(_local, "session", None)
+        _local.session = self.session
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.session = self._previous
+        return False
+
+
+def bind(session):
+    """
+    Binds the calling thread to session until it is bound to another one
+    """
+    _local.session = session
+
+
+def current():
+    """
+    Returns the session the calling thread is bound to by the panel command,
+    dialog or task it runs for. Code not run for any of them gets the active
+    session.
+    """
+    session = getattr(_local, "session", None)
+    if session is not None:
+        return session
+    return g_sessions.active()
+
+
+def current_port_and_pin():
+    """
+    Returns the port and pin of the current session, falling back to the
+    environment the backend was launched with
+    """
+    session = current()
+    if session is not None:
+        return session.port, session.pin
+    return int(os.environ[SGTK_SYNTHEYES_PORT]), os.environ[SGTK_SYNTHEYES_PIN]
+
+
+def multi_session_enabled():
+    return os.getenv(MULTI_SESSION, '0').lower() in ('1', 'true', 'yes')
+
+
+def dormant_timeout():
+    """
+    Seconds a backend without sessions waits for a SynthEyes to re-attach
+    """
+    try:
+        return max(0.0, float(os.getenv(DORMANT_TIMEOUT, '0')))
+    except ValueError:
+        _logger.error("Error reading %s: %s", DORMANT_TIMEOUT,
+                      os.getenv(DORMANT_TIMEOUT))
+        return 0.0
+
+
+def broker_enabled():
+    """
+    Whether backends offer and try session handoffs
+    """
+    return multi_session_enabled() or dormant_timeout() > 0
+
+
+################################################################################
+# broker
+
+g_broker = None
+
+
+def _broker_file():
+    return os.path.join(tempfile.gettempdir(),
+                        "tk-syntheyes-broker-%s.json" % getpass.getuser())
+
+
+def _send(sock, message):
+    sock.sendall(json.dumps(message) + "\n")
+
+
+def _receive(sock):
+    data = ""
+    while not data.endswith("\n"):
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return json.loads(data) if data.strip() else None
+
+
+class SessionBroker(object):
+    """
+    Accepts handoffs of new SynthEyes sessions from other backends.
+
+    The accept function is called in the main thread with the handoff
+    request and returns None to accept it or a reason to refuse it.
+    """
+    def __init__(self, accept_fn):
+        self._accept_fn = accept_fn
+        self._token = uuid.uuid4().hex
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(("127.0.0.1", 0))
+        self._server.listen(5)
+        self.port = self._server.getsockname()[1]
+
+    def start(self):
+        # only processes of the same user can read the token
+        path = _broker_file()
+        temp_path = "%s.%d" % (path, os.getpid())
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        with os.fdopen(fd, "w") as file_:
+            json.dump({"port": self.port, "pid": os.getpid(),
+                       "token": self._token}, file_)
+        if os.name == "nt" and os.path.exists(path):
+            os.remove(path)
+        os.rename(temp_path, path)
+
+        thread = threading.Thread(target=self._serve, name="BrokerThread")
+        thread.daemon = True
+        thread.start()
+        global g_broker
+        g_broker = self
+        _logger.info("Session broker listening on port %d", self.port)
+
+    def stop(self):
+        """
+        Stops advertising the broker. Other backends start on their own.
+        """
+        global g_broker
+        if g_broker is self:
+            g_broker = None
+        try:
+            with open(_broker_file()) as file_:
+                if json.load(file_).get("pid") == os.getpid():
+                    os.remove(_broker_file())
+        except (IOError, OSError, ValueError):
+            pass
+
+    def _serve(self):
+        while True:
+            connection, _ = self._server.accept()
+            thread = threading.Thread(target=self._handle,
+                                      args=(connection,),
+                                      name="BrokerHandlerThread")
+            thread.daemon = True
+            thread.start()
+
+    def _handle(self, connection):
+        try:
+            connection.settimeout(HANDOFF_TIMEOUT)
+            request = _receive(connection)
+            if not request or request.get("token") != self._token:
+                _send(connection, {"accepted": False,
+                                   "reason": "invalid token"})
+                return
+
+            from syntheyes import callback_event
+            done = threading.Event()
+            state_lock = threading.Lock()
+            # "accepting" once decide started, "timed out" if it never may
+            state = {}
+            answer = {}
+
+            def decide():
+                with state_lock:
+                    if state:
+                        # the handoff timed out already
+                        return
+                    state["accepting"] = True
+                try:
+                    answer["reason"] = self._accept_fn(request)
+                except Exception as e:
+                    _logger.exception("Error accepting session handoff")
+                    answer["reason"] = str(e)
+                done.set()
+
+            callback_event.send_to_main_thread(decide)
+            if not done.wait(HANDOFF_TIMEOUT):
+                with state_lock:
+                    accepting = bool(state)
+                    if not accepting:
+                        state["timed out"] = True
+                        answer["reason"] = "backend busy"
+                if accepting:
+                    # refusing now could leave two backends on the session
+                    done.wait()
+            reason = answer.get("reason")
+            _send(connection, {"accepted": reason is None, "reason": reason})
+        except Exception:
+            _logger.exception("Error handling session handoff")
+        finally:
+            connection.close()
+
+
+def handoff(port, pin, **extra):
+    """
+    Tries to hand a new SynthEyes session over to a running backend.
+    Returns True if it was accepted. Extra values, like the serialized
+    context, are passed on to the accepting backend.
+    """
+    try:
+        with open(_broker_file()) as file_:
+            broker = json.load(file_)
+    except (IOError, OSError, ValueError):
+        return False
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(HANDOFF_TIMEOUT + 5)
+    try:
+        sock.connect(("127.0.0.1", broker["port"]))
+        request = dict(extra, token=broker["token"], port=int(port), pin=pin)
+        _send(sock, request)
+        # the broker answers within HANDOFF_TIMEOUT unless it already
+        # started accepting, then its answer has to be waited for
+        sock.settimeout(None)
+        answer = _receive(sock) or {}
+    except (socket.error, ValueError, KeyError) as e:
+        _logger.debug("No session broker available: %s", e)
+        return False
+    finally:
+        sock.close()
+
+    if not answer.get("accepted"):
+        _logger.info("Session handoff refused: %s", answer.get("reason"))
+        return False
+    return True
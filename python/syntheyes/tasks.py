@@ -0,0 +1,273 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Background task execution with results marshalled to the main thread
+
+Tasks run on a bounded number of worker threads per named queue. A task
+function receives its Task as first argument to report progress and check
+for cancellation. Done and progress callbacks are run in the main PySide
+GUI thread through callback_event, so they may update the UI.
+
+Tasks submitted while a panel command runs are attributed to it, which lets
+the panel show the command as busy until all of its tasks have returned.
+Cancelling a task only asks it to stop, its command stays busy until the
+task function returns.
+"""
+import collections
+import logging
+import threading
+
+from syntheyes import callback_event
+from syntheyes import metrics
+from syntheyes import sessions
+from syntheyes import tracing
+from syntheyes.futures import CancelledError, Future
+
+
+DEFAULT_QUEUE = "default"
+DEFAULT_WORKERS = 4
+
+_local = threading.local()
+_queued_tasks = metrics.g_registry.gauge(
+    "syntheyes_tasks_queued", "Number of background tasks waiting to run")
+_task_seconds = metrics.g_registry.histogram(
+    "syntheyes_task_seconds", "Run time of background tasks")
+
+
+class command_context(object):
+    """
+    Attributes the tasks submitted in its block to a panel command
+    """
+    def __init__(self, command):
+        self.command = command
+
+    def __enter__(self):
+        self._previous = getattr(_local, "command", None)
+        _local.command = self.command
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.command = self._previous
+        return False
+
+
+def current_command():
+    return getattr(_local, "command", None)
+
+
+class Task(Future):
+    def __init__(self, name, queue, fn, args, kwargs, command=None,
+                 session=None, on_done=None, on_progress=None):
+        super(Task, self).__init__()
+        self.name = name
+        self.queue = queue
+        self.command = command
+        # SyPy connections of the task go to the session it was submitted for
+        self.session = session
+        self.progress = 0.0
+        self.message = ""
+        self._fn = fn
+        self._args = args
+        self._kwargs = kwargs
+        self._on_progress = on_progress
+        # continue the trace of the submitting thread
+        self._span = tracing.capture()
+        if on_done:
+            self.add_done_callback(
+                lambda task: callback_event.send_to_main_thread(on_done,
+                                                                task))
+
+    def __repr__(self):
+        return "<Task %s on %s>" % (self.name, self.queue)
+
+    def report_progress(self, progress, message=""):
+        """
+        Reports progress between 0.0 and 1.0 from within the task
+        """
+        self.progress = progress
+        self.message = message
+        if self._on_progress:
+            callback_event.send_to_main_thread(self._on_progress, self,
+                                               progress, message)
+
+    def check_cancelled(self):
+        """
+        Raises CancelledError if the task has been cancelled. Long running
+        tasks should call this regularly.
+        """
+        if self.cancelled():
+            raise CancelledError("Task %s was cancelled" % self.name)
+
+    def run(self):
+        if self.cancelled():
+            return
+        try:
+            with sessions.session_context(self.session), \
+                    tracing.activate(self._span), \
+                    tracing.span(self.name, tracing.TASK, queue=self.queue), \
+                    _task_seconds.time(queue=self.queue):
+                result = self._fn(self, *self._args, **self._kwargs)
+        except Exception:
+            self.set_exception()
+        else:
+            self.set_result(result)
+
+
+class _Queue(object):
+    def __init__(self, name, max_workers):
+        self.name = name
+        self.max_workers = max_workers
+        self.pending = collections.deque()
+        self.workers = 0
+
+
+class TaskExecutor(object):
+    _logger = logging.getLogger('sgtk.syntheyes.tasks')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._running = set()
+        self._busy_commands = collections.defaultdict(int)
+        self._busy_listeners = []
+        self._shutdown = False
+        self.add_queue(DEFAULT_QUEUE, DEFAULT_WORKERS)
+
+    def add_queue(self, name, max_workers):
+        """
+        Adds a named queue running at most max_workers tasks at a time.
+        Changes the limit if the queue already exists.
+        """
+        with self._lock:
+            queue = self._queues.get(name)
+            if queue is None:
+                self._queues[name] = _Queue(name, max_workers)
+            else:
+                queue.max_workers = max_workers
+
+    def add_busy_listener(self, fn):
+        """
+        Calls fn(command, busy) in the main thread whenever a command gets
+        its first or finishes its last task
+        """
+        self._busy_listeners.append(fn)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Runs fn(task, *args, **kwargs) on a worker thread and returns the
+        Task. The keyword arguments name, queue, session, on_done(task) and
+        on_progress(task, progress, message) are used by the executor and
+        not passed on to fn. session defaults to the session of the
+        submitting thread.
+        """
+        name = kwargs.pop("name", getattr(fn, "__name__", str(fn)))
+        queue_name = kwargs.pop("queue", DEFAULT_QUEUE)
+        session = kwargs.pop("session", None) or sessions.current()
+        task = Task(name, queue_name, fn, args, kwargs,
+                    command=current_command(), session=session,
+                    on_done=kwargs.pop("on_done", None),
+                    on_progress=kwargs.pop("on_progress", None))
+
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("Task executor is shut down")
+            queue = self._queues.get(queue_name)
+            if queue is None:
+                queue = self._queues[queue_name] = _Queue(queue_name,
+                                                          DEFAULT_WORKERS)
+            queue.pending.append(task)
+            _queued_tasks.inc(queue=queue_name)
+            start_worker = queue.workers < queue.max_workers
+            if start_worker:
+                queue.workers += 1
+            if task.command:
+                self._busy_commands[task.command] += 1
+                became_busy = self._busy_commands[task.command] == 1
+
+        if task.command and became_busy:
+            self._notify_busy(task.command, True)
+        if start_worker:
+            thread = threading.Thread(target=self._work, args=(queue,),
+                                      name="TaskThread-%s" % queue_name)
+            thread.daemon = True
+            thread.start()
+        return task
+
+    def tasks(self):
+        """
+        Returns the tasks that are queued or running
+        """
+        with self._lock:
+            pending = [t for q in self._queues.values() for t in q.pending]
+            return list(self._running) + pending
+
+    def cancel(self, queue=None, command=None):
+        """
+        Cancels all tasks, or those of one queue or command
+        """
+        for task in self.tasks():
+            if queue not in (None, task.queue):
+                continue
+            if command not in (None, task.command):
+                continue
+            task.cancel()
+
+    def shutdown(self):
+        """
+        Cancels all tasks and refuses new ones
+        """
+        with self._lock:
+            self._shutdown = True
+        self.cancel()
+
+    def _work(self, queue):
+        while True:
+            with self._lock:
+                if not queue.pending:
+                    queue.workers -= 1
+                    return
+                task = queue.pending.popleft()
+                _queued_tasks.dec(queue=queue.name)
+                self._running.add(task)
+            try:
+                task.run()
+            finally:
+                with self._lock:
+                    self._running.discard(task)
+                # a cancelled task is done right away, but its command is
+                # busy until the worker actually returned from it
+                if task.command:
+                    self._task_finished(task)
+            if task.exception() and not task.cancelled():
+                self._logger.error("Task %s failed: %s", task.name,
+                                   task.exception())
+
+    def _task_finished(self, task):
+        with self._lock:
+            self._busy_commands[task.command] -= 1
+            idle = self._busy_commands[task.command] <= 0
+            if idle:
+                del self._busy_commands[task.command]
+        if idle:
+            self._notify_busy(task.command, False)
+
+    def _notify_busy(self, command, busy):
+        for fn in self._busy_listeners:
+            callback_event.send_to_main_thread(fn, command, busy)
+
+g_executor = TaskExecutor()
+
+
+def submit(fn, *args, **kwargs):
+    """
+    Submits a task to the global executor, see TaskExecutor.submit
+    """
+    return g_executor.submit(fn, *args, **kwargs)
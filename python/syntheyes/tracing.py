@@ -0,0 +1,279 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Span based tracing of panel commands
+
+A trace starts with the root span of a command clicked in the panel. Spans
+opened while a trace is active, like dialog construction or SyPy calls,
+become its children; outside a trace they cost next to nothing and are not
+recorded. The trace follows the work into the main thread and into
+background tasks through capture() and activate().
+
+Every finished span is written as a line of JSON to a file in the log
+directory and added to a per-command summary of the time spent per layer.
+"""
+import json
+import logging
+import os
+import Queue
+import threading
+import time
+import uuid
+
+
+# Constants
+TRACING = 'SGTK_SYNTHEYES_TRACING'
+TRACE_DIR = 'SGTK_SYNTHEYES_TRACE_DIR'
+
+# layers time is attributed to in the summary
+COMMAND = "command"
+DIALOG = "dialog"
+SYPY = "sypy"
+SHOTGUN = "shotgun"
+CALLBACK = "callback"
+TASK = "task"
+LAYERS = (DIALOG, SYPY, SHOTGUN, CALLBACK, TASK)
+
+_local = threading.local()
+
+
+def _new_id():
+    return uuid.uuid4().hex[:16]
+
+
+class Span(object):
+    def __init__(self, tracer, name, layer, parent=None, **attributes):
+        self._tracer = tracer
+        self.name = name
+        self.layer = layer
+        self.attributes = attributes
+        self.span_id = _new_id()
+        if parent is None:
+            self.trace_id = _new_id()
+            self.parent_id = None
+            self.root_name = name
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self.root_name = parent.root_name
+        self.thread = threading.current_thread().name
+        self.start = None
+        self.duration = None
+        self.error = None
+
+    def __enter__(self):
+        self._previous = current_span()
+        _local.span = self
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.duration = time.time() - self.start
+        if exc_type is not None:
+            self.error = "%s: %s" % (exc_type.__name__, exc_value)
+        _local.span = self._previous
+        self._tracer.finish(self)
+        return False
+
+    def to_dict(self):
+        return {"trace_id": self.trace_id, "span_id": self.span_id,
+                "parent_id": self.parent_id, "name": self.name,
+                "layer": self.layer, "command": self.root_name,
+                "thread": self.thread, "start": self.start,
+                "duration": self.duration, "error": self.error,
+                "attributes": self.attributes}
+
+
+class _NullSpan(object):
+    """
+    Stands in for spans outside of a trace
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Activation(object):
+    def __init__(self, span):
+        self._span = span
+
+    def __enter__(self):
+        self._previous = current_span()
+        _local.span = self._span
+        return self._span
+
+    def __exit__(self, *exc_info):
+        _local.span = self._previous
+        return False
+
+
+def current_span():
+    return getattr(_local, "span", None)
+
+
+def capture():
+    """
+    Returns the active span, to be activated in the thread that continues
+    the work
+    """
+    return current_span()
+
+
+def activate(span):
+    """
+    Returns a context manager making span the parent of the spans opened
+    in its block. span may be None.
+    """
+    return _Activation(span)
+
+
+class CommandSummary(object):
+    """
+    Per command counts, total latency and time per layer
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._commands = {}
+
+    def _get(self, command):
+        stats = self._commands.get(command)
+        if stats is None:
+            stats = self._commands[command] = {
+                "count": 0, "total": 0.0, "max": 0.0,
+                "layers": dict((layer, 0.0) for layer in LAYERS)}
+        return stats
+
+    def add(self, span):
+        with self._lock:
+            stats = self._get(span.root_name)
+            if span.parent_id is None:
+                stats["count"] += 1
+                stats["total"] += span.duration
+                stats["max"] = max(stats["max"], span.duration)
+            elif span.layer in stats["layers"]:
+                stats["layers"][span.layer] += span.duration
+
+    def format_report(self):
+        with self._lock:
+            commands = [(name, dict(stats, layers=dict(stats["layers"])))
+                        for (name, stats) in self._commands.items()]
+        commands = [(n, s) for (n, s) in commands if s["count"]]
+        if not commands:
+            return "No commands traced."
+
+        header = ["%6s" % "count", "%10s" % "mean", "%10s" % "max"]
+        header += ["%10s" % layer for layer in LAYERS]
+        lines = ["mean time per command run, layers include the layers "
+                 "nested in them", "", " ".join(header) + "  command"]
+        commands.sort(key=lambda item: item[1]["total"], reverse=True)
+        for name, stats in commands:
+            count = stats["count"]
+            row = ["%6d" % count,
+                   "%9.1fms" % (stats["total"] / count * 1000),
+                   "%9.1fms" % (stats["max"] * 1000)]
+            row += ["%9.1fms" % (stats["layers"][layer] / count * 1000)
+                    for layer in LAYERS]
+            lines.append(" ".join(row) + "  " + name)
+        return "\n".join(lines)
+
+
+class FileSink(object):
+    """
+    Appends finished spans as JSON lines, written on a background thread
+    """
+    def __init__(self, path):
+        self.path = path
+        self._queue = Queue.Queue()
+        thread = threading.Thread(target=self._run, name="TraceSinkThread")
+        thread.daemon = True
+        thread.start()
+
+    def __call__(self, span):
+        self._queue.put(span.to_dict())
+
+    def _run(self):
+        logger = logging.getLogger('sgtk.syntheyes.tracing')
+        while True:
+            spans = [self._queue.get()]
+            while True:
+                try:
+                    spans.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+            try:
+                with open(self.path, "a") as file_:
+                    for span in spans:
+                        file_.write(json.dumps(span, default=repr) + "\n")
+            except Exception:
+                logger.exception("Could not write traces to %s", self.path)
+
+
+class Tracer(object):
+    def __init__(self):
+        self.enabled = True
+        self.summary = CommandSummary()
+        self._sinks = [self.summary.add]
+
+    def add_sink(self, sink):
+        """
+        Calls sink(span) for every finished span
+        """
+        self._sinks.append(sink)
+
+    def span(self, name, layer, root=False, **attributes):
+        """
+        Returns a context manager timing its block as a span. Without an
+        active trace only root spans are recorded.
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        parent = current_span()
+        if parent is None and not root:
+            return _NULL_SPAN
+        return Span(self, name, layer, parent, **attributes)
+
+    def finish(self, span):
+        for sink in self._sinks:
+            try:
+                sink(span)
+            except Exception:
+                pass
+
+g_tracer = Tracer()
+
+
+def span(name, layer, root=False, **attributes):
+    return g_tracer.span(name, layer, root, **attributes)
+
+
+def setup():
+    """
+    Configures tracing from the environment
+    """
+    if os.getenv(TRACING, '1').lower() in ('0', 'false', 'no'):
+        g_tracer.enabled = False
+        return
+
+    directory = os.getenv(TRACE_DIR)
+    if not directory:
+        from syntheyes import get_log_dir
+        directory = os.path.join(get_log_dir(), "traces")
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory, "tk-syntheyes-%s-%d.jsonl" %
+                        (time.strftime("%Y%m%d-%H%M%S"), os.getpid()))
+    g_tracer.add_sink(FileSink(path))
+    logging.getLogger('sgtk.syntheyes.tracing').debug(
+        "Writing traces to %s", path)
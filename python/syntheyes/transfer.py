@@ -0,0 +1,279 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Parallel, resumable file copies for publishing
+
+Files are copied on the "transfer" task queue, several at a time. Every
+file is streamed in large chunks into "<target>.partial", hashed on the
+way, and renamed to the target once complete, so readers never see half a
+file. A sidecar "<target>.partial.json" remembers the source a partial file
+belongs to; copying the same file again after an interruption continues
+where the last attempt stopped.
+
+A copy owns its partial file through the lock file "<target>.partial.lock",
+created exclusively before the partial file is resumed or written. Locks
+of copies that died on this host are taken over, copying to a target that
+another live transfer is writing fails with TargetLockedError.
+"""
+import errno
+import hashlib
+import json
+import os
+import socket
+import threading
+
+from syntheyes import metrics
+from syntheyes import tasks
+from syntheyes.futures import CancelledError, Future
+
+
+# Constants
+QUEUE = "transfer"
+DEFAULT_WORKERS = 8
+CHUNK_SIZE = 8 * 1024 * 1024
+
+_copied_bytes = metrics.g_registry.counter(
+    "syntheyes_transfer_bytes_total", "Number of bytes copied by transfers")
+
+tasks.g_executor.add_queue(QUEUE, DEFAULT_WORKERS)
+
+
+class TargetLockedError(IOError):
+    pass
+
+
+def _sidecar(partial_path):
+    return partial_path + ".json"
+
+
+def _lock_is_stale(lock_path):
+    """
+    Returns True if the lock was left behind by a process of this host that
+    is gone
+    """
+    try:
+        with open(lock_path) as file_:
+            owner = json.load(file_)
+    except (IOError, OSError, ValueError):
+        # being written right now, or removed meanwhile
+        return False
+    if owner.get("host") != socket.gethostname():
+        return False
+    if os.name == "nt":
+        # the owner keeps the file open, it can only be removed once the
+        # owner is gone
+        return True
+    try:
+        os.kill(owner["pid"], 0)
+    except OSError as e:
+        return e.errno == errno.ESRCH
+    except (KeyError, TypeError):
+        return True
+    return False
+
+
+def _lock(partial_path):
+    """
+    Takes the lock of partial_path, returns its path and open file
+    """
+    lock_path = partial_path + ".lock"
+    for _ in range(2):
+        try:
+            fd = os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                         0644)
+        except OSError as e:
+            if e.errno != errno.EEXIST or not _lock_is_stale(lock_path):
+                break
+            try:
+                os.remove(lock_path)
+            except OSError:
+                break
+            continue
+        lock_file = os.fdopen(fd, "w")
+        json.dump({"host": socket.gethostname(), "pid": os.getpid()},
+                  lock_file)
+        lock_file.flush()
+        return lock_path, lock_file
+    raise TargetLockedError("%s is being written by another transfer, "
+                            "remove %s if it isn't" % (partial_path,
+                                                        lock_path))
+
+
+def _unlock(lock):
+    lock_path, lock_file = lock
+    lock_file.close()
+    try:
+        os.remove(lock_path)
+    except OSError:
+        pass
+
+
+def _resume_offset(source, partial_path, stat):
+    """
+    Returns how many bytes of partial_path can be kept
+    """
+    try:
+        with open(_sidecar(partial_path)) as file_:
+            info = json.load(file_)
+        size = os.path.getsize(partial_path)
+    except (IOError, OSError, ValueError):
+        return 0
+    if (info.get("source") != source or info.get("size") != stat.st_size or
+            info.get("mtime") != stat.st_mtime or size > stat.st_size):
+        return 0
+    return size
+
+
+def copy_file(source, target, checksum=True, task=None, progress=None):
+    """
+    Copies source to target and returns the sha1 of the data, or None
+    without checksum. progress(size) is called for every copied chunk.
+    """
+    stat = os.stat(source)
+    directory = os.path.dirname(target)
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # created by another transfer meanwhile
+            if not os.path.isdir(directory):
+                raise
+
+    partial_path = target + ".partial"
+    lock = _lock(partial_path)
+    try:
+        return _copy_partial(source, target, partial_path, stat, checksum,
+                             task, progress)
+    finally:
+        _unlock(lock)
+
+
+def _copy_partial(source, target, partial_path, stat, checksum, task,
+                  progress):
+    offset = _resume_offset(source, partial_path, stat)
+    digest = hashlib.sha1() if checksum else None
+    if offset and digest:
+        # hash what is already there, reading locally is cheaper than
+        # copying it again
+        with open(partial_path, "rb") as partial:
+            remaining = offset
+            while remaining:
+                chunk = partial.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                remaining -= len(chunk)
+    if not offset:
+        with open(_sidecar(partial_path), "w") as file_:
+            json.dump({"source": source, "size": stat.st_size,
+                       "mtime": stat.st_mtime}, file_)
+
+    with open(source, "rb") as source_file:
+        source_file.seek(offset)
+        with open(partial_path, "r+b" if offset else "wb") as target_file:
+            target_file.seek(offset)
+            target_file.truncate()
+            while True:
+                if task:
+                    task.check_cancelled()
+                chunk = source_file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if digest:
+                    digest.update(chunk)
+                target_file.write(chunk)
+                _copied_bytes.inc(len(chunk))
+                if progress:
+                    progress(len(chunk))
+
+    if os.stat(source).st_mtime != stat.st_mtime:
+        raise IOError("%s changed while it was copied" % source)
+    if os.name == "nt" and os.path.exists(target):
+        os.remove(target)
+    os.rename(partial_path, target)
+    os.remove(_sidecar(partial_path))
+    return digest.hexdigest() if digest else None
+
+
+class Transfer(Future):
+    """
+    Copies a list of (source, target) pairs in parallel. Resolves with a
+    dict of target -> sha1 once all files are copied, or with the first
+    error. Cancelling it cancels the remaining copies.
+    """
+    def __init__(self, pairs, checksum=True, on_progress=None):
+        super(Transfer, self).__init__()
+        self.pairs = list(pairs)
+        self.checksum = checksum
+        self.total = 0
+        self.copied = 0
+        self._on_progress = on_progress
+        self._state_lock = threading.Lock()
+        self._results = {}
+        self._tasks = []
+
+    def start(self):
+        for source, _ in self.pairs:
+            self.total += os.path.getsize(source)
+        if not self.pairs:
+            self.set_result({})
+            return self
+        self.add_done_callback(self._cancel_tasks)
+        for source, target in self.pairs:
+            task = tasks.submit(self._copy, source, target,
+                                name="Copy %s" % os.path.basename(source),
+                                queue=QUEUE)
+            task.add_done_callback(self._copy_done)
+            self._tasks.append(task)
+        return self
+
+    def _copy(self, task, source, target):
+        if self.done():
+            # failed or cancelled before this copy started
+            raise CancelledError("Transfer is already done")
+        return target, copy_file(source, target, self.checksum, task,
+                                 self._add_progress)
+
+    def _add_progress(self, size):
+        with self._state_lock:
+            self.copied += size
+            copied = self.copied
+        if self._on_progress:
+            from syntheyes import callback_event
+            callback_event.send_to_main_thread(self._on_progress, self,
+                                               copied, self.total)
+
+    def _copy_done(self, task):
+        if self.done():
+            return
+        try:
+            target, sha1 = task.result()
+        except Exception:
+            self.set_exception()
+            return
+        with self._state_lock:
+            self._results[target] = sha1
+            finished = len(self._results) == len(self.pairs)
+        if finished:
+            self.set_result(dict(self._results))
+
+    def _cancel_tasks(self, _):
+        for task in self._tasks:
+            task.cancel()
+
+
+def copy_files(pairs, checksum=True, on_progress=None):
+    """
+    Starts copying (source, target) pairs in the background and returns the
+    Transfer. on_progress(transfer, copied, total) is called in the main
+    thread.
+    """
+    return Transfer(pairs, checksum, on_progress).start()
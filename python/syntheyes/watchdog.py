@@ -0,0 +1,166 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Watchdog detecting stalls of the main PySide GUI thread
+
+A background thread regularly posts a ping to the main thread through
+callback_event. When the ping isn't answered within the threshold the main
+thread is considered stalled and its Python stack is captured.
+"""
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from syntheyes import callback_event
+
+
+# Constants
+WATCHDOG_INTERVAL = 'SGTK_SYNTHEYES_WATCHDOG_INTERVAL'
+WATCHDOG_THRESHOLD = 'SGTK_SYNTHEYES_WATCHDOG_THRESHOLD'
+MAX_RECORDS = 200
+
+g_watchdog = None
+
+
+class StallRecord(object):
+    """
+    A single stall of the main thread
+    """
+    def __init__(self, start, stack):
+        self.start = start
+        self.duration = 0.0
+        self.stack = stack
+
+    @property
+    def site(self):
+        """
+        The innermost frame of the stack as "file:line in function"
+        """
+        if not self.stack:
+            return "<unknown>"
+        filename, lineno, function, _ = self.stack[-1]
+        return "%s:%d in %s" % (os.path.basename(filename), lineno, function)
+
+
+class Watchdog(object):
+    def __init__(self, interval, threshold):
+        self._logger = logging.getLogger('sgtk.syntheyes.watchdog')
+        self.interval = interval
+        self.threshold = threshold
+        self.records = collections.deque(maxlen=MAX_RECORDS)
+        self._lock = threading.Lock()
+        self._main_thread_id = threading.current_thread().ident
+        self._pong = threading.Event()
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name="WatchdogThread")
+        thread.daemon = True
+        thread.start()
+
+    def _answer(self):
+        self._pong.set()
+    _answer._tkLog = False
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self._pong.clear()
+            sent = time.time()
+            callback_event.send_to_main_thread(self._answer)
+
+            if self._pong.wait(self.threshold):
+                continue
+
+            # stalled, take the stack while it is still blocked
+            record = StallRecord(sent, self._main_stack())
+            self._logger.warning("Main thread stalled for more than %.2fs "
+                                 "at %s", self.threshold, record.site)
+
+            while not self._pong.wait(self.interval):
+                pass
+            record.duration = time.time() - sent
+            with self._lock:
+                self.records.append(record)
+            self._logger.warning(
+                "Main thread stalled for %.2fs. Stack:\n%s", record.duration,
+                "".join(traceback.format_list(record.stack)))
+
+    def _main_stack(self):
+        frame = sys._current_frames().get(self._main_thread_id)
+        if frame is None:
+            return []
+        return traceback.extract_stack(frame)
+
+    def format_report(self):
+        """
+        Returns a summary of all recorded stalls grouped by the site the main
+        thread was blocked in
+        """
+        with self._lock:
+            records = list(self.records)
+        if not records:
+            return "No stalls above %.2fs recorded." % self.threshold
+
+        sites = {}
+        for record in records:
+            count, total, longest = sites.get(record.site, (0, 0.0, 0.0))
+            sites[record.site] = (count + 1, total + record.duration,
+                                  max(longest, record.duration))
+
+        lines = ["%d stalls above %.2fs, %.2fs in total" %
+                 (len(records), self.threshold,
+                  sum(r.duration for r in records)),
+                 "",
+                 "%8s %10s %10s  %s" % ("count", "total", "max", "site")]
+        for site, (count, total, longest) in sorted(
+                sites.items(), key=lambda item: item[1][1], reverse=True):
+            lines.append("%8d %9.2fs %9.2fs  %s" % (count, total, longest,
+                                                     site))
+
+        last = records[-1]
+        lines.extend(["", "Last stall (%.2fs at %s):" %
+                      (last.duration, time.ctime(last.start)),
+                      "".join(traceback.format_list(last.stack))])
+        return "\n".join(lines)
+
+
+def setup():
+    """
+    Starts the watchdog. Has to be called from the main thread.
+    """
+    global g_watchdog
+    logger = logging.getLogger('sgtk.syntheyes.watchdog')
+
+    try:
+        interval = float(os.getenv(WATCHDOG_INTERVAL, '0.5'))
+    except ValueError:
+        logger.error("Error setting interval from %s: %s", WATCHDOG_INTERVAL,
+                     os.getenv(WATCHDOG_INTERVAL))
+        interval = 0.5
+
+    try:
+        threshold = float(os.getenv(WATCHDOG_THRESHOLD, '0.5'))
+    except ValueError:
+        logger.error("Error setting threshold from %s: %s",
+                     WATCHDOG_THRESHOLD, os.getenv(WATCHDOG_THRESHOLD))
+        threshold = 0.5
+
+    if threshold <= 0:
+        logger.debug("Watchdog disabled")
+        return None
+
+    g_watchdog = Watchdog(interval, threshold)
+    g_watchdog.start()
+    return g_watchdog
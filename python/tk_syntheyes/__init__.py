@@ -9,3 +9,7 @@
 # reserved by Sebastian Kral.
 
 from .panel_generation import PanelGenerator
+from .dialog_prewarm import DialogPrewarmer
+from .shotgun_cache import ShotgunCache
+from .plate_prefetch import PlatePrefetcher
+from .session_binding import SessionBinder
@@ -0,0 +1,278 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Searchable command palette for the SGTK panel
+
+Commands are indexed by the trigrams and word prefixes of their name, app
+display name and type. Results are ranked by how well they match and how
+often and how recently the artist used them. The result list is a QListView
+over a model that is filled in batches while scrolling, so no widget is
+created per command.
+"""
+import bisect
+import math
+import re
+import time
+
+from PySide import QtCore
+from PySide import QtGui
+
+from .usage_stats import UsageStats
+
+TOKEN_REGEX = re.compile(r"\w+", re.UNICODE)
+# rows added to the result list at a time while scrolling
+FETCH_BATCH = 50
+# share of a word's trigrams a command needs for a fuzzy match
+MIN_TRIGRAM_SHARE = 0.5
+RECENT_SECONDS = 24 * 60 * 60
+
+
+def tokenize(text):
+    return TOKEN_REGEX.findall((text or "").lower())
+
+
+def trigrams(word):
+    # the leading space makes matches at the start of a word count more
+    padded = " %s" % word
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class CommandEntry(object):
+    __slots__ = ("name", "callback", "app_name", "type", "words")
+
+    def __init__(self, name, callback, app_name, type):
+        self.name = name
+        self.callback = callback
+        self.app_name = app_name
+        self.type = type
+        self.words = tokenize(" ".join([name, app_name or "", type or ""]))
+
+
+class CommandIndex(object):
+    """
+    Trigram and prefix index over command entries
+    """
+    def __init__(self):
+        self.entries = []
+        self._trigrams = {}
+        self._words = {}
+        self._sorted_words = []
+
+    def add(self, entry):
+        position = len(self.entries)
+        self.entries.append(entry)
+        for word in set(entry.words):
+            positions = self._words.get(word)
+            if positions is None:
+                positions = self._words[word] = set()
+                bisect.insort(self._sorted_words, word)
+            positions.add(position)
+            for trigram in trigrams(word):
+                self._trigrams.setdefault(trigram, set()).add(position)
+
+    def search(self, text):
+        """
+        Returns a dict of entry position -> match score. Every word of text
+        has to match a word of the command by prefix or, for words of three
+        letters and more, fuzzily by shared trigrams.
+        """
+        scores = None
+        for word in tokenize(text):
+            word_scores = self._match_word(word)
+            if scores is None:
+                scores = word_scores
+            else:
+                scores = dict((position, score + word_scores[position])
+                              for position, score in scores.items()
+                              if position in word_scores)
+            if not scores:
+                return {}
+        return scores or {}
+
+    def _match_word(self, word):
+        scores = {}
+        if len(word) >= 3:
+            word_trigrams = trigrams(word)
+            hits = {}
+            for trigram in word_trigrams:
+                for position in self._trigrams.get(trigram, ()):
+                    hits[position] = hits.get(position, 0) + 1
+            for position, count in hits.items():
+                share = float(count) / len(word_trigrams)
+                if share >= MIN_TRIGRAM_SHARE:
+                    scores[position] = share
+
+        # prefix matches beat fuzzy ones
+        start = bisect.bisect_left(self._sorted_words, word)
+        for indexed in self._sorted_words[start:]:
+            if not indexed.startswith(word):
+                break
+            bonus = 2.0 if indexed == word else 1.5
+            for position in self._words[indexed]:
+                scores[position] = max(scores.get(position, 0), bonus)
+        return scores
+
+
+class CommandModel(QtCore.QAbstractListModel):
+    """
+    List model over the ranked results, rows are made available in batches
+    as the view scrolls
+    """
+    EntryRole = QtCore.Qt.UserRole + 1
+
+    def __init__(self, parent=None):
+        super(CommandModel, self).__init__(parent)
+        self._results = []
+        self._loaded = 0
+        self._busy = set()
+
+    def set_results(self, results):
+        self.beginResetModel()
+        self._results = results
+        self._loaded = min(FETCH_BATCH, len(results))
+        self.endResetModel()
+
+    def set_busy(self, name, busy):
+        if busy:
+            self._busy.add(name)
+        else:
+            self._busy.discard(name)
+        for row in range(self._loaded):
+            if self._results[row].name == name:
+                index = self.index(row)
+                self.dataChanged.emit(index, index)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._loaded
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self._loaded < len(self._results)
+
+    def fetchMore(self, parent):
+        if parent.isValid():
+            return
+        count = min(FETCH_BATCH, len(self._results) - self._loaded)
+        self.beginInsertRows(QtCore.QModelIndex(), self._loaded,
+                             self._loaded + count - 1)
+        self._loaded += count
+        self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self._loaded:
+            return None
+        entry = self._results[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            text = entry.name
+            if entry.app_name and entry.app_name != entry.name:
+                text = "%s - %s" % (entry.name, entry.app_name)
+            if entry.name in self._busy:
+                text = "%s (running...)" % text
+            return text
+        if role == QtCore.Qt.ToolTipRole:
+            return "%s (%s)" % (entry.app_name or "Other Items", entry.type)
+        if role == self.EntryRole:
+            return entry
+        return None
+
+
+class CommandPalette(QtGui.QWidget):
+    """
+    Search field and result list for the commands of the panel.
+
+    run_fn(name, callback) is called to run the chosen command.
+    """
+    def __init__(self, run_fn, parent=None):
+        super(CommandPalette, self).__init__(parent)
+        self._run_fn = run_fn
+        self._index = CommandIndex()
+        self._usage_stats = UsageStats("commands")
+        self._usage = None
+
+        layout = QtGui.QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.search = QtGui.QLineEdit(self)
+        self.search.setPlaceholderText("Search commands...")
+        self.search.installEventFilter(self)
+        layout.addWidget(self.search)
+
+        self.model = CommandModel(self)
+        self.view = QtGui.QListView(self)
+        self.view.setUniformItemSizes(True)
+        self.view.setModel(self.model)
+        self.view.setMinimumHeight(200)
+        layout.addWidget(self.view)
+
+        self.search.textChanged.connect(self.refresh)
+        self.search.returnPressed.connect(self._run_current)
+        self.view.activated.connect(self._run_index)
+
+        # refresh once after a batch of commands has been added
+        self._refresh_timer = QtCore.QTimer(self)
+        self._refresh_timer.setSingleShot(True)
+        self._refresh_timer.timeout.connect(self.refresh)
+
+    def add_command(self, name, callback, app_name=None, command_type=None):
+        self._index.add(CommandEntry(name, callback, app_name,
+                                     command_type or "default"))
+        self._refresh_timer.start(0)
+
+    def set_busy(self, name, busy):
+        self.model.set_busy(name, busy)
+
+    def refresh(self):
+        """
+        Updates the results for the current search text
+        """
+        if self._usage is None:
+            self._usage = dict(self._usage_stats.most_used())
+        text = self.search.text()
+        entries = self._index.entries
+        if tokenize(text):
+            matches = self._index.search(text).items()
+        else:
+            matches = [(position, 0.0) for position in range(len(entries))]
+
+        now = time.time()
+        ranked = []
+        for position, score in matches:
+            entry = entries[position]
+            usage = self._usage.get(entry.name)
+            if usage:
+                score += 0.5 * math.log(1 + usage["count"])
+                if now - usage["last_used"] < RECENT_SECONDS:
+                    score += 0.5
+            ranked.append((-score, entry.name.lower(), entry))
+        ranked.sort(key=lambda item: item[:2])
+        self.model.set_results([item[2] for item in ranked])
+        if ranked:
+            self.view.setCurrentIndex(self.model.index(0))
+
+    def eventFilter(self, obj, event):
+        # move through the results without leaving the search field
+        if obj is self.search and event.type() == QtCore.QEvent.KeyPress:
+            if event.key() in (QtCore.Qt.Key_Up, QtCore.Qt.Key_Down,
+                               QtCore.Qt.Key_PageUp, QtCore.Qt.Key_PageDown):
+                QtGui.QApplication.sendEvent(self.view, event)
+                return True
+        return super(CommandPalette, self).eventFilter(obj, event)
+
+    def _run_current(self):
+        self._run_index(self.view.currentIndex())
+
+    def _run_index(self, index):
+        if not index.isValid():
+            return
+        entry = self.model.data(index, CommandModel.EntryRole)
+        self._run_fn(entry.name, entry.callback)
+        # rank by the new usage next time
+        self._usage = None
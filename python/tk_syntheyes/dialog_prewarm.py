@@ -0,0 +1,209 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Idle-time prewarming of frequently used app dialogs
+"""
+import hashlib
+import importlib
+import os
+import sys
+import time
+
+from PySide import QtCore
+from PySide import QtGui
+
+from .usage_stats import UsageStats
+
+# Delay after startup before the first dialog is built
+STARTUP_DELAY = 2000
+# Delay between two dialogs, lets the event loop breathe in between
+SLICE_INTERVAL = 250
+
+
+class DialogPrewarmer(QtCore.QObject):
+    """
+    Builds the dialogs an artist opens most often while the event loop is
+    idle, so that show_dialog can hand back a ready made instance.
+
+    Only dialogs that have been shown without extra constructor arguments
+    are considered, as those are the only ones that can be rebuilt from the
+    recorded usage statistics alone.
+    """
+    def __init__(self, engine, limit):
+        super(DialogPrewarmer, self).__init__()
+        self._engine = engine
+        self._limit = limit
+        self._stats = UsageStats("dialogs")
+        self._pending = []
+        self._prewarmed = {}
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.timeout.connect(self._process_next)
+
+    ############################################################################
+    # public methods
+
+    def record(self, title, bundle, widget_class):
+        """
+        Records that a dialog has been shown
+        """
+        info = self._describe(title, bundle, widget_class)
+        if info is None:
+            return
+        self._stats.record(self._key(info), **info)
+
+    def start(self):
+        """
+        Queues the most used dialogs and starts building them when idle
+        """
+        if self._limit <= 0:
+            return
+        self._pending = [e for (_, e) in self._stats.most_used(self._limit)]
+        if self._pending:
+            self._engine.log_debug("Prewarming %d dialogs", len(self._pending))
+            self._timer.start(STARTUP_DELAY)
+
+    def stop(self):
+        """
+        Stops prewarming and discards any dialogs that were not used
+        """
+        self._timer.stop()
+        self._pending = []
+        for (dialog, widget) in self._prewarmed.values():
+            dialog.close()
+            widget.deleteLater()
+            dialog.deleteLater()
+        self._prewarmed = {}
+
+    def take(self, title, bundle, widget_class):
+        """
+        Returns a prewarmed (dialog, widget) tuple or None. A prewarmed
+        dialog is handed out only once.
+        """
+        return self._prewarmed.pop((title, bundle, widget_class), None)
+
+    ############################################################################
+    # internal
+
+    def _process_next(self):
+        # keep going at a faster pace after the startup delay
+        self._timer.setInterval(SLICE_INTERVAL)
+
+        app = QtGui.QApplication.instance()
+        if (app.hasPendingEvents() or app.activePopupWidget() or
+                app.mouseButtons() != QtCore.Qt.NoButton):
+            # not idle, try again on the next slice
+            return
+
+        if not self._pending:
+            self._timer.stop()
+            return
+
+        info = self._pending.pop(0)
+        try:
+            self._build(info)
+        except Exception:
+            self._engine.log_exception("Could not prewarm dialog %s",
+                                       info.get("title"))
+
+    def _build(self, info):
+        bundle = self._find_bundle(info["bundle"])
+        if bundle is None:
+            return
+        widget_class = self._find_class(bundle, info["module"],
+                                        info["class_name"])
+        if widget_class is None:
+            return
+
+        title = info["title"]
+        key = (title, bundle, widget_class)
+        if key in self._prewarmed:
+            return
+
+        start = time.time()
+        dialog, widget = self._engine._create_dialog_with_widget(title,
+                                                                 bundle,
+                                                                 widget_class)
+        dialog.hide()
+        self._prewarmed[key] = (dialog, widget)
+        self._engine.log_debug("Prewarmed dialog '%s' in %.3fs", title,
+                               time.time() - start)
+
+    def _find_bundle(self, name):
+        if name == self._engine.name:
+            return self._engine
+        return self._engine.apps.get(name)
+
+    def _find_class(self, bundle, module_path, class_name):
+        """
+        Finds a widget class of a bundle by the path of its module relative
+        to the bundle location. Bundle modules are imported under a per
+        session name by Toolkit, so they can't be looked up by module name.
+        """
+        root = os.path.normpath(bundle.disk_location)
+        source = os.path.join(root, module_path)
+
+        module = None
+        for candidate in sys.modules.values():
+            if _module_source(candidate) == source:
+                module = candidate
+                break
+
+        if module is None:
+            # not loaded yet, import it relative to its loaded top level
+            # package
+            parts = os.path.splitext(module_path)[0].split(os.sep)
+            if len(parts) < 3:
+                # only modules below a package of the bundle can be imported
+                return None
+            package_dir = os.path.join(root, parts[0], parts[1])
+            package_init = os.path.join(package_dir, "__init__.py")
+            for candidate in sys.modules.values():
+                if _module_source(candidate) == package_init:
+                    name = ".".join([candidate.__name__] + parts[2:])
+                    module = importlib.import_module(name)
+                    break
+
+        return getattr(module, class_name, None)
+
+    def _describe(self, title, bundle, widget_class):
+        if bundle is self._engine:
+            bundle_name = self._engine.name
+        else:
+            bundle_name = getattr(bundle, "instance_name", None)
+        module = sys.modules.get(widget_class.__module__)
+        source = _module_source(module)
+        root = os.path.normpath(getattr(bundle, "disk_location", ""))
+        if not bundle_name or not source or not source.startswith(root):
+            return None
+
+        return {"title": title,
+                "bundle": bundle_name,
+                "module": os.path.relpath(source, root),
+                "class_name": widget_class.__name__}
+
+    def _key(self, info):
+        identity = "|".join([info["bundle"], info["module"],
+                             info["class_name"], info["title"]])
+        return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+
+def _module_source(module):
+    """
+    Returns the normalized path to the .py file of a module or None
+    """
+    path = getattr(module, "__file__", None)
+    if not path:
+        return None
+    path = os.path.normpath(path)
+    if path.endswith((".pyc", ".pyo")):
+        path = path[:-1]
+    return path
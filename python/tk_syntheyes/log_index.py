@@ -0,0 +1,193 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+In-memory inverted index over log records for the log console
+
+Records are indexed by the words of their message, their logger (including
+all parent loggers), their level and their thread. Indexing happens on a
+background thread; queries are answered from the index under a short lock.
+"""
+import bisect
+import logging
+import Queue
+import re
+import threading
+
+TOKEN_REGEX = re.compile(r"\w+", re.UNICODE)
+MAX_RECORDS = 200000
+# prefixes shorter than this only match whole words, a one letter prefix
+# would match half the index
+MIN_PREFIX = 2
+
+
+def tokenize(text):
+    return TOKEN_REGEX.findall(text.lower())
+
+
+class LogRecordEntry(object):
+    __slots__ = ("id", "level", "logger", "thread", "text", "html")
+
+    def __init__(self, id, level, logger, thread, text, html):
+        self.id = id
+        self.level = level
+        self.logger = logger
+        self.thread = thread
+        self.text = text
+        self.html = html
+
+
+class _Postings(object):
+    """
+    The index structures, replaced as a whole when old records are dropped
+    """
+    def __init__(self):
+        self.records = []
+        self.tokens = {}
+        self.sorted_tokens = []
+        self.levels = {}
+        self.loggers = {}
+        self.threads = {}
+
+    def add(self, entry):
+        self.records.append(entry)
+        for token in set(tokenize(entry.text)):
+            ids = self.tokens.get(token)
+            if ids is None:
+                ids = self.tokens[token] = []
+                bisect.insort(self.sorted_tokens, token)
+            ids.append(entry.id)
+        self.levels.setdefault(entry.level, []).append(entry.id)
+        parts = entry.logger.split(".")
+        for index in range(1, len(parts) + 1):
+            name = ".".join(parts[:index])
+            self.loggers.setdefault(name, []).append(entry.id)
+        self.threads.setdefault(entry.thread, []).append(entry.id)
+
+
+class LogIndex(object):
+    def __init__(self, max_records=MAX_RECORDS):
+        self.max_records = max_records
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._postings = _Postings()
+        self._next_id = 0
+        self._queue = Queue.Queue()
+        thread = threading.Thread(target=self._run, name="LogIndexThread")
+        thread.daemon = True
+        thread.start()
+
+    def add(self, level, logger, thread, text, html):
+        """
+        Queues a record for indexing. Safe to call from any thread.
+        """
+        self._queue.put((level, logger, thread, text, html))
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            # index everything that piled up in one go
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+
+            with self._lock:
+                for item in items:
+                    self._postings.add(LogRecordEntry(self._next_id, *item))
+                    self._next_id += 1
+                self.generation += 1
+                records = self._postings.records
+
+            if len(records) > self.max_records:
+                self._trim()
+
+    def _trim(self):
+        """
+        Drops the oldest fifth of the records. The index is rebuilt outside
+        the lock; new records wait in the queue meanwhile.
+        """
+        with self._lock:
+            records = self._postings.records
+        keep = records[len(records) // 5:]
+        postings = _Postings()
+        for entry in keep:
+            postings.add(entry)
+        with self._lock:
+            self._postings = postings
+            self.generation += 1
+
+    def __len__(self):
+        return len(self._postings.records)
+
+    def threads(self):
+        with self._lock:
+            return sorted(self._postings.threads.keys())
+
+    def query(self, text="", level=logging.NOTSET, logger="", thread="",
+              limit=2000):
+        """
+        Returns the newest matching records, oldest first, and the total
+        number of matches.
+
+        All words of text have to be in the message; the last word also
+        matches as a prefix, for incremental search while typing. logger
+        matches the logger and all its children.
+        """
+        words = tokenize(text)
+        with self._lock:
+            postings = self._postings
+            candidates = []
+
+            for word in words[:-1]:
+                candidates.append(postings.tokens.get(word, ()))
+            if words:
+                candidates.append(self._prefix_ids(postings, words[-1]))
+            if logger:
+                candidates.append(postings.loggers.get(logger, ()))
+            if thread:
+                candidates.append(postings.threads.get(thread, ()))
+            if level > logging.NOTSET:
+                ids = []
+                for record_level, level_ids in postings.levels.items():
+                    if record_level >= level:
+                        ids.extend(level_ids)
+                candidates.append(ids)
+
+            records = postings.records
+            if not candidates:
+                matches = records
+                total = len(records)
+            else:
+                # intersect starting with the smallest set
+                candidates.sort(key=len)
+                ids = set(candidates[0])
+                for other in candidates[1:]:
+                    if not ids:
+                        break
+                    ids.intersection_update(other)
+                total = len(ids)
+                first_id = records[0].id if records else 0
+                newest = sorted(ids)[-limit:]
+                matches = [records[i - first_id] for i in newest]
+        return matches[-limit:], total
+
+    def _prefix_ids(self, postings, prefix):
+        if len(prefix) < MIN_PREFIX:
+            return postings.tokens.get(prefix, ())
+        tokens = postings.sorted_tokens
+        start = bisect.bisect_left(tokens, prefix)
+        ids = set()
+        for token in tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            ids.update(postings.tokens[token])
+        return ids
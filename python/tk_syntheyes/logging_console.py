@@ -16,6 +16,18 @@ from syntheyes import callback_event
 from PySide import QtGui
 from PySide import QtCore
 
+from .log_index import LogIndex
+
+# Delay after the last key press before the log is filtered, in milliseconds
+FILTER_DELAY = 150
+# Number of matching records shown at most
+FILTER_LIMIT = 2000
+FILTER_LEVELS = [("All levels", logging.NOTSET),
+                 ("Debug and above", logging.DEBUG),
+                 ("Info and above", logging.INFO),
+                 ("Warnings and above", logging.WARNING),
+                 ("Errors and above", logging.ERROR)]
+
 COLOR_MAP = {
     'CRITICAL': 'indianred',
     '   ERROR': 'indianred',
@@ -35,21 +47,23 @@ append_to_log._tkLog = False
 
 
 class QtLogHandler(logging.Handler):
-    def __init__(self, widget):
+    def __init__(self, widget, index=None):
         logging.Handler.__init__(self)
         self.widget = widget
+        self.index = index
         pattern = "%(asctime)s [%(levelname) 8s] %(message)s"
         self.formatter = logging.Formatter(pattern)
 
     def emit(self, record):
         message = self.formatter.format(record)
+        decoded = None
         clean = 'Unable to decode message'
         for charset in ("utf-8", 'latin-1', 'iso-8859-1', 'us-ascii',
                         'windows-1252'):
             try:
-                clean = cgi.escape(unicode(message,
-                                           charset)).encode('ascii',
-                                                            'xmlcharrefreplace')
+                decoded = unicode(message, charset)
+                clean = cgi.escape(decoded).encode('ascii',
+                                                   'xmlcharrefreplace')
                 break
             except Exception:
                 continue
@@ -58,8 +72,11 @@ class QtLogHandler(logging.Handler):
             if ('[%s]' % k) in clean:
                 clean = '<font color="%s">%s</font>' % (v, clean)
                 break
-        callback_event.send_to_main_thread(append_to_log, self.widget,
-                                           "<pre>%s</pre>" % clean)
+        html = "<pre>%s</pre>" % clean
+        if self.index is not None:
+            self.index.add(record.levelno, record.name, record.threadName,
+                           decoded or u"", html)
+        callback_event.send_to_main_thread(append_to_log, self.widget, html)
 
 
 class LogConsole(QtGui.QWidget):
@@ -68,18 +85,148 @@ class LogConsole(QtGui.QWidget):
 
         self.setWindowTitle('Shotgun SynthEyes Logs')
         self.layout = QtGui.QVBoxLayout(self)
+        self.tabs = QtGui.QTabWidget(self)
+        self.layout.addWidget(self.tabs)
+        self.tabs.currentChanged.connect(self._refresh_report)
+        self.reports = {}
+
+        # the log tab shows either all logs or the filtered records
+        page = QtGui.QWidget(self)
+        page_layout = QtGui.QVBoxLayout(page)
+        page_layout.setContentsMargins(0, 0, 0, 0)
+        page_layout.addLayout(self._create_filter_bar(page))
+        self.views = QtGui.QStackedWidget(page)
+        page_layout.addWidget(self.views)
+        self.tabs.addTab(page, "Log")
+
         self.logs = QtGui.QPlainTextEdit(self)
-        self.layout.addWidget(self.logs)
+        self.results = QtGui.QPlainTextEdit(self)
+        for view in (self.logs, self.results):
+            # configure the text widget
+            view.setLineWrapMode(view.NoWrap)
+            view.setReadOnly(True)
+            self.views.addWidget(view)
 
-        # configure the text widget
-        self.logs.setLineWrapMode(self.logs.NoWrap)
-        self.logs.setReadOnly(True)
+        # records are indexed off the main thread by QtLogHandler
+        self.index = LogIndex()
+        self._filter_generation = None
+        self._filter_timer = QtCore.QTimer(self)
+        self._filter_timer.setSingleShot(True)
+        self._filter_timer.timeout.connect(self._apply_filter)
+        # picks up records arriving while a filter is active
+        self._update_timer = QtCore.QTimer(self)
+        self._update_timer.setInterval(500)
+        self._update_timer.timeout.connect(self._update_filter)
 
         # load up previous size
         self.settings = QtCore.QSettings("Shotgun Software",
                                          "tk-syntheyes.log_console")
         self.resize(self.settings.value("size", QtCore.QSize(800, 400)))
 
+    def _create_filter_bar(self, parent):
+        layout = QtGui.QHBoxLayout()
+        self.search = QtGui.QLineEdit(parent)
+        self.search.setPlaceholderText("Search")
+        self.level = QtGui.QComboBox(parent)
+        for (label, level) in FILTER_LEVELS:
+            self.level.addItem(label, level)
+        self.logger = QtGui.QLineEdit(parent)
+        self.logger.setPlaceholderText("Logger")
+        self.thread = QtGui.QLineEdit(parent)
+        self.thread.setPlaceholderText("Thread")
+        self.matches = QtGui.QLabel(parent)
+
+        layout.addWidget(self.search, 3)
+        layout.addWidget(self.level, 1)
+        layout.addWidget(self.logger, 1)
+        layout.addWidget(self.thread, 1)
+        layout.addWidget(self.matches)
+
+        for edit in (self.search, self.logger, self.thread):
+            edit.textChanged.connect(self._schedule_filter)
+        self.level.currentIndexChanged.connect(self._schedule_filter)
+        return layout
+
+    def _filter_args(self):
+        return dict(text=self.search.text(),
+                    level=self.level.itemData(self.level.currentIndex()),
+                    logger=self.logger.text().strip(),
+                    thread=self.thread.text().strip())
+
+    def _schedule_filter(self, *args):
+        self._filter_timer.start(FILTER_DELAY)
+
+    def _apply_filter(self):
+        args = self._filter_args()
+        if not any(args.values()):
+            self._update_timer.stop()
+            self.matches.setText("")
+            self.views.setCurrentWidget(self.logs)
+            return
+
+        self._filter_generation = self.index.generation
+        records, total = self.index.query(limit=FILTER_LIMIT, **args)
+        self.results.clear()
+        self.results.appendHtml("".join(r.html for r in records))
+        self.results.moveCursor(QtGui.QTextCursor.End)
+        if total > len(records):
+            self.matches.setText("%d matches, showing the last %d" %
+                                 (total, len(records)))
+        else:
+            self.matches.setText("%d matches" % total)
+        self.views.setCurrentWidget(self.results)
+        self._update_timer.start()
+
+    def _update_filter(self):
+        if self.index.generation != self._filter_generation:
+            self._apply_filter()
+
+    def add_report(self, title, report_fn):
+        """
+        Adds a tab showing the text returned by report_fn. The report is
+        refreshed whenever the tab is shown or its refresh button is pressed.
+        """
+        page = QtGui.QWidget(self)
+        layout = QtGui.QVBoxLayout(page)
+        text = QtGui.QPlainTextEdit(page)
+        text.setLineWrapMode(text.NoWrap)
+        text.setReadOnly(True)
+        layout.addWidget(text)
+        refresh = QtGui.QPushButton("Refresh", page)
+        layout.addWidget(refresh, 0, QtCore.Qt.AlignRight)
+
+        self.reports[page] = (text, report_fn)
+        refresh.clicked.connect(lambda: self._refresh_report(
+            self.tabs.indexOf(page)))
+        self.tabs.addTab(page, title)
+
+    def show_report(self, title):
+        """
+        Shows the console with the report tab of the given title
+        """
+        for index in range(self.tabs.count()):
+            if self.tabs.tabText(index) != title:
+                continue
+            if self.tabs.currentIndex() == index:
+                self._refresh_report(index)
+            else:
+                # refreshed by the tab change
+                self.tabs.setCurrentIndex(index)
+            break
+        self.setHidden(False)
+        self.activateWindow()
+        self.raise_()
+
+    def _refresh_report(self, index):
+        page = self.tabs.widget(index)
+        if page not in self.reports:
+            return
+        text, report_fn = self.reports[page]
+        try:
+            text.setPlainText(report_fn())
+        except Exception as e:
+            text.setPlainText("Could not create report: %s" % e)
+
     def closeEvent(self, event):
         self.settings.setValue("size", self.size())
         event.accept()
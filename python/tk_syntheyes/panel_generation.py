@@ -11,20 +11,20 @@
 """
 Panel handling for SynthEyes
 """
-import os
-import sys
-import webbrowser
 import unicodedata
 
+# Number of callbacks profiled by the "Profile Callbacks" button
+PROFILE_CALLBACK_COUNT = 20
+
 
 class PanelGenerator(object):
     """
     Panel generation functionality for SynthEyes
     """
-    def __init__(self, engine):
+    def __init__(self, engine, ui=None):
         self._engine = engine
         self._dialogs = []
-        self._ui = self._engine.ui
+        self._ui = ui or self._engine.ui
         # engine_root_dir = self._engine.disk_location
 
     ############################################################################
@@ -54,7 +54,7 @@ class PanelGenerator(object):
         for cmd in panel_items:
             if cmd.get_type() == "context_menu":
                 # context menu!
-                cmd.add_button()
+                cmd.add_button(self._ui)
             else:
                 # normal menu
                 app_name = cmd.get_app_name()
@@ -65,8 +65,14 @@ class PanelGenerator(object):
                     commands_by_app[app_name] = []
                 commands_by_app[app_name].append(cmd)
 
-        # now add all apps to main panel
-        self._add_app_buttons(commands_by_app)
+        # now add all apps to main panel, large configurations get a
+        # searchable palette instead of a button per command
+        threshold = self._engine.get_setting("command_palette_threshold", 0)
+        command_count = sum(len(cmds) for cmds in commands_by_app.values())
+        if threshold and command_count >= threshold:
+            self._add_app_palette(commands_by_app)
+        else:
+            self._add_app_buttons(commands_by_app)
 
     def destroy_panel(self):
         self._ui.destroy_panel()
@@ -84,6 +90,8 @@ class PanelGenerator(object):
         self._ui.add_button("Jump to Shotgun", self._jump_to_sg)
         self._ui.add_button("Jump to File System", self._jump_to_fs)
         self._ui.add_button("Show Log", self._handle_show_log)
+        self._ui.add_button("Memory", self._handle_show_memory)
+        self._ui.add_button("Profile Callbacks", self._toggle_profiling)
 
     def _handle_show_log(self):
         from sgtk.platform.qt import QtCore
@@ -93,37 +101,46 @@ class PanelGenerator(object):
         win.activateWindow()
         win.raise_()
 
+    def _handle_show_memory(self):
+        """
+        Shows the memory report in the log console and takes a new
+        snapshot in the background
+        """
+        from sgtk.platform.qt import QtCore
+        app = QtCore.QCoreApplication.instance()
+        win = app.property('tk-syntheyes.log_console')
+        win.show_report("Memory")
+
+    def _toggle_profiling(self):
+        """
+        Starts or stops profiling of the next callbacks run in the main
+        thread
+        """
+        from syntheyes import callback_event
+        runner = callback_event.g_callbackRunner
+        if runner.profiling:
+            runner.stop_profiling()
+            self._engine.log_info("Callback profiling stopped")
+        else:
+            runner.start_profiling(PROFILE_CALLBACK_COUNT)
+
     def _jump_to_sg(self):
         """
         Jump to shotgun, launch web browser
         """
+        from syntheyes import launcher
         url = self._engine.context.shotgun_url
-        webbrowser.open(url, autoraise=True)
+        launcher.g_launcher.open_url(url)
 
     def _jump_to_fs(self):
         """
         Jump from context to FS
         """
+        from syntheyes import launcher
         # launch one window for each location on disk
         paths = self._engine.context.filesystem_locations
         for disk_location in paths:
-
-            # get the setting
-            system = sys.platform
-
-            # run the app
-            if system == "linux2":
-                cmd = 'xdg-open "%s"' % disk_location
-            elif system == "darwin":
-                cmd = 'open "%s"' % disk_location
-            elif system == "win32":
-                cmd = 'cmd.exe /C start "Folder" "%s"' % disk_location
-            else:
-                raise Exception("Platform '%s' is not supported." % system)
-
-            exit_code = os.system(cmd)
-            if exit_code != 0:
-                self._engine.log_error("Failed to launch '%s'!" % cmd)
+            launcher.g_launcher.open_path(disk_location)
 
     ############################################################################
     # app panels
@@ -136,14 +153,22 @@ class PanelGenerator(object):
                 # more than one panel entry fort his app
                 # make a sub panel and put all items in the sub panel
                 for cmd in commands_by_app[app_name]:
-                    cmd.add_button()
+                    cmd.add_button(self._ui)
             else:
                 # this app only has a single entry.
                 # display that on the panel
                 # todo: Should this be labelled with the name of the app
                 # or the name of the panel item? Not sure.
                 cmd_obj = commands_by_app[app_name][0]
-                cmd_obj.add_button()
+                cmd_obj.add_button(self._ui)
+
+    def _add_app_palette(self, commands_by_app):
+        """
+        Add all apps to the command palette of the main panel
+        """
+        for app_name in sorted(commands_by_app.keys()):
+            for cmd in commands_by_app[app_name]:
+                cmd.add_to_palette(self._ui)
 
 
 class AppCommand(object):
@@ -202,9 +227,9 @@ class AppCommand(object):
         """
         return self.properties.get("type", "default")
 
-    def add_button(self):
+    def add_button(self, ui=None):
         """
-        Adds an app command to the panel
+        Adds an app command to the panel, the engine's main panel by default
         """
         if "app" not in self.properties:
             return None
@@ -212,4 +237,14 @@ class AppCommand(object):
         app_instance = self.properties["app"]
         engine = app_instance.engine
 
-        engine.ui.add_button(self.name, self.callback)
+        (ui or engine.ui).add_button(self.name, self.callback)
+
+    def add_to_palette(self, ui):
+        """
+        Adds an app command to the command palette of the panel
+        """
+        if "app" not in self.properties:
+            return None
+
+        ui.add_palette_command(self.name, self.callback, self.get_app_name(),
+                               self.get_type())
@@ -0,0 +1,191 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Context driven read-ahead of plate image sequences
+"""
+import os
+import threading
+import time
+
+from syntheyes import tasks
+
+CHUNK_SIZE = 1024 * 1024
+# files read by one prefetch task
+FILES_PER_TASK = 25
+SCAN_QUEUE = "plate_scan"
+READ_QUEUE = "plate_prefetch"
+
+
+class RateLimiter(object):
+    """
+    Caps the combined read rate of all prefetch threads
+    """
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = bytes_per_second
+        self._lock = threading.Lock()
+        self._next = time.time()
+
+    def consume(self, size):
+        if not self.bytes_per_second:
+            return
+        with self._lock:
+            now = time.time()
+            start = max(now, self._next)
+            self._next = start + float(size) / self.bytes_per_second
+        if start > now:
+            time.sleep(start - now)
+
+
+class PlatePrefetcher(object):
+    """
+    Finds the plates of the current context and reads them once, so the
+    OS page cache holds them by the time SynthEyes scrubs or tracks them.
+
+    Plates are found through the templates of the plate_templates setting
+    and by scanning the context's filesystem locations plate_scan_depth
+    levels deep for plate_extensions.
+    """
+    def __init__(self, engine):
+        self._engine = engine
+        self._tasks = []
+        self._lock = threading.Lock()
+        self._total = 0
+        self._done = 0
+        self._reported = 0
+        self._started = None
+        tasks.g_executor.add_queue(SCAN_QUEUE, 1)
+        tasks.g_executor.add_queue(
+            READ_QUEUE, max(1, engine.get_setting("plate_prefetch_threads",
+                                                  4)))
+        self._limiter = RateLimiter(
+            engine.get_setting("plate_prefetch_mbps", 0) * 1024 * 1024)
+
+    ############################################################################
+    # public methods
+
+    def start(self):
+        """
+        Starts prefetching the plates of the current context, cancelling the
+        prefetch of the previous one
+        """
+        self.stop()
+        templates = self._engine.get_setting("plate_templates", [])
+        depth = self._engine.get_setting("plate_scan_depth", 0)
+        if not templates and not depth:
+            return
+        task = tasks.submit(self._scan, self._engine.context, templates,
+                            depth, name="Find plates", queue=SCAN_QUEUE)
+        with self._lock:
+            self._tasks = [task]
+
+    def stop(self):
+        with self._lock:
+            running, self._tasks = self._tasks, []
+        for task in running:
+            task.cancel()
+
+    ############################################################################
+    # background tasks
+
+    def _scan(self, task, context, templates, depth):
+        start = time.time()
+        paths = set()
+        for name in templates:
+            task.check_cancelled()
+            paths.update(self._template_paths(context, name))
+        extensions = tuple(e.lower() for e in self._engine.get_setting(
+            "plate_extensions", []))
+        if depth and extensions:
+            for location in context.filesystem_locations:
+                paths.update(self._scan_location(task, location, depth,
+                                                 extensions))
+
+        files = []
+        budget = self._engine.get_setting("plate_prefetch_max_gb", 0) * \
+            1024 ** 3
+        total = 0
+        for path in sorted(paths):
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            if budget and total + size > budget:
+                self._engine.log_info("Plate prefetch limited to %d of %d "
+                                      "files", len(files), len(paths))
+                break
+            files.append(path)
+            total += size
+        self._engine.log_debug("Found %d plate files (%.1f MB) in %.2fs",
+                               len(files), total / 1048576.0,
+                               time.time() - start)
+        if not files:
+            return
+
+        with self._lock:
+            # stop() might have run while scanning
+            if task.cancelled():
+                return
+            self._total = total
+            self._done = 0
+            self._reported = 0
+            self._started = time.time()
+            for index in range(0, len(files), FILES_PER_TASK):
+                self._tasks.append(tasks.submit(
+                    self._read, files[index:index + FILES_PER_TASK],
+                    name="Prefetch plates", queue=READ_QUEUE))
+
+    def _template_paths(self, context, name):
+        template = self._engine.sgtk.templates.get(name)
+        if template is None:
+            self._engine.log_warning("Unknown plate template %s", name)
+            return []
+        # fields the context doesn't provide, like the frame number, match
+        # all existing files
+        fields = context.as_template_fields(template)
+        return self._engine.sgtk.paths_from_template(template, fields)
+
+    def _scan_location(self, task, location, depth, extensions):
+        paths = []
+        base_depth = location.rstrip(os.sep).count(os.sep)
+        for root, dirs, names in os.walk(location):
+            task.check_cancelled()
+            if root.count(os.sep) - base_depth >= depth:
+                del dirs[:]
+            paths.extend(os.path.join(root, n) for n in names
+                         if n.lower().endswith(extensions))
+        return paths
+
+    def _read(self, task, paths):
+        for path in paths:
+            try:
+                with open(path, "rb") as file_:
+                    while True:
+                        task.check_cancelled()
+                        data = file_.read(CHUNK_SIZE)
+                        if not data:
+                            break
+                        self._limiter.consume(len(data))
+                        self._add_progress(len(data))
+            except (IOError, OSError) as e:
+                self._engine.log_debug("Could not prefetch %s: %s", path, e)
+
+    def _add_progress(self, size):
+        with self._lock:
+            self._done += size
+            percent = self._done * 100 // self._total if self._total else 100
+            if percent < self._reported + 10 and self._done < self._total:
+                return
+            self._reported = percent
+            done, total = self._done, self._total
+            elapsed = max(time.time() - self._started, 0.001)
+        self._engine.log_info("Prefetched %d%% of the plates, %.1f of %.1f "
+                              "MB at %.1f MB/s", percent, done / 1048576.0,
+                              total / 1048576.0, done / 1048576.0 / elapsed)
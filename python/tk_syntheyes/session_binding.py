@@ -0,0 +1,34 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Binding of app dialogs to the SynthEyes session they were opened for
+"""
+from PySide import QtCore
+
+from syntheyes import sessions
+
+
+class SessionBinder(QtCore.QObject):
+    """
+    Binds the main thread to the session of a dialog whenever the dialog
+    becomes the active window. The slots of a dialog only run while the
+    artist works in it, so their SyPy connections and tasks go to the
+    SynthEyes the dialog was opened for.
+    """
+    def __init__(self, dialog, session):
+        super(SessionBinder, self).__init__(dialog)
+        self.session = session
+        dialog.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QtCore.QEvent.WindowActivate:
+            sessions.bind(self.session)
+        return False
@@ -0,0 +1,269 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Context driven Shotgun prefetch with a local disk cache
+"""
+import datetime
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from syntheyes import tasks
+from syntheyes import tracing
+
+# Tokens like {context.entity.id} in prefetch queries are resolved against
+# the engine context
+TOKEN_REGEX = re.compile(r"^\{(context(?:\.\w+)*)\}$")
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+class _FixedOffset(datetime.tzinfo):
+    """
+    Timezone of datetimes read back from the cache
+    """
+    def __init__(self, seconds):
+        self._offset = datetime.timedelta(seconds=seconds)
+
+    def utcoffset(self, dt):
+        return self._offset
+
+    def dst(self, dt):
+        return datetime.timedelta(0)
+
+    def tzname(self, dt):
+        return None
+
+
+def _canonical(value):
+    """
+    Returns value with strings as unicode and entity dicts reduced to their
+    type and id, so equal queries get the same key
+    """
+    if isinstance(value, str):
+        return value.decode("utf-8")
+    if isinstance(value, dict):
+        if "type" in value and "id" in value:
+            return {u"type": _canonical(value["type"]), u"id": value["id"]}
+        return dict((_canonical(k), _canonical(v))
+                    for k, v in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, datetime.datetime):
+        return _encode(value)
+    return value
+
+
+def _encode(value):
+    """
+    Encodes the datetimes of Shotgun results for json
+    """
+    if isinstance(value, datetime.datetime):
+        offset = value.utcoffset()
+        return {"__datetime__": value.strftime(DATETIME_FORMAT),
+                "utc_offset": None if offset is None else
+                offset.days * 86400 + offset.seconds}
+    raise TypeError("%r can't be cached" % (value,))
+
+
+def _decode(obj):
+    if "__datetime__" not in obj:
+        return obj
+    value = datetime.datetime.strptime(obj["__datetime__"], DATETIME_FORMAT)
+    if obj.get("utc_offset") is not None:
+        value = value.replace(tzinfo=_FixedOffset(obj["utc_offset"]))
+    return value
+
+
+class ShotgunCache(object):
+    """
+    Serves Shotgun find queries from a per-project disk cache.
+
+    Apps can use find() instead of querying Shotgun directly; results are
+    fetched once and reused until their time to live expires, also across
+    sessions.
+    """
+    def __init__(self, engine, ttl):
+        self._engine = engine
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._memory = {}
+        self._local = threading.local()
+        self.cache_dir = os.path.join(engine.cache_location, "shotgun_cache")
+
+    ############################################################################
+    # public methods
+
+    def find(self, entity_type, filters, fields=None, order=None, ttl=None):
+        """
+        Same as shotgun.find, served from the cache when possible.
+
+        :param ttl: Seconds a cached result may be old, defaults to the
+                    engine's shotgun_cache_ttl setting
+        """
+        if ttl is None:
+            ttl = self._ttl
+        key = self._key(entity_type, filters, fields, order)
+
+        entry = self._read(key)
+        if entry and time.time() - entry[0] <= ttl:
+            return entry[1]
+
+        with tracing.span("find %s" % entity_type, tracing.SHOTGUN):
+            result = self._shotgun().find(entity_type, filters,
+                                          fields=fields, order=order)
+        self._write(key, result)
+        return result
+
+    def find_one(self, entity_type, filters, fields=None, order=None,
+                 ttl=None):
+        """
+        Same as shotgun.find_one, served from the cache when possible
+        """
+        result = self.find(entity_type, filters, fields, order, ttl)
+        if result:
+            return result[0]
+        return None
+
+    def prefetch(self, queries):
+        """
+        Runs the given queries for the current context in the background so
+        the results are cached by the time apps ask for them
+        """
+        queries = [q for q in (self._resolve(q) for q in queries) if q]
+        if not queries:
+            return None
+        return tasks.submit(self._prefetch, queries, name="Shotgun prefetch",
+                            queue="shotgun_prefetch")
+
+    def clear(self):
+        with self._lock:
+            self._memory = {}
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            os.remove(os.path.join(self.cache_dir, name))
+
+    ############################################################################
+    # internal
+
+    def _prefetch(self, task, queries):
+        start = time.time()
+        for index, query in enumerate(queries):
+            task.check_cancelled()
+            try:
+                self.find(query["entity_type"], query["filters"],
+                          query.get("fields"), query.get("order"),
+                          query.get("ttl"))
+            except Exception as e:
+                self._engine.log_warning("Could not prefetch %s: %s",
+                                         query["entity_type"], e)
+            task.report_progress(float(index + 1) / len(queries))
+        self._engine.log_debug("Prefetched %d Shotgun queries in %.2fs",
+                               len(queries), time.time() - start)
+
+    def _shotgun(self):
+        """
+        Returns a Shotgun connection for the calling thread. The api is not
+        thread safe, so background threads get their own connection.
+        """
+        if isinstance(threading.current_thread(), threading._MainThread):
+            return self._engine.shotgun
+        connection = getattr(self._local, "shotgun", None)
+        if connection is None:
+            from sgtk.util import shotgun
+            connection = shotgun.create_sg_connection()
+            self._local.shotgun = connection
+        return connection
+
+    def _resolve(self, query):
+        """
+        Resolves the context tokens of a configured query. Returns None if
+        the context lacks something the query needs.
+        """
+        try:
+            resolved = dict(query)
+            resolved["entity_type"] = self._resolve_value(
+                query["entity_type"])
+            resolved["filters"] = self._resolve_value(query.get("filters",
+                                                                []))
+        except LookupError:
+            return None
+        if resolved["entity_type"] == "PublishedFile":
+            from sgtk.util import get_published_file_entity_type
+            resolved["entity_type"] = get_published_file_entity_type(
+                self._engine.sgtk)
+        return resolved
+
+    def _resolve_value(self, value):
+        if isinstance(value, (list, tuple)):
+            return [self._resolve_value(v) for v in value]
+        if not isinstance(value, basestring):
+            return value
+        match = TOKEN_REGEX.match(value)
+        if not match:
+            return value
+
+        path = match.group(1).split(".")
+        resolved = self._engine.context
+        for name in path[1:]:
+            if isinstance(resolved, dict):
+                resolved = resolved.get(name)
+            else:
+                resolved = getattr(resolved, name, None)
+            if resolved is None:
+                raise LookupError(value)
+        return resolved
+
+    def _key(self, entity_type, filters, fields, order):
+        identity = json.dumps(_canonical([entity_type, filters,
+                                          sorted(fields or []), order]),
+                              sort_keys=True)
+        return hashlib.sha1(identity).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, "%s.json" % key)
+
+    def _read(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry:
+            return entry
+        try:
+            with open(self._path(key), "rb") as file_:
+                entry = tuple(json.load(file_, object_hook=_decode))
+        except (IOError, ValueError, TypeError):
+            return None
+        with self._lock:
+            self._memory[key] = entry
+        return entry
+
+    def _write(self, key, result):
+        entry = (time.time(), result)
+        with self._lock:
+            self._memory[key] = entry
+        # write next to the target and rename, concurrent sessions never read
+        # half a file
+        temp_path = "%s.%d.tmp" % (self._path(key), os.getpid())
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            with open(temp_path, "wb") as file_:
+                json.dump(entry, file_, default=_encode)
+            if os.name == "nt" and os.path.exists(self._path(key)):
+                os.remove(self._path(key))
+            os.rename(temp_path, self._path(key))
+        except (IOError, OSError, TypeError, ValueError) as e:
+            self._engine.log_warning("Could not cache Shotgun result: %s", e)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
@@ -11,10 +11,19 @@
 from PySide import QtCore
 from PySide import QtGui
 
+from syntheyes import sessions
+from syntheyes import tasks
+from syntheyes import tracing
+
+from ..command_palette import CommandPalette
+from ..usage_stats import UsageStats
+
 
 class Ui_SgtkPanel(QtGui.QDialog):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, session=None):
         super(Ui_SgtkPanel, self).__init__(parent)
+        # the SynthEyes session the commands of this panel talk to
+        self.session = session
 
         self.setMinimumSize(200, 200)
         self.setWindowTitle("SGTK Panel")
@@ -24,6 +33,8 @@ class Ui_SgtkPanel(QtGui.QDialog):
         self.layout.setAlignment(QtCore.Qt.AlignTop)
         self.layout.setSizeConstraint(QtGui.QLayout.SetMinimumSize)
         self.buttons = []
+        self.palette = None
+        self._usage = UsageStats("commands")
 
         # load up previous position
         self.settings = QtCore.QSettings("Shotgun Software",
@@ -38,19 +49,59 @@ class Ui_SgtkPanel(QtGui.QDialog):
 
     def add_button(self, name, command):
         button = QtGui.QPushButton(name, self)
-        button.clicked.connect(command)
+        button.clicked.connect(lambda: self._run_command(name, command))
+        button.setProperty("command_name", name)
         self.buttons.append(button)
         self.layout.addWidget(button)
 
+    def add_palette_command(self, name, command, app_name=None,
+                            command_type=None):
+        """
+        Adds a command to the searchable command palette below the buttons
+        """
+        if self.palette is None:
+            self.palette = CommandPalette(self._run_command, self)
+            self.layout.addWidget(self.palette)
+        self.palette.add_command(name, command, app_name, command_type)
+
+    def _run_command(self, name, command):
+        if self.session is not None:
+            sessions.g_sessions.activate(self.session)
+        self._usage.record(name)
+        # background tasks started by the command are attributed to it, and
+        # the command talks to the SynthEyes of this panel
+        with tracing.span(name, tracing.COMMAND, root=True), \
+                tasks.command_context(name), \
+                sessions.session_context(self.session):
+            command()
+
+    def set_busy(self, name, busy):
+        """
+        Shows whether a command has background tasks running
+        """
+        for button in self.buttons:
+            if button.property("command_name") != name:
+                continue
+            if busy:
+                button.setText("%s (running...)" % name)
+            else:
+                button.setText(name)
+        if self.palette is not None:
+            self.palette.set_busy(name, busy)
+
     def delete_button(self, index):
-        b = self.layout.takeAt(index)
-        self.buttons.pop(index)
-        b.widget().deleteLater()
+        button = self.buttons.pop(index)
+        self.layout.removeWidget(button)
+        button.deleteLater()
 
     def clear_panel(self):
         count = len(self.buttons)
         for index in reversed(range(count)):
             self.delete_button(index)
+        if self.palette is not None:
+            self.layout.removeWidget(self.palette)
+            self.palette.deleteLater()
+            self.palette = None
 
     def destroy_panel(self):
         self.deleteLater()
@@ -0,0 +1,75 @@
+# Copyright (c) 2015 Sebastian Kral
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the MIT License included in this
+# distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the MIT License. All rights not expressly granted therein are
+# reserved by Sebastian Kral.
+
+"""
+Per-user usage statistics for the SynthEyes engine
+"""
+import time
+
+from PySide import QtCore
+
+
+class UsageStats(object):
+    """
+    Counts how often things are used, persisted in the user's settings.
+
+    Entries are grouped (e.g. "dialogs" or "commands") and keyed by an
+    arbitrary string. Every entry stores a use count and the time it was
+    last used.
+    """
+    def __init__(self, group):
+        self._group = group
+        self.settings = QtCore.QSettings("Shotgun Software",
+                                         "tk-syntheyes.usage")
+
+    def record(self, key, **extra):
+        """
+        Records one use of key. Extra values are stored alongside the
+        counters so the entry can be resolved again later.
+        """
+        entry = self.get(key)
+        entry.update(extra)
+        entry["count"] = entry.get("count", 0) + 1
+        entry["last_used"] = time.time()
+
+        self.settings.beginGroup(self._group)
+        self.settings.setValue(key, entry)
+        self.settings.endGroup()
+
+    def get(self, key):
+        """
+        Returns the stored entry for key as a dict
+        """
+        self.settings.beginGroup(self._group)
+        entry = self.settings.value(key)
+        self.settings.endGroup()
+        if not isinstance(entry, dict):
+            return {}
+
+        entry = dict(entry)
+        entry["count"] = int(entry.get("count", 0))
+        entry["last_used"] = float(entry.get("last_used", 0))
+        return entry
+
+    def most_used(self, limit=None):
+        """
+        Returns a list of (key, entry) tuples, most used first
+        """
+        self.settings.beginGroup(self._group)
+        keys = self.settings.childKeys()
+        self.settings.endGroup()
+
+        entries = [(key, self.get(key)) for key in keys]
+        entries = [(k, e) for (k, e) in entries if e.get("count")]
+        entries.sort(key=lambda item: (item[1]["count"],
+                                       item[1]["last_used"]), reverse=True)
+        if limit is not None:
+            entries = entries[:limit]
+        return entries